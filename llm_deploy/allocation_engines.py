@@ -0,0 +1,244 @@
+class MachineBin:
+    """
+    A machine offer together with the models placed on it.
+    """
+
+    def __init__(self, machine, models=None):
+        self.machine = machine
+        self.models = list(models or [])
+
+    @property
+    def id(self):
+        return self.machine['id']
+
+    @property
+    def capacity(self):
+        return self.machine['gpu_total_ram']
+
+    @property
+    def num_gpus(self):
+        return self.machine.get('num_gpus') or 1
+
+    @property
+    def gpu_ram(self):
+        return self.machine.get('gpu_ram') or self.capacity / self.num_gpus
+
+    @property
+    def free(self):
+        return self.capacity - sum(model['size'] for model in self.models)
+
+    @property
+    def cost(self):
+        return self.machine['dph_total']
+
+    def copy(self):
+        return MachineBin(self.machine, self.models)
+
+
+def plan_cost(bins):
+    """ Total price per hour of the machines in a plan. """
+    return sum(machine_bin.cost for machine_bin in bins)
+
+
+class AllocationEngine:
+    """
+    Base class for strategies that place models onto machine offers from an OfferCatalog.
+
+    Engines only decide the placement; the placement rules come from the allocator:
+    `fits(model, machine_bin)` tells whether a model may be added to a machine, and
+    `required_memory(model)` is the GPU memory a new machine needs for the model.
+
+    `allocate` returns the list of used MachineBins and the list of models that could
+    not be placed on any offer.
+    """
+
+    def __init__(self, fits, required_memory):
+        self.fits = fits
+        self.required_memory = required_memory
+
+    def allocate(self, models, catalog):
+        raise NotImplementedError
+
+    def placeable(self, models, catalog):
+        """ Splits models into those that fit at least one offer and those that fit none. """
+        placeable, unallocated = [], []
+        for model in models:
+            if self.cheapest_offer(model, catalog, ()):
+                placeable.append(model)
+            else:
+                print(f"Failed to allocate model: {model['model']}")
+                unallocated.append(model)
+        return placeable, unallocated
+
+    def cheapest_offer(self, model, catalog, used_ids):
+        """
+        Returns the cheapest unused offer that can hold the model, preferring faster machines on ties.
+        The catalog answers with the cheapest offer with enough total GPU RAM; only offers whose GPUs
+        can not hold the model's layout are skipped and asked again.
+        """
+        rejected = set(used_ids)
+        while True:
+            offer = catalog.cheapest(model['size'], exclude=rejected)
+            if offer is None or self.fits(model, MachineBin(offer)):
+                return offer
+            rejected.add(offer['id'])
+
+
+class GreedyEngine(AllocationEngine):
+    """
+    The original strategy: put each model on the first machine with room, otherwise rent the
+    fastest of the ten cheapest offers with enough memory for it.
+    """
+
+    def allocate(self, models, catalog):
+        bins, unallocated, used_ids = [], [], set()
+        for model in models:
+            machine_bin = next((b for b in bins if self.fits(model, b)), None)
+            if machine_bin is None:
+                required = self.required_memory(model)
+                candidates = sorted(
+                    (offer for offer in catalog.with_min_total_ram(required)
+                     if offer['id'] not in used_ids and self.fits(model, MachineBin(offer))),
+                    key=lambda offer: (offer['dph_total'], offer['total_flops'])
+                )[:10]
+                candidates.sort(key=lambda offer: (-offer['total_flops'], offer['dph_total']))
+                if not candidates:
+                    print(f"Failed to allocate model: {model['model']}")
+                    unallocated.append(model)
+                    continue
+                machine_bin = MachineBin(candidates[0])
+                used_ids.add(machine_bin.id)
+                bins.append(machine_bin)
+            machine_bin.models.append(model)
+        return bins, unallocated
+
+
+class FirstFitDecreasingEngine(AllocationEngine):
+    """
+    First-fit decreasing: largest models first, each on the first open machine with room,
+    otherwise on the cheapest offer that can hold it.
+    """
+
+    def allocate(self, models, catalog):
+        models, unallocated = self.placeable(sort_decreasing(models), catalog)
+        bins, used_ids = [], set()
+        for model in models:
+            machine_bin = next((b for b in bins if self.fits(model, b)), None)
+            if machine_bin is None:
+                machine_bin = MachineBin(self.cheapest_offer(model, catalog, used_ids))
+                used_ids.add(machine_bin.id)
+                bins.append(machine_bin)
+            machine_bin.models.append(model)
+        return bins, unallocated
+
+
+class BestFitEngine(AllocationEngine):
+    """
+    Best-fit decreasing: each model goes to the open machine it leaves the least free memory on,
+    otherwise to the cheapest offer that can hold it.
+    """
+
+    def allocate(self, models, catalog):
+        models, unallocated = self.placeable(sort_decreasing(models), catalog)
+        bins, used_ids = [], set()
+        for model in models:
+            candidates = [b for b in bins if self.fits(model, b)]
+            if candidates:
+                machine_bin = min(candidates, key=lambda b: b.free - model['size'])
+            else:
+                machine_bin = MachineBin(self.cheapest_offer(model, catalog, used_ids))
+                used_ids.add(machine_bin.id)
+                bins.append(machine_bin)
+            machine_bin.models.append(model)
+        return bins, unallocated
+
+
+class BranchAndBoundEngine(AllocationEngine):
+    """
+    Exact search for the cheapest plan. Every model is tried on each open machine and on every
+    offer that is not dominated by a cheaper offer with at least as many GPUs of at least the
+    same size (a single large GPU and several small ones are not comparable). Branches that
+    can not beat the best plan found so far are pruned; the first-fit and best-fit plans seed
+    the bound. After `node_limit` search nodes the best plan found so far is returned.
+    """
+
+    def __init__(self, fits, required_memory, node_limit=200000):
+        super().__init__(fits, required_memory)
+        self.node_limit = node_limit
+
+    def allocate(self, models, catalog):
+        models, unallocated = self.placeable(sort_decreasing(models), catalog)
+        # Cheaper offers first, so good plans are found early and prune the rest
+        offers = catalog.by_price()
+
+        seeds = [engine.allocate(models, catalog)[0] for engine in (
+            FirstFitDecreasingEngine(self.fits, self.required_memory),
+            BestFitEngine(self.fits, self.required_memory),
+        )]
+        self.best_bins = min(seeds, key=plan_cost)
+        self.best_cost = plan_cost(self.best_bins)
+        self.nodes = 0
+
+        remaining_sizes = [sum(model['size'] for model in models[i:]) for i in range(len(models) + 1)]
+        self._search(models, offers, 0, [], 0.0, remaining_sizes)
+        if self.nodes >= self.node_limit:
+            print(f"Allocation search stopped after {self.node_limit} nodes; using the best plan found.")
+        return self.best_bins, unallocated
+
+    def _search(self, models, offers, index, bins, cost, remaining_sizes):
+        self.nodes += 1
+        if self.nodes >= self.node_limit or cost >= self.best_cost - 1e-9:
+            return
+        if index == len(models):
+            self.best_bins = [machine_bin.copy() for machine_bin in bins]
+            self.best_cost = cost
+            return
+
+        used_ids = {machine_bin.id for machine_bin in bins}
+        # Lower bound: if the open machines can not hold the remaining models, one more machine is needed
+        if remaining_sizes[index] > sum(max(machine_bin.free, 0) for machine_bin in bins):
+            cheapest = next((offer['dph_total'] for offer in offers if offer['id'] not in used_ids), None)
+            if cheapest is None or cost + cheapest >= self.best_cost - 1e-9:
+                return
+
+        model = models[index]
+        tried = set()
+        for machine_bin in bins:
+            # Machines in the same state lead to the same subtree
+            state = (machine_bin.capacity, machine_bin.gpu_ram, machine_bin.num_gpus, tuple(
+                (m['priority'], m['size'], m.get('server_group'), tuple(sorted((m.get('footprint') or {}).items())))
+                for m in machine_bin.models))
+            if state in tried or not self.fits(model, machine_bin):
+                continue
+            tried.add(state)
+            machine_bin.models.append(model)
+            self._search(models, offers, index + 1, bins, cost, remaining_sizes)
+            machine_bin.models.pop()
+
+        tried_layouts = []
+        for offer in offers:
+            if offer['id'] in used_ids:
+                continue
+            offer_bin = MachineBin(offer)
+            # Skip offers dominated by a cheaper one with at least as many GPUs, each at least as large
+            if any(gpu_ram >= offer_bin.gpu_ram and num_gpus >= offer_bin.num_gpus for gpu_ram, num_gpus in tried_layouts):
+                continue
+            if not self.fits(model, offer_bin):
+                continue
+            tried_layouts.append((offer_bin.gpu_ram, offer_bin.num_gpus))
+            bins.append(MachineBin(offer, [model]))
+            self._search(models, offers, index + 1, bins, cost + offer['dph_total'], remaining_sizes)
+            bins.pop()
+
+
+def sort_decreasing(models):
+    """ High priority models first, larger models first within a priority. """
+    return sorted(models, key=lambda model: (model['priority'] != 'high', -model['size']))
+
+
+ALLOCATION_ENGINES = {
+    'greedy': GreedyEngine,
+    'ffd': FirstFitDecreasingEngine,
+    'best-fit': BestFitEngine,
+    'exact': BranchAndBoundEngine,
+}
@@ -1,48 +1,67 @@
 from llm_deploy.vastai import VastAI
-from llm_deploy.ollama import OllamaInstance
+from llm_deploy.ollama import OllamaInstance, parse_keep_alive, DEFAULT_KEEP_ALIVE
 from llm_deploy.storage_manager import StorageManager
 from llm_deploy.litellm import LiteLLManager
 from llm_deploy.llms_config import LLMsConfig
 from llm_deploy.model_allocator import ModelAllocator
-from llm_deploy.instance_manager import InstanceManager
+from llm_deploy.instance_manager import InstanceManager, DEFAULT_INSTANCE_TTL
 from llm_deploy.model_manager import ModelManager
+from llm_deploy.llm_calculator import LLMCalculator
+from llm_deploy.metadata_cache import MetadataCache, DEFAULT_TTL
+from llm_deploy.ollama_registry import OllamaRegistry
+from llm_deploy.http_client import configure_http_client
+from llm_deploy.reconciler import Reconciler
+from llm_deploy.ollama_server import OllamaServerSettings
+from llm_deploy.utils import print_plan
 
 class AppLogic:
-    def __init__(self, vast_api_key, litellm_api_url):
+    def __init__(self, vast_api_key, litellm_api_url, cache_dir=None, cache_ttl=None, offline=False, registry_url=None, http_timeout=60, http_retries=3, keep_alive=DEFAULT_KEEP_ALIVE,
+                 num_parallel=1, flash_attention=True, kv_cache_type='f16', instance_ttl=DEFAULT_INSTANCE_TTL):
         """
         Initialize the AppLogic class with the VastAI API key.
         """
+        # All API clients share one pooled HTTP transport
+        self.http = configure_http_client(timeout=(10, http_timeout), retries=http_retries)
         self.vast_api_key = vast_api_key
         self.vast = VastAI(vast_api_key)
         self.storage = StorageManager()
         self.llms_config = LLMsConfig()
         self.litellm = LiteLLManager(litellm_api_url)
-        self.instance = InstanceManager(self.vast, self.storage, self.litellm)
-        self.model = ModelManager(self.litellm, self.storage)
+        self.instance = InstanceManager(self.vast, self.storage, self.litellm, cache_ttl=instance_ttl)
+        # Runtime settings of the ollama servers, also used to size the models
+        self.server = OllamaServerSettings(num_parallel, flash_attention, kv_cache_type, parse_keep_alive(keep_alive))
+        self.model = ModelManager(self.litellm, self.storage, keep_alive=self.server.keep_alive)
+        self.cache = MetadataCache(cache_dir, ttl=DEFAULT_TTL if cache_ttl is None else cache_ttl, offline=offline)
+        self.registry = OllamaRegistry(registry_url, cache=self.cache)
+        self.calculator = LLMCalculator(self.cache, registry=self.registry)
 
-    def apply_llms_config(self):
+    def apply_llms_config(self, strategy='exact', dry_run=False, max_workers=4):
         """
-        Apply the LLMs configuration.
+        Apply the LLMs configuration. Only the difference between llms.yaml and the running
+        instances is applied: instances that already serve desired models are kept.
+        :param strategy: Allocation engine used to place models on new machines
+        :param dry_run: Only print the plan
+        :param max_workers: Maximum number of machines provisioned at the same time
+        :return: The plan
         """
-        model_allocator = ModelAllocator(self.vast, self.llms_config)
-        allocated_models, machines = model_allocator.allocate_models()
-        self.log_machine_details(allocated_models, machines)
+        print(f"Ollama server settings: {self.server.describe()}")
+        model_allocator = ModelAllocator(self.vast, self.llms_config, self.calculator, strategy=strategy, server=self.server)
+        reconciler = Reconciler(model_allocator, self.instance, self.model, max_workers=max_workers)
+        plan = reconciler.plan()
+        print_plan(plan)
 
-        models_size = self._calculate_models_size(allocated_models)
-        # creating instances
-        for machine_id, models in allocated_models.items():
-            machine_disk_space = (models_size[machine_id] + 5000) / 1024
-            instance_id, _ = self.instance.create(machine_id, machine_disk_space, True)
-            if not instance_id:
-                print("Failed to create instance.")
-                return None
-            # will pull models for this instance 
-            for model in models:
-                if not self.model.pull(model['model'], instance_id):
-                    print("Failed to pull model.")
-                    return None
+        created = {action['machine_id']: action['models'] for action in plan['actions'] if action['action'] == 'create'}
+        if created:
+            self.log_machine_details(created, model_allocator.machines)
+        if dry_run:
+            return plan
+        if all(action['action'] == 'reuse' for action in plan['actions']):
+            print("Nothing to apply, the instances match llms.yaml.")
+            reconciler.sync_deployments(plan)
+            return plan
 
-        return None
+        reconciler.apply(plan)
+        return plan
 
     def log_machine_details(self, allocated_models, machines):
         print("Machine Details and Allocated Models\n")
@@ -57,19 +76,6 @@ class AppLogic:
                 print(f"  - Name: {model['name']}, Model: {model['model']}, Size: {model['size']} MB")
             print("\n" + "-"*50 + "\n")
 
-    def _calculate_models_size(self, models_dict):
-        # Dictionary to hold the total size of models for each key
-        total_sizes = {}
-        
-        # Iterate through each key and its list of models in the dictionary
-        for key, models in models_dict.items():
-            # Calculate the sum of sizes for the current list of models
-            total_size = sum(model['size'] for model in models)
-            # Assign the total size to the corresponding key in the result dictionary
-            total_sizes[key] = total_size
-        
-        return total_sizes
-
     def get_offers(self, gpu_memory, disk_space, public_ip=True):
         """
         Retrieve offers based on the specified GPU memory.
@@ -92,7 +98,7 @@ class AppLogic:
         :return: Result of the model run
         """
         # Create an instance and prepare it
-        instance_id, ollama_addr = self.instance.create(offer_id, disk_space, public_ip)
+        instance_id, ollama_addr = self.instance.create(offer_id, disk_space, public_ip, self.server.env())
         if not instance_id:
             return False
 
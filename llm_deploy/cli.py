@@ -1,28 +1,54 @@
 import typer
+import itertools
+import time
 from enum import Enum, auto
 from pathlib import Path
+from typing import List, Optional
 
 from llm_deploy.app_logic import AppLogic
 from llm_deploy.config import load_config
-from llm_deploy.utils import print_offer_table, print_instances_table, print_models
+from llm_deploy.utils import print_offer_table, print_instances_table, print_models, print_sweep_table, write_sweep_csv, print_max_context_table, print_http_stats, print_pull_results, print_warmup_results, print_destroy_results
 from llm_deploy.logging_config import setup_logging
+from llm_deploy.llm_calculator import KV_CACHE_BYTES
 
 class OperationMode(Enum):
     CONFIG_MODE = auto()
     MANUAL_MODE = auto()
 
+class AllocationStrategy(str, Enum):
+    greedy = "greedy"
+    ffd = "ffd"
+    best_fit = "best-fit"
+    exact = "exact"
+
 app = typer.Typer()
 
 # Define subcommand groups
 infra_app = typer.Typer(help="Commands for managing infrastructure.")
 models_app = typer.Typer(help="Commands for managing models.")
+cache_app = typer.Typer(help="Commands for managing the local metadata cache.")
 
 # Add subcommand groups to the main app
 app.add_typer(infra_app, name="infra")
 app.add_typer(models_app, name="model")
+app.add_typer(cache_app, name="cache")
 
 config = load_config()
-appl = AppLogic(config['VAST_API_KEY'], config['LITELLM_API_URL'])
+appl = AppLogic(
+    config['VAST_API_KEY'],
+    config['LITELLM_API_URL'],
+    cache_dir=config['CACHE_DIR'],
+    cache_ttl=config['CACHE_TTL'],
+    offline=config['OFFLINE'],
+    registry_url=config['OLLAMA_REGISTRY_URL'],
+    http_timeout=config['HTTP_TIMEOUT'],
+    http_retries=config['HTTP_RETRIES'],
+    keep_alive=config['KEEP_ALIVE'],
+    num_parallel=config['NUM_PARALLEL'],
+    flash_attention=config['FLASH_ATTENTION'],
+    kv_cache_type=config['KV_CACHE_TYPE'],
+    instance_ttl=config['INSTANCE_TTL']
+)
 
 CONFIG_MODE_FILE = "llms.yaml"
 is_config_mode = Path(CONFIG_MODE_FILE).exists()
@@ -49,17 +75,32 @@ def ensure_mode_is(expected_mode: OperationMode):
         mode_str = 'config-mode' if expected_mode == OperationMode.CONFIG_MODE else 'manual-mode'
         raise typer.Exit(f"This command is only available in {mode_str}.")
 
+@app.callback()
+def main_options(
+        ctx: typer.Context,
+        offline: bool = typer.Option(False, "--offline", help="Serve model metadata from the local cache only, even if it is stale."),
+        http_stats: bool = typer.Option(False, "--http-stats", help="Print request, byte and latency counters per endpoint on exit.")):
+    if offline:
+        appl.cache.offline = True
+    if http_stats:
+        ctx.call_on_close(lambda: print_http_stats(appl.http.stats()))
+
 @app.command(help="Applies configuration from llms.yaml. Available in Mode 1.")
-def apply():
+def apply(
+        strategy: AllocationStrategy = typer.Option(AllocationStrategy.exact, "--strategy", help="Allocation engine used to place models on machines."),
+        dry_run: bool = typer.Option(False, "--dry-run", help="Only print the plan of changes."),
+        workers: int = typer.Option(4, "--workers", min=1, help="Maximum number of machines provisioned at the same time.")):
     ensure_mode_is(OperationMode.CONFIG_MODE)
     typer.echo("Applying llms.yaml configurations...")
-    appl.apply_llms_config()
+    appl.apply_llms_config(strategy.value, dry_run, workers)
 
 @app.command(help="Destroys infrastructure based on current state. Available in Mode 1.")
 def destroy():
     ensure_mode_is(OperationMode.CONFIG_MODE)
     typer.echo("Destroying infrastructure and models...")
-    appl.instance.destroy_all()
+    start = time.monotonic()
+    results = appl.instance.destroy_all()
+    print_destroy_results(results, time.monotonic() - start)
 
 @infra_app.command(name="ls", help="Lists all machines.")
 def infra_ls():
@@ -86,30 +127,46 @@ def infra_create(
     typer.echo(f"Creating a machine with: GPU Memory: {gpu_memory} GB, Disk space: {disk} GB")
     try:
         # Assuming `create_instance` has been updated to accept offer_id instead of gpu_memory directly
-        appl.instance.create(chosen_offer['id'], disk, True)
+        appl.instance.create(chosen_offer['id'], disk, True, appl.server.env())
         typer.echo("Machine created successfully.")
     except Exception as e:
         typer.echo(f"Failed to create machine due to an error: {e}")
 
-@infra_app.command(name="destroy", help="Destroys a specified machine. Available in Mode 2.")
-def infra_destroy(machine_id: int):
+@infra_app.command(name="destroy", help="Destroys the specified machines. Available in Mode 2.")
+def infra_destroy(machine_ids: List[int]):
     ensure_mode_is(OperationMode.MANUAL_MODE)
-    typer.echo(f"Destroying machine {machine_id}...")
-    chosen_instance = appl.instance.get_instance_by_id(id)
-    if chosen_instance:
-        typer.echo("You have chosen the following instance:")
-        print_instances_table([chosen_instance])
-    else:
-        typer.echo("No instance found with the specified ID.")
+    instances = {instance['id']: instance for instance in appl.instance.instances()}
+    chosen_instances = [instances[machine_id] for machine_id in machine_ids if machine_id in instances]
+    for machine_id in machine_ids:
+        if machine_id not in instances:
+            typer.echo(f"No instance found with ID {machine_id}.")
+    if not chosen_instances:
         return
 
-    appl.instance.destroy_instance(chosen_instance['id'])
+    typer.echo("You have chosen the following instances:")
+    print_instances_table(chosen_instances)
+    typer.echo(f"Destroying {len(chosen_instances)} machine(s)...")
+    start = time.monotonic()
+    results = appl.instance.destroy_instances([instance['id'] for instance in chosen_instances])
+    print_destroy_results(results, time.monotonic() - start)
 
 @models_app.command(name="deploy", help="Deploys a model to a specified machine. Available in Mode 2.")
-def model_deploy(model_name: str, machine_id: int):
+def model_deploy(
+        model_name: str,
+        machine_id: int,
+        extra_models: List[str] = typer.Option([], "--model", "-m", help="Another model to pull at the same time, can be repeated."),
+        per_host: int = typer.Option(2, "--per-host", min=1, help="Maximum number of concurrent pulls on the machine.")):
     ensure_mode_is(OperationMode.MANUAL_MODE)
-    typer.echo(f"Deploying model {model_name} to machine {machine_id}...")
-    appl.model.pull(model_name, machine_id)
+    if not extra_models:
+        typer.echo(f"Deploying model {model_name} to machine {machine_id}...")
+        appl.model.pull(model_name, machine_id)
+        return
+    model_names = [model_name] + extra_models
+    typer.echo(f"Deploying models {', '.join(model_names)} to machine {machine_id}...")
+    appl.model.per_host_limit = per_host
+    results = appl.model.pull_many([(name, machine_id) for name in model_names])
+    print_pull_results(results)
+    print_warmup_results([result['warm'] for result in results if 'warm' in result])
 
 @models_app.command(name="remove", help="Removes a model from a specified machine. Available in Mode 2.")
 def model_remove(model_name: str, machine_id: int):
@@ -118,8 +175,52 @@ def model_remove(model_name: str, machine_id: int):
     appl.model.remove_model(model_name, machine_id)
 
 @models_app.command(name="ls", help="Lists models across machines, or for a specific machine.")
-def model_ls():
-    print_models(appl.model.models())
+def model_ls(timeout: float = typer.Option(5.0, "--timeout", min=0.1, help="Seconds each machine gets to answer.")):
+    print_models(appl.model.models(appl.instance.instances(), timeout=timeout))
+
+@app.command(help="Calculates memory requirements of a model (ollama tag or GGUF file) over a grid of settings.")
+def calc(
+        model: str,
+        context: List[int] = typer.Option([8192], "--context", "-c", help="Context length, can be repeated."),
+        quant: Optional[List[str]] = typer.Option(None, "--quant", "-q", help="Quantization, can be repeated. Defaults to the model's own."),
+        batch: List[int] = typer.Option([512], "--batch", "-b", help="Batch size, can be repeated."),
+        kv_cache: List[str] = typer.Option(["f16"], "--kv-cache", help="KV cache type (f16, q8_0, q4_0; fp16 or fp8), can be repeated."),
+        vram: Optional[float] = typer.Option(None, "--vram", help="VRAM budget in GB; shows the largest context that fits."),
+        csv_path: Optional[Path] = typer.Option(None, "--csv", help="Writes the results to a CSV file.")):
+    for cache_type in kv_cache:
+        if cache_type not in KV_CACHE_BYTES:
+            raise typer.BadParameter(f"Unknown KV cache type: {cache_type}")
+
+    calculator = appl.calculator
+    model_config, model_quant = calculator.resolve_model_config(model)
+    quants = [q.upper() for q in quant] if quant else [model_quant]
+
+    rows = calculator.sweep_config(model_config, context, quants, batch, kv_cache)
+    print_sweep_table(rows)
+    if csv_path:
+        write_sweep_csv(rows, csv_path)
+        typer.echo(f"Results written to {csv_path}")
+
+    if vram is not None:
+        max_contexts = []
+        for quant_size, bsz, cache_type in itertools.product(quants, batch, kv_cache):
+            max_contexts.append({
+                'quant': quant_size,
+                'batch': bsz,
+                'kv_cache_type': cache_type,
+                'max_context': calculator.max_context(model_config, quant_size, vram, bsz, cache_type)
+            })
+        print_max_context_table(max_contexts, vram)
+
+@cache_app.command(name="clear", help="Removes all cached model metadata.")
+def cache_clear():
+    removed = appl.cache.clear()
+    typer.echo(f"Removed {removed} cached entries from {appl.cache.cache_dir}.")
+
+@cache_app.command(name="prune", help="Removes expired model metadata from the cache.")
+def cache_prune():
+    removed = appl.cache.prune()
+    typer.echo(f"Removed {removed} expired entries from {appl.cache.cache_dir}.")
 
 @app.command(help="Retrieves and displays logs for a specified machine.")
 def logs(machine_id: int, max_logs: int = typer.Option(30)):
@@ -15,7 +15,41 @@ def load_config():
     # Always read LITELLM_API_URL from the environment variable
     litellm_api_url = os.environ.get('LITELLM_API_URL', 'http://localhost:4000')
 
+    # Local cache for Hugging Face metadata lookups
+    cache_dir = os.environ.get('LLM_DEPLOY_CACHE_DIR', '~/.cache/llm-deploy')
+    cache_ttl = int(os.environ.get('LLM_DEPLOY_CACHE_TTL', 7 * 24 * 3600))
+    offline = os.environ.get('LLM_DEPLOY_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+    # Ollama registry used to size models; can point to a local mirror
+    registry_url = os.environ.get('OLLAMA_REGISTRY_URL', 'https://registry.ollama.ai')
+
+    # Shared HTTP transport settings
+    http_timeout = float(os.environ.get('LLM_DEPLOY_HTTP_TIMEOUT', 60))
+    http_retries = int(os.environ.get('LLM_DEPLOY_HTTP_RETRIES', 3))
+
+    # How long deployed models stay loaded after the warm-up, as seconds or a duration like "30m"
+    keep_alive = os.environ.get('LLM_DEPLOY_KEEP_ALIVE', '-1')
+
+    # Ollama server settings of rented machines; models are sized for them
+    num_parallel = int(os.environ.get('LLM_DEPLOY_NUM_PARALLEL', 1))
+    flash_attention = os.environ.get('LLM_DEPLOY_FLASH_ATTENTION', '1').lower() in ('1', 'true', 'yes')
+    kv_cache_type = os.environ.get('LLM_DEPLOY_KV_CACHE_TYPE', 'f16')
+
+    # Seconds a vast instance listing is reused within one command
+    instance_ttl = float(os.environ.get('LLM_DEPLOY_INSTANCE_TTL', 10))
+
     return {
         'VAST_API_KEY': vast_api_key,
-        'LITELLM_API_URL': litellm_api_url
+        'LITELLM_API_URL': litellm_api_url,
+        'CACHE_DIR': cache_dir,
+        'CACHE_TTL': cache_ttl,
+        'OFFLINE': offline,
+        'OLLAMA_REGISTRY_URL': registry_url,
+        'HTTP_TIMEOUT': http_timeout,
+        'HTTP_RETRIES': http_retries,
+        'KEEP_ALIVE': keep_alive,
+        'NUM_PARALLEL': num_parallel,
+        'FLASH_ATTENTION': flash_attention,
+        'KV_CACHE_TYPE': kv_cache_type,
+        'INSTANCE_TTL': instance_ttl
     }
@@ -0,0 +1,316 @@
+import mmap
+import struct
+
+GGUF_MAGIC = b"GGUF"
+GGUF_DEFAULT_ALIGNMENT = 32
+
+# ggml tensor types: id -> (name, elements per block, bytes per block)
+GGML_TYPES = {
+    0: ("F32", 1, 4),
+    1: ("F16", 1, 2),
+    2: ("Q4_0", 32, 18),
+    3: ("Q4_1", 32, 20),
+    6: ("Q5_0", 32, 22),
+    7: ("Q5_1", 32, 24),
+    8: ("Q8_0", 32, 34),
+    9: ("Q8_1", 32, 36),
+    10: ("Q2_K", 256, 84),
+    11: ("Q3_K", 256, 110),
+    12: ("Q4_K", 256, 144),
+    13: ("Q5_K", 256, 176),
+    14: ("Q6_K", 256, 210),
+    15: ("Q8_K", 256, 292),
+    16: ("IQ2_XXS", 256, 66),
+    17: ("IQ2_XS", 256, 74),
+    18: ("IQ3_XXS", 256, 98),
+    19: ("IQ1_S", 256, 50),
+    20: ("IQ4_NL", 32, 18),
+    21: ("IQ3_S", 256, 110),
+    22: ("IQ2_S", 256, 82),
+    23: ("IQ4_XS", 256, 136),
+    24: ("I8", 1, 1),
+    25: ("I16", 1, 2),
+    26: ("I32", 1, 4),
+    27: ("I64", 1, 8),
+    28: ("F64", 1, 8),
+    29: ("IQ1_M", 256, 56),
+    30: ("BF16", 1, 2),
+}
+
+# `general.file_type` values (llama_ftype) -> quantization name used by ollama tags
+GGUF_FILE_TYPES = {
+    0: "F32",
+    1: "F16",
+    2: "Q4_0",
+    3: "Q4_1",
+    7: "Q8_0",
+    8: "Q5_0",
+    9: "Q5_1",
+    10: "Q2_K",
+    11: "Q3_K_S",
+    12: "Q3_K_M",
+    13: "Q3_K_L",
+    14: "Q4_K_S",
+    15: "Q4_K_M",
+    16: "Q5_K_S",
+    17: "Q5_K_M",
+    18: "Q6_K",
+    19: "IQ2_XXS",
+    20: "IQ2_XS",
+    21: "Q2_K_S",
+    22: "IQ3_XS",
+    23: "IQ3_XXS",
+    24: "IQ1_S",
+    25: "IQ4_NL",
+    26: "IQ3_S",
+    27: "IQ3_M",
+    28: "IQ2_S",
+    29: "IQ2_M",
+    30: "IQ4_XS",
+    31: "IQ1_M",
+    32: "BF16",
+}
+
+# Metadata value types: id -> struct format (None for variable sized values)
+_VALUE_FORMATS = {
+    0: "<B",   # UINT8
+    1: "<b",   # INT8
+    2: "<H",   # UINT16
+    3: "<h",   # INT16
+    4: "<I",   # UINT32
+    5: "<i",   # INT32
+    6: "<f",   # FLOAT32
+    7: "<?",   # BOOL
+    8: None,   # STRING
+    9: None,   # ARRAY
+    10: "<Q",  # UINT64
+    11: "<q",  # INT64
+    12: "<d",  # FLOAT64
+}
+_STRING = 8
+_ARRAY = 9
+
+# Arrays longer than this (tokenizer vocabularies, merges, ...) are skipped instead of decoded
+MAX_DECODED_ARRAY_LENGTH = 64
+
+
+class GGUFError(ValueError):
+    """
+    Raised when a file is not a valid GGUF file.
+    """
+
+
+class GGUFTruncatedError(GGUFError):
+    """
+    Raised when the buffer ends before the header and tensor-info table do.
+    """
+
+
+class _Reader:
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.offset = 0
+
+    def unpack(self, fmt):
+        size = struct.calcsize(fmt)
+        if self.offset + size > len(self.buffer):
+            raise GGUFTruncatedError(f"GGUF header is truncated at offset {self.offset}")
+        value = struct.unpack_from(fmt, self.buffer, self.offset)[0]
+        self.offset += size
+        return value
+
+    def skip(self, size):
+        if self.offset + size > len(self.buffer):
+            raise GGUFTruncatedError(f"GGUF header is truncated at offset {self.offset}")
+        self.offset += size
+
+    def string(self):
+        length = self.unpack("<Q")
+        start = self.offset
+        self.skip(length)
+        return bytes(self.buffer[start:self.offset]).decode("utf-8", errors="replace")
+
+    def value(self, value_type):
+        if value_type == _STRING:
+            return self.string()
+        if value_type == _ARRAY:
+            return self.array()
+        if value_type not in _VALUE_FORMATS:
+            raise GGUFError(f"Unknown GGUF metadata value type: {value_type}")
+        return self.unpack(_VALUE_FORMATS[value_type])
+
+    def array(self):
+        item_type = self.unpack("<I")
+        count = self.unpack("<Q")
+        if count <= MAX_DECODED_ARRAY_LENGTH:
+            return [self.value(item_type) for _ in range(count)]
+
+        # Walk over large arrays without decoding their items
+        if item_type == _STRING:
+            for _ in range(count):
+                self.skip(self.unpack("<Q"))
+        elif item_type == _ARRAY:
+            for _ in range(count):
+                self.array()
+        else:
+            self.skip(struct.calcsize(_VALUE_FORMATS[item_type]) * count)
+        return GGUFArray(item_type, count)
+
+
+class GGUFArray:
+    """
+    Placeholder for a metadata array that was too long to decode.
+    """
+
+    def __init__(self, item_type, count):
+        self.item_type = item_type
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return f"GGUFArray(item_type={self.item_type}, count={self.count})"
+
+
+class GGUFFile:
+    """
+    Header, metadata and tensor-info table of a GGUF model file.
+
+    Only the header is parsed; tensor data is never read, so opening a 40 GB
+    file through `from_path` only touches the first few megabytes via mmap.
+    """
+
+    def __init__(self, version, metadata, tensors, data_offset):
+        self.version = version
+        self.metadata = metadata  # Maps metadata key to its value
+        self.tensors = tensors  # List of dicts: name, shape, type, offset, n_elements, n_bytes
+        self.data_offset = data_offset  # Offset of the tensor data section
+
+    @classmethod
+    def from_path(cls, path):
+        """ Parses the header of a GGUF file on disk through mmap. """
+        with open(path, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return cls.from_buffer(buffer)
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        """
+        Parses a GGUF header from a bytes-like object. The buffer may hold only the
+        beginning of the file; GGUFTruncatedError is raised if it is too short.
+        """
+        reader = _Reader(buffer)
+        if bytes(buffer[:4]) != GGUF_MAGIC:
+            if len(buffer) < 4:
+                raise GGUFTruncatedError("GGUF header is truncated at offset 0")
+            raise GGUFError("Not a GGUF file (bad magic)")
+        reader.skip(4)
+
+        version = reader.unpack("<I")
+        if version < 2:
+            raise GGUFError(f"Unsupported GGUF version: {version}")
+        tensor_count = reader.unpack("<Q")
+        kv_count = reader.unpack("<Q")
+
+        metadata = {}
+        for _ in range(kv_count):
+            key = reader.string()
+            metadata[key] = reader.value(reader.unpack("<I"))
+
+        tensors = []
+        for _ in range(tensor_count):
+            name = reader.string()
+            n_dims = reader.unpack("<I")
+            shape = [reader.unpack("<Q") for _ in range(n_dims)]
+            tensor_type = reader.unpack("<I")
+            offset = reader.unpack("<Q")
+            tensors.append(cls._tensor_info(name, shape, tensor_type, offset))
+
+        alignment = metadata.get("general.alignment", GGUF_DEFAULT_ALIGNMENT)
+        data_offset = reader.offset + (-reader.offset % alignment)
+        return cls(version, metadata, tensors, data_offset)
+
+    @staticmethod
+    def _tensor_info(name, shape, tensor_type, offset):
+        if tensor_type not in GGML_TYPES:
+            raise GGUFError(f"Unknown ggml type {tensor_type} for tensor {name}")
+        type_name, block_size, type_size = GGML_TYPES[tensor_type]
+        n_elements = 1
+        for dim in shape:
+            n_elements *= dim
+        return {
+            "name": name,
+            "shape": shape,
+            "type": type_name,
+            "offset": offset,
+            "n_elements": n_elements,
+            "n_bytes": n_elements // block_size * type_size,
+        }
+
+    @property
+    def architecture(self):
+        return self.metadata.get("general.architecture", "llama")
+
+    @property
+    def tensor_bytes(self):
+        """ Exact size of all tensors in bytes. """
+        return sum(tensor["n_bytes"] for tensor in self.tensors)
+
+    @property
+    def parameter_count(self):
+        return sum(tensor["n_elements"] for tensor in self.tensors)
+
+    @property
+    def quant_type(self):
+        """ Quantization name from `general.file_type`, or the most common tensor type. """
+        file_type = self.metadata.get("general.file_type")
+        if file_type in GGUF_FILE_TYPES:
+            return GGUF_FILE_TYPES[file_type]
+        weights = {}
+        for tensor in self.tensors:
+            weights[tensor["type"]] = weights.get(tensor["type"], 0) + tensor["n_bytes"]
+        return max(weights, key=weights.get) if weights else None
+
+    def model_config(self) -> dict:
+        """
+        Translates GGUF metadata into the Hugging Face config.json keys used by LLMCalculator.
+        `parameters` and `model_bytes` come from the tensor-info table.
+        """
+        arch = self.architecture
+
+        def get(key, default=None):
+            value = self.metadata.get(f"{arch}.{key}", default)
+            # Per-layer values (e.g. head_count_kv in some models) are reduced to their maximum
+            if isinstance(value, list):
+                return max(value) if value else default
+            return value
+
+        head_count = get("attention.head_count")
+        config = {
+            "model_type": arch,
+            "hidden_size": get("embedding_length"),
+            "num_attention_heads": head_count,
+            "num_key_value_heads": get("attention.head_count_kv", head_count),
+            "num_hidden_layers": get("block_count"),
+            "max_position_embeddings": get("context_length"),
+            "intermediate_size": get("feed_forward_length"),
+            "parameters": self.parameter_count,
+            "model_bytes": self.tensor_bytes,
+            "quant_size": self.quant_type,
+        }
+        optional_keys = {
+            "head_dim": "attention.key_length",
+            "sliding_window": "attention.sliding_window",
+            "num_local_experts": "expert_count",
+            "num_experts_per_tok": "expert_used_count",
+        }
+        for config_key, gguf_key in optional_keys.items():
+            value = get(gguf_key)
+            if value is not None:
+                config[config_key] = value
+
+        missing = [key for key in ("hidden_size", "num_attention_heads", "num_hidden_layers") if config[key] is None]
+        if missing:
+            raise GGUFError(f"GGUF metadata for architecture '{arch}' is missing: {', '.join(missing)}")
+        return config
@@ -0,0 +1,146 @@
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = (10, 60)  # (connect, read) seconds
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_POOL_SIZE = 16
+
+# Statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Only requests that are safe to repeat are retried on a bad status; renting a machine (PUT) or adding
+# a LiteLLM model (POST) twice would not be. Connection errors are retried for every method.
+RETRY_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "DELETE"])
+
+_ID_PATTERN = re.compile(r"/(\d+|sha256[:-][0-9a-f]+)(?=/|$)")
+
+
+class HTTPClient:
+    """
+    Shared HTTP transport for all API clients.
+
+    A single requests session keeps one connection pool per host, so polling
+    loops and repeated API calls reuse keep-alive connections instead of doing
+    a TCP/TLS handshake each time. Every request gets a default timeout and is
+    retried with exponential backoff on connection errors, 429 and 5xx.
+
+    The client counts requests, errors, bytes and latency per endpoint; see
+    `stats()`.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR, pool_size=DEFAULT_POOL_SIZE):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=RETRY_METHODS,
+            backoff_factor=backoff_factor,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def request(self, method, url, idempotent=False, **kwargs):
+        """
+        Sends a request through the shared session. Pass `idempotent=True` for read-only
+        POST/PUT requests (e.g. searches) so they are retried on 429/5xx as well.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.monotonic()
+        try:
+            response = self.session.request(method, url, **kwargs)
+            attempt = 0
+            while idempotent and method not in RETRY_METHODS and response.status_code in RETRY_STATUSES and attempt < self.retries:
+                time.sleep(self.backoff_factor * 2 ** attempt)
+                attempt += 1
+                response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self._record(method, url, time.monotonic() - start, 0, error=True)
+            raise
+
+        # Streamed bodies are consumed by the caller, so only their announced length is known here
+        if kwargs.get("stream"):
+            size = int(response.headers.get("Content-Length") or 0)
+        else:
+            size = len(response.content)
+        self._record(method, url, time.monotonic() - start, size, error=response.status_code >= 400)
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def stats(self):
+        """
+        Returns per-endpoint counters sorted by total latency: requests, errors, bytes,
+        total and average latency in seconds.
+        """
+        with self._lock:
+            stats = [dict(endpoint=endpoint, **counters) for endpoint, counters in self._stats.items()]
+        for entry in stats:
+            entry["avg_latency"] = entry["latency"] / entry["requests"]
+        return sorted(stats, key=lambda entry: -entry["latency"])
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {}
+
+    def endpoint(self, method, url):
+        """ Groups URLs by host and path, with numeric ids and digests collapsed and the query dropped. """
+        parts = urlsplit(url)
+        path = _ID_PATTERN.sub("/{id}", parts.path)
+        return f"{method} {parts.netloc}{path}"
+
+    def _record(self, method, url, latency, size, error=False):
+        endpoint = self.endpoint(method, url)
+        with self._lock:
+            counters = self._stats.setdefault(endpoint, {"requests": 0, "errors": 0, "bytes": 0, "latency": 0.0})
+            counters["requests"] += 1
+            counters["errors"] += int(error)
+            counters["bytes"] += size
+            counters["latency"] += latency
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """ Returns the process-wide HTTP client, creating it with default settings on first use. """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HTTPClient()
+        return _default_client
+
+
+def configure_http_client(**kwargs):
+    """ Replaces the process-wide HTTP client with one using the given settings. """
+    global _default_client
+    with _default_client_lock:
+        _default_client = HTTPClient(**kwargs)
+        return _default_client
@@ -1,48 +1,99 @@
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 
 from llm_deploy.ollama import OllamaInstance
+from llm_deploy.status_poller import InstanceStatusPoller, is_running
+
+DEFAULT_INSTANCE_TTL = 10  # seconds an instance listing is reused
+DEFAULT_DESTROY_WORKERS = 8
 
 class InstanceManager:
-    def __init__(self, vast, storage, litellm):
+    def __init__(self, vast, storage, litellm, poller=None, cache_ttl=DEFAULT_INSTANCE_TTL):
         self.vast = vast
         self.storage = storage
         self.litellm = litellm
+        # One poller watches all booting instances
+        self.poller = poller or InstanceStatusPoller(vast)
+        # Read-through cache of the vast instance listing, indexed by instance ID
+        self.cache_ttl = cache_ttl
+        self._listing = None  # (fetched at, {instance ID: instance})
+        self._listing_lock = threading.Lock()
+
+    def create(self, offer_id, disk_space, public_ip=True, env=None):
+        """
+        Rents a machine, waits for it to boot and for its Ollama server to answer.
+        The instance is destroyed again if any step fails.
+        :param env: Environment of the Ollama server, see OllamaServerSettings.env
+        :return: (instance ID, Ollama address) or None
+        """
+        instance_id = self.rent(offer_id, disk_space, public_ip, env)
+        if not instance_id:
+            return None
+
+        ollama_addr = self.boot(instance_id, public_ip)
+        if not ollama_addr:
+            print("Destroying instance...")
+            self.vast.destroy_instance(instance_id)
+            return None
+
+        if not self.wait_for_ollama(ollama_addr):
+            print("Destroying instance...")
+            self.vast.destroy_instance(instance_id)
+            return None
 
-    def create(self, offer_id, disk_space, public_ip=True):
-        # Create an instance
+        return instance_id, ollama_addr
+
+    def rent(self, offer_id, disk_space, public_ip=True, env=None):
+        """
+        Creates an instance with the Ollama image on the offered machine.
+        :param env: Environment of the Ollama server
+        :return: Instance ID, or None if vast refused the rental
+        """
         image = "g1ibby/ollama-cloudflared:latest"
         ports = []
         if public_ip:
             image = "ollama/ollama:latest"
             ports = [11434]
-        instance_id = self.vast.create_instance(offer_id, image=image, ports=ports, disk_space=disk_space)
+        instance_id = self.vast.create_instance(offer_id, image=image, ports=ports, disk_space=disk_space, env=env)
+        if not instance_id:
+            print(f"Failed to rent offer {offer_id}.")
+            return None
+        self.invalidate()
         print(f"Created Instance with ID: {instance_id}")
+        return instance_id
 
-        # Monitor instance status
+    def boot(self, instance_id, public_ip=True):
+        """
+        Waits for the instance to run, then stores and returns its Ollama address (None on failure).
+        """
         chosen_instance, _ = self.monitor_instance_status(instance_id)
         if not chosen_instance:
             print("Instance with ollama creation failed.")
-            print("Destroying instance...")
-            self.vast.destroy_instance(instance_id)
             return None
 
         print(f"Instance Status: {chosen_instance['actual_status']}")
+        self.invalidate()
 
         # Get Ollama address
         ollama_addr = self.cloudflared(instance_id) if not public_ip else self.get_instance_address(chosen_instance)
         if not ollama_addr:
             print("Failed to retrieve Ollama address.")
-            self.vast.destroy_instance(instance_id)
             return None
 
         # Save instance details
-        self.storage.save_instance(instance_id, {"ollama_addr": ollama_addr})
+        self.storage.update_instance(instance_id, ollama_addr=ollama_addr)
         print(f"Ollama address: {ollama_addr}")
+        return ollama_addr
 
-        # Create an instance of the OllamaInstance class
+    def wait_for_ollama(self, ollama_addr):
+        """
+        Waits for the Ollama server at the address to be 'running'.
+        :return: True if it is running
+        """
         ollama_instance = OllamaInstance(ollama_addr)
-        # Wait for Ollama server to be 'running'
         ollama_running = False
         for attempt in range(10):
             ollama_status = ollama_instance.ollama_status()
@@ -57,33 +108,44 @@ class InstanceManager:
 
         if not ollama_running:
             print("Ollama server did not reach the 'running' status after 10 attempts.")
-            print("Destroying instance...")
-            self.vast.destroy_instance(instance_id)
-            return None
+            return False
 
         print("Ollama Server Status: Running")
-        return instance_id, ollama_addr
+        return True
 
-    def instances(self):
+    def instances(self, refresh=False):
         """
-        List all instances.
+        List all instances. The vast listing is fetched at most once per `cache_ttl` seconds and
+        whenever `invalidate` was called; the Ollama addresses come from the storage on every call.
+        :param refresh: Fetch the listing even if the cached one is fresh
         :return: List of instances
         """
-        instances = self.vast.list_instances()
-        self.storage.sync_instances([inst['id'] for inst in instances])
-        # Inject Cloudflared address into the instances
-        for instance in instances:
-            storage_instance = self.storage.get_instance(instance['id'])
-            instance['ollama_addr'] = storage_instance.get('ollama_addr', '')
-        return instances
+        return [self._with_address(instance) for instance in self._instance_index(refresh).values()]
+
+    def invalidate(self):
+        """ Drops the cached instance listing; called after every change to the instances. """
+        with self._listing_lock:
+            self._listing = None
+
+    def _instance_index(self, refresh=False):
+        with self._listing_lock:
+            if refresh or self._listing is None or time.monotonic() - self._listing[0] > self.cache_ttl:
+                instances = self.vast.list_instances()
+                self.storage.sync_instances([inst['id'] for inst in instances])
+                self._listing = (time.monotonic(), {inst['id']: inst for inst in instances})
+            return self._listing[1]
+
+    def _with_address(self, instance):
+        # Copies, so callers can annotate instances without touching the cache
+        storage_instance = self.storage.get_instance(instance['id']) or {}
+        return dict(instance, ollama_addr=storage_instance.get('ollama_addr', ''))
 
     def destroy_all(self):
         """
-        Destroy all the instances based on state.json file.
+        Destroy all the instances.
+        :return: Results of `destroy_instances`
         """
-        instances = self.instances()
-        for instance in instances:
-            self.destroy_instance(instance['id'])
+        return self.destroy_instances([instance['id'] for instance in self.instances()])
 
     def get_instance_by_id(self, instance_id: int):
         """
@@ -91,10 +153,12 @@ class InstanceManager:
         :param instance_id: Instance ID
         :return: Instance details or None if not found
         """
-        instances = self.instances()
-        chosen_instance = next((inst for inst in instances if inst['id'] == instance_id), None)
+        chosen_instance = self._instance_index().get(instance_id)
+        if chosen_instance is None:
+            return None
+        chosen_instance = self._with_address(chosen_instance)
         # Inject list of models in the chosen_instance based on ollama_addr
-        if chosen_instance and chosen_instance['ollama_addr'] != '':
+        if chosen_instance['ollama_addr'] != '':
             ollama_instance = OllamaInstance(chosen_instance['ollama_addr'])
             chosen_instance['models'] = ollama_instance.models()
         return chosen_instance
@@ -103,50 +167,71 @@ class InstanceManager:
         """
         Destroy a specific instance by its ID.
         :param instance_id: Instance ID
-        :return: Result of the destruction operation
-        """
-        instance = self.get_instance_by_id(instance_id)
-
-        r = self.vast.destroy_instance(instance_id)
-        if r['success']:
-            instances = self.vast.list_instances()
-            self.storage.sync_instances([inst['id'] for inst in instances])
-            self.litellm.remove_all_models_by_api_base(instance['ollama_addr'])
-            print("Instance destroyed successfully.")
-
-    def monitor_instance_status(self, instance_id, retry_count=30, delay=10):
-        for attempt in range(retry_count): 
-            instances = self.instances()
-            chosen_instance = next((inst for inst in instances if inst['id'] == instance_id), None)
-
-            if chosen_instance is None:
-                print("Instance not found.")
-                time.sleep(delay)
-                continue
-
-            actual_status = (chosen_instance.get('actual_status') or '').lower()
-            intended_status = (chosen_instance.get('intended_status') or '').lower()
-            cur_state = (chosen_instance.get('cur_state') or '').lower()
-            status_msg = (chosen_instance.get('status_msg') or '').lower()
-
-            print(f"Instance Status:\nActual: {actual_status}\nIntended: {intended_status}\nCurrent: {cur_state}\nMessage: {status_msg}")
-
-            if actual_status == "running" and intended_status == "running" and cur_state == "running":
-                address = self.get_instance_address(chosen_instance)
-                if address:
-                    return chosen_instance, address
-                else:
-                    print("Failed to retrieve instance address")
-            elif "error" in status_msg:
-                print("Error encountered with the instance.")
-                return None, None
-
-            if attempt < retry_count - 1:
-                print(f"Retrying to get instance status... (Attempt {attempt + 1}/{retry_count})")
-                time.sleep(delay)
-
-        print(f"Instance did not reach the 'running' status after {retry_count} attempts.")
-        return None, None
+        :return: Result of the destruction operation, see `destroy_instances`
+        """
+        return self.destroy_instances([instance_id])[0]
+
+    def destroy_instances(self, instance_ids, max_workers=DEFAULT_DESTROY_WORKERS):
+        """
+        Destroys the instances concurrently, then removes the LiteLLM deployments of all destroyed
+        instances in one pass over the model list.
+        :param instance_ids: Instance IDs
+        :return: A result per ID with `ok`, the failure `reason`, the `seconds` the destroy took, the
+                 `dph_total` it freed, its GPUs and the IDs of the removed `deployments`
+        """
+        # The listing is usually cached by the command that picked the instances. It only describes
+        # them: an instance rented moments ago may be missing from it and is destroyed all the same.
+        index = self._instance_index()
+        results = []
+        for instance_id in instance_ids:
+            instance = index.get(instance_id) or {}
+            results.append({'id': instance_id, 'ok': False, 'reason': None, 'seconds': 0.0, 'deployments': [],
+                            'dph_total': instance.get('dph_total'), 'gpu_name': instance.get('gpu_name'), 'num_gpus': instance.get('num_gpus'),
+                            'ollama_addr': (self.storage.get_instance(instance_id) or {}).get('ollama_addr', '')})
+
+        def destroy(result):
+            start = time.monotonic()
+            try:
+                r = self.vast.destroy_instance(result['id'])
+                result['ok'] = bool(r.get('success'))
+                if not result['ok']:
+                    result['reason'] = r.get('msg') or r.get('error') or "vast refused to destroy the instance"
+            except requests.exceptions.RequestException as e:
+                result['reason'] = str(e)
+            result['seconds'] = time.monotonic() - start
+
+        if results:
+            with ThreadPoolExecutor(max_workers=min(len(results), max_workers)) as executor:
+                list(executor.map(destroy, results))
+            self.invalidate()
+
+        destroyed = [result for result in results if result['ok']]
+        for result in destroyed:
+            self.storage.remove_instance(result['id'])
+        api_bases = {result['ollama_addr'] for result in destroyed if result['ollama_addr']}
+        if api_bases:
+            removed = self.litellm.remove_models_by_api_bases(api_bases)
+            for result in destroyed:
+                result['deployments'] = removed.get(result['ollama_addr'], [])
+        for result in results:
+            if result['ok']:
+                print(f"Instance {result['id']} destroyed successfully.")
+            else:
+                print(f"Failed to destroy instance {result['id']}: {result['reason']}")
+        return results
+
+    def monitor_instance_status(self, instance_id, timeout=300):
+        """
+        Waits until the instance is running and has an address, using the shared status poller.
+        :param timeout: Seconds to wait for the instance
+        :return: (instance, address), or (None, None) on error or timeout
+        """
+        chosen_instance = self.poller.wait(
+            instance_id, timeout, ready=lambda instance: is_running(instance) and self.get_instance_address(instance)
+        )
+        if chosen_instance is None:
+            return None, None
+        return chosen_instance, self.get_instance_address(chosen_instance)
 
     def get_instance_address(self, instance):
         public_ip = instance.get('public_ipaddr', 'N/A')
@@ -173,8 +258,6 @@ class InstanceManager:
                 time.sleep(5)
         if not cloudflared_addr:
             print("Failed to retrieve Cloudflared address.")
-            print("Destroying instance...")
-            self.vast.destroy_instance(instance_id)
             return None
         return cloudflared_addr
 
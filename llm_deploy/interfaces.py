@@ -6,7 +6,7 @@ class VastAIInterface(ABC):
     """
 
     @abstractmethod
-    def get_available_offers(self, gpu_memory=30, min_gpu=1, max_gpu=2, disck_space=40, internet_speed=70):
+    def get_available_offers(self, gpu_memory=30, min_gpu=1, max_gpu=2, disck_space=40, internet_speed=70, result_count=10, public_ip=True, limit=None):
         """
         Retrieves a list of available offers that match specified criteria.
 
@@ -15,17 +15,23 @@ class VastAIInterface(ABC):
         :param min_gpu: Minimum number of GPUs required.
         :param max_gpu: Maximum number of GPUs acceptable.
         :param internet_speed: Minimum internet speed required (in Mbps).
+        :param result_count: Maximum number of offers returned after filtering (None for all).
+        :param public_ip: Whether only offers with a static IP are returned.
+        :param limit: Maximum number of offers requested from the API.
         :return: List of offers matching the criteria.
         """
         pass
 
     @abstractmethod
-    def create_instance(self, machine_id, template_id):
+    def create_instance(self, machine_id, disk_space, image, ports, env=None):
         """
-        Creates a new instance with given machine and template IDs.
+        Creates a new instance on the given machine.
 
         :param machine_id: The ID of the machine to rent.
-        :param template_id: The ID of the template to use for the instance.
+        :param disk_space: Disk space in GB.
+        :param image: Docker image to run.
+        :param ports: Ports to expose.
+        :param env: Environment variables of the container.
         :return: Instance ID of the newly created instance.
         """
         pass
@@ -84,10 +90,12 @@ class OllamaInstanceInterface(ABC):
         pass
 
     @abstractmethod
-    def models(self):
+    def models(self, timeout=None):
         """
         Returns a list of local models.
 
+        :param timeout: Request timeout in seconds, the HTTP client's default if None.
+
         :return: List of local models.
         """
         pass
@@ -101,3 +109,24 @@ class OllamaInstanceInterface(ABC):
         :return: True if the test is successful, False otherwise.
         """
         pass
+
+    @abstractmethod
+    def warm_model(self, model_name, keep_alive, options=None):
+        """
+        Loads a model into memory and generates one token.
+
+        :param model_name: Name of the model to load.
+        :param keep_alive: How long the model stays loaded, in seconds or as a duration ("30m"); negative for forever.
+        :param options: Model options to load it with, such as num_ctx.
+        :return: Dict with `ok`, `error`, `load_seconds`, `first_token_seconds` and `seconds`.
+        """
+        pass
+
+    @abstractmethod
+    def running_models(self):
+        """
+        Returns the models loaded in memory.
+
+        :return: List of running models with their size and VRAM size.
+        """
+        pass
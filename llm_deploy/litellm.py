@@ -1,29 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from llm_deploy.http_client import get_http_client
+
+# Concurrent requests when deleting or adding many deployments
+DEFAULT_MAX_WORKERS = 8
+
+
+def deployment_id(model_identifier, api_base):
+    """ model_info id of a deployment; one per model and server, so servers of the same model do not collide. """
+    return f"{model_identifier}@{api_base}"
+
+
+class DeploymentIndex:
+    """ LiteLLM deployments indexed by api base (then model name) and by model_info id. """
+
+    def __init__(self, deployments):
+        self.by_api_base = {}
+        self.by_id = {}
+        for deployment in deployments:
+            api_base = deployment.get('litellm_params', {}).get('api_base')
+            self.by_api_base.setdefault(api_base, {}).setdefault(deployment.get('model_name'), []).append(deployment)
+            self.by_id[deployment.get('model_info', {}).get('id')] = deployment
+
+    def find(self, model_identifier, api_base):
+        return self.by_api_base.get(api_base, {}).get(model_identifier, [])
+
 
 class LiteLLManager:
-    def __init__(self, api_url="http://localhost:4000"):
+    def __init__(self, api_url="http://localhost:4000", http=None, max_workers=DEFAULT_MAX_WORKERS):
         self.api_url = api_url
+        self.http = http or get_http_client()
+        self.max_workers = max_workers
+
+    def add_model(self, model_identifier, api_base, options=None):
+        """
+        Registers an ollama model; `options` (e.g. num_ctx) are sent with every request routed to it.
+        A model that is already registered for the api base with the same options is left alone, one
+        registered with other options is replaced.
+        :return: Whether the deployment exists afterwards
+        """
+        result = self.reconcile([(model_identifier, api_base, options)], prune=False)
+        return not result['failed']
 
-    def add_model(self, model_identifier, api_base):
+    def _post_deployment(self, model_identifier, api_base, options=None):
         try:
-            response = requests.post(f"{self.api_url}/model/new", json={
+            response = self.http.post(f"{self.api_url}/model/new", json={
                 "model_name": model_identifier,
                 "litellm_params": {
                     "model": f"ollama/{model_identifier}",
-                    "api_base": api_base
+                    "api_base": api_base,
+                    **(options or {})
                 },
                 "model_info": {
-                    "id": model_identifier,
+                    "id": deployment_id(model_identifier, api_base),
                 }
             })
             if response.status_code != 200:
                 print(f"Failed to add model: {response.text}")
+                return False
+            return True
         except requests.exceptions.ConnectionError:
             print(f"Failed to connect to {self.api_url}. Skipping model addition to litellm.")
+            return False
 
     def get_model_names(self):
         try:
-            response = requests.get(f"{self.api_url}/model/info")
+            response = self.http.get(f"{self.api_url}/model/info")
             if response.status_code == 200:
                 models = response.json().get('data', [])
                 return [model['model_name'] for model in models]
@@ -36,28 +79,123 @@ class LiteLLManager:
 
     def remove_model_by_id(self, model_id):
         try:
-            response = requests.post(f"{self.api_url}/model/delete", json={"id": model_id})
+            response = self.http.post(f"{self.api_url}/model/delete", json={"id": model_id})
             if response.status_code != 200:
                 print(f"Failed to remove model: {response.text}")
+                return False
+            return True
         except requests.exceptions.ConnectionError:
             print(f"Failed to connect to {self.api_url}. Skipping model removal from litellm.")
+            return False
 
-    def remove_all_models_by_api_base(self, api_base):
+    def get_deployments(self):
+        """ All deployments from one `/model/info` request, or None if LiteLLM could not be asked. """
         try:
-            response = requests.get(f"{self.api_url}/model/info")
-            if response.status_code == 200:
-                models = response.json().get('data', [])
-                for model in models:
-                    litellm_params = model.get('litellm_params', {})
-                    if 'api_base' in litellm_params and litellm_params['api_base'] == api_base:
-                        try:
-                            self.remove_model_by_id(model['model_info']['id'])
-                        except requests.exceptions.ConnectionError:
-                            print(f"Failed to connect to {self.api_url}. Skipping model removal.")
-                    else:
-                        print(f"Failed to remove model {model['model_info']['id']}. API base mismatch.")
-            else:
-                print("Failed to fetch models for removal")
+            response = self.http.get(f"{self.api_url}/model/info")
         except requests.exceptions.ConnectionError:
-            print(f"Failed to connect to {self.api_url}. Skipping model removal form litellm.")
+            print(f"Failed to connect to {self.api_url}. Skipping model retrieval from litellm.")
+            return None
+        if response.status_code != 200:
+            print(f"Failed to fetch models. Status code: {response.status_code}")
+            return None
+        return response.json().get('data', [])
+
+    def missing(self, desired, deployments):
+        """ The (model, api_base, options) entries of `desired` without a deployment that has those options. """
+        index = DeploymentIndex(deployments)
+        return [entry for entry in desired
+                if not any(self._has_options(deployment, entry[2] or {}) for deployment in index.find(entry[0], entry[1]))]
+
+    def reconcile(self, desired, api_bases=None, deployments=None, prune=True):
+        """
+        Makes the deployments of the given api bases match `desired`, a list of (model, api_base) or
+        (model, api_base, options) tuples. The current deployments are fetched once (unless passed in);
+        only missing deployments are added and, with `prune`, deployments of those api bases that are
+        not desired, duplicated or registered with other options are deleted. The requests run
+        concurrently (deletes before adds), and a second run with the same input does nothing.
+        :param api_bases: Api bases whose deployments are managed; defaults to the ones in `desired`.
+                          Deployments of other api bases are never touched.
+        :return: Dict with the `added` (model, api_base) pairs, the `removed` deployment IDs, the number
+                 of deployments `kept` and the requests that `failed`
+        """
+        desired = {(entry[0], entry[1]): (entry[2] if len(entry) > 2 else None) or {} for entry in desired}
+        api_bases = set(api_bases) if api_bases is not None else {api_base for _, api_base in desired}
+        result = {'added': [], 'removed': [], 'kept': 0, 'failed': []}
+        if deployments is None:
+            deployments = self.get_deployments()
+        if deployments is None:
+            result['failed'] = [('add', model, api_base) for model, api_base in desired]
+            return result
+        index = DeploymentIndex(deployments)
+
+        adds, deletes = [], []
+        for (model, api_base), options in desired.items():
+            if any(self._has_options(deployment, options) for deployment in index.find(model, api_base)):
+                result['kept'] += 1
+            else:
+                adds.append((model, api_base, options))
+                # A deployment with other options holds the id the new one gets; it is replaced even without `prune`
+                if deployment_id(model, api_base) in index.by_id:
+                    deletes.append(deployment_id(model, api_base))
+        if prune:
+            for api_base in api_bases:
+                for model, found in index.by_api_base.get(api_base, {}).items():
+                    deletes += self._surplus(found, model, api_base, desired.get((model, api_base)))
+
+        # Deletes go first: a deployment re-added with new options reuses the id of the one it replaces
+        for jobs in ([('remove', id) for id in dict.fromkeys(deletes)], [('add',) + add for add in adds]):
+            if not jobs:
+                continue
+            with ThreadPoolExecutor(max_workers=min(len(jobs), self.max_workers)) as executor:
+                outcomes = list(executor.map(self._run, jobs))
+            for job, ok in zip(jobs, outcomes):
+                if not ok:
+                    result['failed'].append(job)
+                elif job[0] == 'remove':
+                    result['removed'].append(job[1])
+                else:
+                    result['added'].append((job[1], job[2]))
+        return result
 
+    def _run(self, job):
+        if job[0] == 'remove':
+            return self.remove_model_by_id(job[1])
+        return self._post_deployment(*job[1:])
+
+    def _surplus(self, found, model, api_base, options):
+        """ IDs of the deployments of a model and api base to delete: all but one matching the desired options. """
+        matching = sorted((deployment for deployment in found if self._has_options(deployment, options or {})),
+                          key=lambda deployment: deployment.get('model_info', {}).get('id') != deployment_id(model, api_base))
+        keep = matching[0] if options is not None and matching else None
+        return [deployment['model_info']['id'] for deployment in found
+                if deployment is not keep and deployment.get('model_info', {}).get('id') is not None]
+
+    @staticmethod
+    def _has_options(deployment, options):
+        params = deployment.get('litellm_params', {})
+        return all(params.get(key) == value for key, value in options.items())
+
+    def remove_model(self, model_identifier, api_base):
+        """ Removes every deployment of a model on an api base. :return: The removed deployment IDs """
+        deployments = self.get_deployments() or []
+        ids = [deployment['model_info']['id'] for deployment in DeploymentIndex(deployments).find(model_identifier, api_base)]
+        with ThreadPoolExecutor(max_workers=max(1, min(len(ids), self.max_workers))) as executor:
+            return [id for id, ok in zip(ids, executor.map(self.remove_model_by_id, ids)) if ok]
+
+    def remove_models_by_api_bases(self, api_bases, deployments=None):
+        """
+        Removes the deployments of all the given api bases, e.g. of destroyed instances, in one
+        reconcile pass (see `reconcile`).
+        :return: Dict of api base to the IDs of its removed deployments
+        """
+        api_bases = set(api_bases)
+        if deployments is None:
+            deployments = self.get_deployments() or []
+        index = DeploymentIndex(deployments)
+        removed = {api_base: [] for api_base in api_bases}
+        for id in self.reconcile([], api_bases, deployments)['removed']:
+            removed[index.by_id[id]['litellm_params']['api_base']].append(id)
+        return removed
+
+    def remove_all_models_by_api_base(self, api_base):
+        return self.remove_models_by_api_bases([api_base])[api_base]
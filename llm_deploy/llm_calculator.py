@@ -1,22 +1,105 @@
 import requests
 import math
 import json
+import os
+import itertools
+
+from llm_deploy.gguf import GGUFFile
+from llm_deploy.http_client import get_http_client
+from llm_deploy.metadata_cache import MetadataCache, CacheMiss
+from llm_deploy.ollama_registry import OllamaRegistry
+
+# Alternative config.json spellings used by some architecture families, mapped to the keys used below
+CONFIG_ALIASES = {
+    "hidden_size": ["n_embd", "d_model", "dim"],
+    "num_attention_heads": ["n_head", "n_heads", "num_heads"],
+    "num_hidden_layers": ["n_layer", "n_layers", "num_layers"],
+    "num_key_value_heads": ["num_kv_heads", "n_head_kv", "multi_query_group_num"],
+    "num_local_experts": ["num_experts", "n_routed_experts"],
+    "intermediate_size": ["ffn_hidden_size", "n_inner"],
+}
+
+# Architectures where llama.cpp keeps only the sliding window in the KV cache of local-attention layers.
+# Maps model_type to the layer pattern period: every period-th layer uses global attention.
+# Other models with a `sliding_window` (e.g. mistral) still get a full-context KV cache in llama.cpp.
+SLIDING_WINDOW_PATTERNS = {
+    "gemma2": 2,
+    "gemma3": 6,
+    "gemma3_text": 6,
+    "cohere2": 4,
+}
+
+# VRAM ollama reserves on every CUDA device it loads a model onto (CUDA context, cuBLAS workspace), in bytes
+GPU_OVERHEAD = 457 * 1024 * 1024
+
+# Bytes per KV cache element. f16, q8_0 and q4_0 are the types ollama takes in OLLAMA_KV_CACHE_TYPE; the
+# quantized ones store a 2-byte scale per block of 32. fp16 and fp8 are the older names of the `calc` command.
+KV_CACHE_BYTES = {
+    "f16": 2,
+    "fp16": 2,
+    "fp8": 1,
+    "q8_0": 34 / 32,
+    "q4_0": 18 / 32,
+}
+
+
+# Bits per weight of the GGUF quantizations ollama publishes, from smallest to best quality
+GGUF_QUANTS = {
+    "Q3_K_S": 3.5,
+    "Q3_K_M": 3.91,
+    "Q3_K_L": 4.27,
+    "Q4_0": 4.55,
+    "Q4_K_S": 4.58,
+    "Q4_K_M": 4.85,
+    "Q5_0": 5.54,
+    "Q5_K_S": 5.54,
+    "Q5_K_M": 5.69,
+    "Q6_K": 6.59,
+    "Q8_0": 8.5,
+}
+
+
+def quant_tag(model: str, quant_size: str) -> str:
+    """ The ollama tag of a model in a quantization, e.g. llama3:8b-instruct and Q4_K_M give llama3:8b-instruct-q4_K_M. """
+    return f"{model}-{quant_size[0].lower()}{quant_size[1:]}"
+
+
+def kv_cache_name(kv_cache_type) -> str:
+    """ Name of a KV cache type; the former boolean flag stands for fp8 (True) or fp16 (False). """
+    if isinstance(kv_cache_type, bool):
+        return "fp8" if kv_cache_type else "fp16"
+    if kv_cache_type not in KV_CACHE_BYTES:
+        raise ValueError(f"Unknown KV cache type: {kv_cache_type}")
+    return kv_cache_type
+
+
+def kv_cache_bytes(kv_cache_type) -> float:
+    """ Bytes per KV cache element of a cache type. """
+    return KV_CACHE_BYTES[kv_cache_name(kv_cache_type)]
 
 class LLMCalculator:
-    def __init__(self):
-        self.gguf_quants = {
-            "Q3_K_S": 3.5,
-            "Q3_K_M": 3.91,
-            "Q3_K_L": 4.27,
-            "Q4_0": 4.55,
-            "Q4_K_S": 4.58,
-            "Q4_K_M": 4.85,
-            "Q5_0": 5.54,
-            "Q5_K_S": 5.54,
-            "Q5_K_M": 5.69,
-            "Q6_K": 6.59,
-            "Q8_0": 8.5,
-        }
+    def __init__(self, cache=None, timeout=30, registry=None, http=None):
+        # Hugging Face lookups go through an on-disk cache so repeated runs skip the network
+        self.cache = cache if cache is not None else MetadataCache()
+        self.timeout = timeout  # Seconds to wait for each Hugging Face response
+        self.http = http or get_http_client()
+        # Ollama tags are sized from their registry manifest first; pass registry=False to only use Hugging Face
+        self.registry = registry if registry is not None else OllamaRegistry(cache=self.cache, timeout=timeout, http=self.http)
+        self.gguf_quants = dict(GGUF_QUANTS)
+
+    def _get(self, url: str) -> tuple:
+        """
+        Performs a GET request through the metadata cache and returns the status code and body.
+        Server errors are raised instead of cached so that they are retried on the next run.
+        """
+        def fetch():
+            response = self.http.get(url, timeout=self.timeout)
+            if response.status_code >= 500 or response.status_code == 429:
+                response.raise_for_status()
+            return {"status": response.status_code, "text": response.text}
+
+        entry = self.cache.get_or_fetch(url, fetch) if self.cache else fetch()
+        return entry["status"], entry["text"]
 
     def fetch_model_size(self, hf_model: str):
         """
@@ -30,13 +113,14 @@ class LLMCalculator:
 
         for source in sources:
             try:
-                response = requests.get(source)
-                response.raise_for_status()  # This will raise an HTTPError for bad responses
-                data = response.json()
+                status, text = self._get(source)
+                if status != 200:
+                    continue
+                data = json.loads(text)
                 model_size = data.get("metadata", {}).get("total_size")
                 if model_size and not math.isnan(model_size / 2):
                     return model_size / 2
-            except (requests.exceptions.RequestException, ValueError):
+            except (requests.exceptions.RequestException, CacheMiss, ValueError):
                 continue  # If there's an error or no size, try the next source
 
         # If all sources fail, fall back to scraping the model page as the last resort
@@ -47,7 +131,7 @@ class LLMCalculator:
         Fallback method to scrape the model's webpage for size information.
         """
         try:
-            model_page = requests.get(f"https://huggingface.co/{hf_model}").text
+            _, model_page = self._get(f"https://huggingface.co/{hf_model}")
             params_el = model_page.find('data-target="ModelSafetensorsParams"')
             if params_el != -1:
                 model_size = json.loads(model_page[params_el:].split('data-props="', 1)[1].split('"', 1)[0])["safetensors"]["total"]
@@ -62,14 +146,51 @@ class LLMCalculator:
         """
         Retrieves the model configuration JSON from the Hugging Face API and determines the model size.
         """
-        config_response = requests.get(f"https://huggingface.co/{hf_model}/raw/main/config.json")
-        config = config_response.json()
+        _, config_text = self._get(f"https://huggingface.co/{hf_model}/raw/main/config.json")
+        config = self.normalize_config(json.loads(config_text))
 
         # Use the new fetch_model_size method to get model size
         model_size = self.fetch_model_size(hf_model)
         config["parameters"] = model_size
         return config
 
+    def normalize_config(self, config: dict) -> dict:
+        """
+        Brings config.json files of different architecture families to the keys used by the calculator.
+        Multimodal configs are flattened to their text model, and models without grouped-query
+        attention get as many key/value heads as attention heads.
+        """
+        if isinstance(config.get("text_config"), dict):
+            config = {**config, **config["text_config"]}
+            config.setdefault("model_type", config["text_config"].get("model_type"))
+
+        for key, aliases in CONFIG_ALIASES.items():
+            if config.get(key) is None:
+                config[key] = next((config[alias] for alias in aliases if config.get(alias) is not None), None)
+
+        if config.get("num_key_value_heads") is None:
+            config["num_key_value_heads"] = config["num_attention_heads"]
+        return config
+
+    def head_dim(self, model_config: dict) -> float:
+        """
+        Returns the size of a single attention head. Some models (e.g. gemma) use heads wider than hidden_size / n_head.
+        """
+        return model_config.get("head_dim") or model_config["hidden_size"] / model_config["num_attention_heads"]
+
+    def sliding_window_layers(self, model_config: dict) -> tuple:
+        """
+        Returns the number of layers whose KV cache is limited to the sliding window, and the window size.
+        """
+        window = model_config.get("sliding_window")
+        period = model_config.get("sliding_window_pattern") or SLIDING_WINDOW_PATTERNS.get(model_config.get("model_type"))
+        if not window or not period:
+            return 0, 0
+
+        layers = model_config["num_hidden_layers"]
+        global_layers = layers // period
+        return layers - global_layers, window
+
     def input_buffer(self, context: int, model_config: dict, bsz: int) -> float:
         """
         Calculates the size of the input buffer based on the context size, model configuration, and batch size.
@@ -88,31 +209,38 @@ class LLMCalculator:
         """
         Estimates the size of the compute buffer based on the context size, model configuration, and batch size.
         """
-        if bsz != 512:
-            raise Exception("Batch size other than 512 is currently not supported for the compute buffer")
+        # The KQ scores (context x batch x n_head floats) dominate the buffer, so the estimate measured
+        # for a batch of 512 tokens scales linearly with the batch size
+        size = (context / 1024 * 2 + 0.75) * model_config["num_attention_heads"] * 1024 * 1024 * bsz / 512
+
+        # Mixture-of-experts graphs also hold the router logits ([n_expert, n_tokens]) and the up and gate
+        # projections of the selected experts ([n_ff, n_expert_used, n_tokens] each), which are alive together
+        n_expert = model_config.get("num_local_experts") or 0
+        if n_expert > 1:
+            n_expert_used = model_config.get("num_experts_per_tok") or 2
+            expert_ffn = model_config.get("moe_intermediate_size") or model_config.get("intermediate_size") or 0
+            size += bsz * (n_expert + 2 * n_expert_used * expert_ffn) * 4
 
-        return (context / 1024 * 2 + 0.75) * model_config["num_attention_heads"] * 1024 * 1024
+        return size
 
-    def kv_cache(self, context: int, model_config: dict, fp8_cache: bool) -> float:
+    def kv_cache(self, context: int, model_config: dict, kv_cache_type: str) -> float:
         """
-        Calculates the size of the key-value cache based on the context size, model configuration, and FP8 caching flag.
+        Calculates the size of the key-value cache based on the context size, model configuration, and cache type
+        (see `KV_CACHE_BYTES`). Grouped-query attention shrinks every layer's cache; sliding-window layers only keep the window.
         """
-        n_gqa = model_config["num_attention_heads"] / model_config["num_key_value_heads"]
-        n_embd_gqa = model_config["hidden_size"] / n_gqa
-        n_elements = n_embd_gqa * (model_config["num_hidden_layers"] * context)
-        size = 2 * n_elements
+        n_embd_gqa = self.head_dim(model_config) * model_config["num_key_value_heads"]
+        swa_layers, window = self.sliding_window_layers(model_config)
+        global_layers = model_config["num_hidden_layers"] - swa_layers
+        n_elements = n_embd_gqa * (global_layers * context + swa_layers * min(context, window))
 
-        if fp8_cache:
-            return size
-        else:
-            return size * 2
+        return 2 * n_elements * kv_cache_bytes(kv_cache_type)
 
-    def context_size(self, context: int, model_config: dict, bsz: int, fp8_cache: bool) -> float:
+    def context_size(self, context: int, model_config: dict, bsz: int, kv_cache_type: str) -> float:
         """
         Combines the input buffer size, key-value cache size, and compute buffer size to estimate the total memory required for the context.
         """
         input_buffer_size = self.input_buffer(context, model_config, bsz)
-        kv_cache_size = self.kv_cache(context, model_config, fp8_cache)
+        kv_cache_size = self.kv_cache(context, model_config, kv_cache_type)
         compute_buffer_size = self.compute_buffer(context, model_config, bsz)
 
         return float(f"{input_buffer_size + kv_cache_size + compute_buffer_size:.2f}")
@@ -120,7 +248,10 @@ class LLMCalculator:
     def model_size(self, model_config: dict, quant_size: str) -> float:
         """
         Calculates the size of the model based on the number of parameters and the quantization size.
+        Configs read from a GGUF header already carry the exact tensor size in bytes for their own quantization.
         """
+        if "model_bytes" in model_config and quant_size == model_config.get("quant_size"):
+            return float(model_config["model_bytes"])
         bpw = self.gguf_quants[quant_size]
         return float(f"{model_config['parameters'] * bpw / 8:.2f}")
 
@@ -137,8 +268,8 @@ class LLMCalculator:
 
         # Make a request to the Hugging Face API
         url = f"https://huggingface.co/api/quicksearch?type=model&q={model_name}"
-        response = requests.get(url)
-        data = response.json()
+        _, search_text = self._get(url)
+        data = json.loads(search_text)
 
         # Extract the full model name from the first search result
         models = data["models"]
@@ -149,26 +280,222 @@ class LLMCalculator:
 
         return full_model_name, quant_size
 
-    def calculate_sizes(self, model: str, quant_size: str, context: int, bsz: int = 512, fp8_cache: bool = False) -> tuple:
+    def check_quant_size(self, model_config: dict, quant_size: str):
+        """
+        Raises if the quantization size can not be sized for the given model configuration.
+        """
+        if quant_size not in self.gguf_quants and quant_size != model_config.get("quant_size"):
+            raise Exception(f"Unsupported quantization size: {quant_size}")
+
+    def gguf_model_config(self, path: str) -> dict:
+        """
+        Reads the model configuration from the header of a local GGUF file without loading its weights.
+        """
+        return GGUFFile.from_path(path).model_config()
+
+    def calculate_sizes(self, model: str, quant_size: str, context: int, bsz: int = 512, kv_cache_type: str = "f16") -> tuple:
         """
         Orchestrates the overall calculation by calling the necessary methods based on the selected quantization size.
         Returns the model size, context size, and total size in gigabytes (GB).
         """
         model_config = self.model_config(model)
+        self.check_quant_size(model_config, quant_size)
+        return self.calculate_config_sizes(model_config, quant_size, context, bsz, kv_cache_type)
 
-        if quant_size not in self.gguf_quants:
-            raise Exception(f"Unsupported quantization size: {quant_size}")
-
+    def calculate_config_sizes(self, model_config: dict, quant_size: str, context: int, bsz: int = 512, kv_cache_type: str = "f16") -> tuple:
+        """
+        Calculates the model size, context size, and total size in gigabytes (GB) for an already fetched model configuration.
+        """
         model_size = self.model_size(model_config, quant_size)
-        context_size = self.context_size(context, model_config, bsz, fp8_cache)
+        context_size = self.context_size(context, model_config, bsz, kv_cache_type)
         total_size = (model_size + context_size) / 1e9
 
         return model_size / 1e9, context_size / 1e9, total_size
 
-    def calculate(self, model_input: str, context: int) -> tuple:
+    def config_footprint(self, model_config: dict, quant_size: str, context: int, bsz: int = 512, kv_cache_type: str = "f16") -> dict:
         """
-        Calculates the model size, context size, and total size based on the model name input and context size.
+        Splits the memory of a loaded model into what llama.cpp distributes layer by layer when the model spans
+        several GPUs and what every GPU it runs on needs in full. Sizes in gigabytes (GB):
+        - `layered`: weights and KV cache, divided between the GPUs by layers;
+        - `layer`: one layer's share of `layered`, the rounding slack of an uneven split;
+        - `per_gpu`: compute buffer, input buffer and CUDA overhead, paid again on each GPU.
         """
+        layered = self.model_size(model_config, quant_size) + self.kv_cache(context, model_config, kv_cache_type)
+        per_gpu = self.compute_buffer(context, model_config, bsz) + self.input_buffer(context, model_config, bsz) + GPU_OVERHEAD
+
+        return {
+            "layered": layered / 1e9,
+            "layer": layered / model_config["num_hidden_layers"] / 1e9,
+            "per_gpu": per_gpu / 1e9,
+        }
+
+    def calculate_from_gguf(self, path: str, context: int, bsz: int = 512, kv_cache_type: str = "f16") -> tuple:
+        """
+        Calculates the model size, context size, and total size in gigabytes (GB) from a local GGUF file.
+        Works offline and uses the exact tensor sizes instead of the bits-per-weight estimate.
+        """
+        model_config = self.gguf_model_config(path)
+        return self.calculate_config_sizes(model_config, model_config["quant_size"], context, bsz, kv_cache_type)
+
+    def resolve_model_config(self, model_input: str) -> tuple:
+        """
+        Returns the model configuration and quantization for an ollama model tag or a local GGUF file.
+        Tags are looked up in the Ollama registry, falling back to a Hugging Face search.
+        """
+        if os.path.isfile(model_input):
+            model_config = self.gguf_model_config(model_input)
+            return model_config, model_config["quant_size"]
+
+        if self.registry:
+            try:
+                model_config = self.registry.model_info(model_input)["config"]
+                return model_config, model_config["quant_size"]
+            except (requests.exceptions.RequestException, CacheMiss, KeyError, ValueError) as e:
+                print(f"Ollama registry lookup for {model_input} failed ({e}), falling back to Hugging Face.")
+
         full_model_name, quant_size = self.extract_model_info(model_input)
-        model_size, context_size, total_size = self.calculate_sizes(full_model_name, quant_size, context)
-        return model_size, context_size, total_size
+        return self.model_config(full_model_name), quant_size
+
+    def download_size(self, model_input: str):
+        """
+        Returns the exact download size in bytes of an ollama model tag or a local GGUF file,
+        or None if it is unknown.
+        """
+        if os.path.isfile(model_input):
+            return os.path.getsize(model_input)
+        if not self.registry:
+            return None
+        try:
+            return self.registry.model_info(model_input)["download_size"]
+        except (requests.exceptions.RequestException, CacheMiss, KeyError, ValueError):
+            return None
+
+    def config_option(self, model_config: dict, quant_size: str, context: int, bsz: int = 512, kv_cache_type: str = "f16") -> dict:
+        """
+        The model, context and total sizes and the per-GPU `footprint` in GB of an already fetched model configuration.
+        """
+        model_size, context_size, total_size = self.calculate_config_sizes(model_config, quant_size, context, bsz, kv_cache_type)
+        return {
+            "model_size": model_size,
+            "context_size": context_size,
+            "total_size": total_size,
+            "footprint": self.config_footprint(model_config, quant_size, context, bsz, kv_cache_type),
+        }
+
+    def model_option(self, model_input: str, context: int, num_parallel: int = 1, kv_cache_type: str = "f16", bsz: int = 512) -> dict:
+        """
+        Sizes a model tag or local GGUF file as is, in the format of `quant_options` with no `quant` or `bpw`. The
+        configuration is fetched once for both the sizes of `calculate` and the footprint of `calculate_footprint`.
+        """
+        model_config, quant_size = self.resolve_model_config(model_input)
+        self.check_quant_size(model_config, quant_size)
+        return {
+            "quant": None,
+            "model": model_input,
+            "bpw": None,
+            **self.config_option(model_config, quant_size, context * num_parallel, bsz, kv_cache_type),
+            "download_size": self.download_size(model_input),
+        }
+
+    def quant_options(self, model: str, floor: str, context: int, num_parallel: int = 1, kv_cache_type: str = "f16", bsz: int = 512) -> list:
+        """
+        Sizes a model tag without quantization suffix (e.g. llama3:8b-instruct) in every quantization at least as good
+        as `floor`, best quality first. The configuration is fetched once; quantizations the Ollama registry does not
+        publish for the model are skipped. Returns dicts with the `quant`, its ollama tag (`model`), bits per weight
+        (`bpw`), the model, context and total sizes and the per-GPU `footprint` in GB, and the `download_size` in bytes.
+        """
+        model_config, _ = self.resolve_model_config(model)
+        options = []
+        for quant_size, bpw in sorted(self.gguf_quants.items(), key=lambda item: -item[1]):
+            if bpw < self.gguf_quants[floor]:
+                continue
+            tag = quant_tag(model, quant_size)
+            download_size = self.download_size(tag)
+            if self.registry and download_size is None:
+                continue
+            options.append({
+                "quant": quant_size,
+                "model": tag,
+                "bpw": bpw,
+                **self.config_option(model_config, quant_size, context * num_parallel, bsz, kv_cache_type),
+                "download_size": download_size,
+            })
+        if not options:
+            raise ValueError(f"No quantization of {model} at least as good as {floor} is published")
+        return options
+
+    def sweep(self, model_input: str, contexts: list, quants: list = None, batch_sizes: list = (512,), kv_cache_types: list = ("f16",)) -> list:
+        """
+        Calculates the memory breakdown for every combination of context, quantization, batch size and KV cache type.
+        The model configuration is fetched only once. Quantizations default to the one in the model tag.
+        """
+        model_config, quant_size = self.resolve_model_config(model_input)
+        return self.sweep_config(model_config, contexts, quants or [quant_size], batch_sizes, kv_cache_types)
+
+    def sweep_config(self, model_config: dict, contexts: list, quants: list, batch_sizes: list = (512,), kv_cache_types: list = ("f16",)) -> list:
+        """
+        Calculates the memory breakdown over a grid of settings for an already fetched model configuration.
+        Returns one row per combination with all sizes in gigabytes (GB).
+        """
+        for quant_size in quants:
+            self.check_quant_size(model_config, quant_size)
+
+        rows = []
+        for quant_size, bsz, kv_cache_type in itertools.product(quants, batch_sizes, kv_cache_types):
+            # The model size only depends on the quantization, the buffers only on the context
+            model_size = self.model_size(model_config, quant_size)
+            for context in contexts:
+                input_buffer_size = self.input_buffer(context, model_config, bsz)
+                kv_cache_size = self.kv_cache(context, model_config, kv_cache_type)
+                compute_buffer_size = self.compute_buffer(context, model_config, bsz)
+                total_size = model_size + input_buffer_size + kv_cache_size + compute_buffer_size
+                rows.append({
+                    "context": context,
+                    "quant": quant_size,
+                    "batch": bsz,
+                    "kv_cache_type": kv_cache_name(kv_cache_type),
+                    "model_size": model_size / 1e9,
+                    "kv_cache": kv_cache_size / 1e9,
+                    "input_buffer": input_buffer_size / 1e9,
+                    "compute_buffer": compute_buffer_size / 1e9,
+                    "total_size": total_size / 1e9,
+                })
+        return rows
+
+    def max_context(self, model_config: dict, quant_size: str, vram_budget: float, bsz: int = 512, kv_cache_type: str = "f16", step: int = 256) -> int:
+        """
+        Finds the largest context (a multiple of `step`) whose total size fits into `vram_budget` gigabytes.
+        The search is capped at the model's trained context length. Returns 0 if not even `step` tokens fit.
+        """
+        budget = vram_budget * 1e9 - self.model_size(model_config, quant_size)
+        limit = model_config.get("max_position_embeddings") or 1024 * 1024
+
+        # Memory grows monotonically with the context, so a binary search over the steps is enough
+        low, high = 0, limit // step
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.context_size(middle * step, model_config, bsz, kv_cache_type) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        return low * step
+
+    def calculate(self, model_input: str, context: int, num_parallel: int = 1, kv_cache_type: str = "f16", bsz: int = 512) -> tuple:
+        """
+        Calculates the model size, context size, and total size based on the model name input and context size.
+        `model_input` is either an ollama model tag or the path to a local GGUF file.
+        Ollama gives each of the `num_parallel` request slots its own `context`, so the model is loaded with
+        their product as its context.
+        """
+        model_config, quant_size = self.resolve_model_config(model_input)
+        self.check_quant_size(model_config, quant_size)
+        return self.calculate_config_sizes(model_config, quant_size, context * num_parallel, bsz, kv_cache_type)
+
+    def calculate_footprint(self, model_input: str, context: int, num_parallel: int = 1, kv_cache_type: str = "f16", bsz: int = 512) -> dict:
+        """
+        Returns the per-GPU memory footprint (see `config_footprint`) based on the model name input and context size,
+        for `num_parallel` request slots (see `calculate`).
+        """
+        model_config, quant_size = self.resolve_model_config(model_input)
+        self.check_quant_size(model_config, quant_size)
+        return self.config_footprint(model_config, quant_size, context * num_parallel, bsz, kv_cache_type)
@@ -1,6 +1,14 @@
 import yaml
 import os
 
+from llm_deploy.llm_calculator import GGUF_QUANTS
+from llm_deploy.ollama_server import OLLAMA_KV_CACHE_TYPES
+
+# Optional per-model keys: the context length, the parallel request slots and the batch size
+INT_OPTIONS = ('num_ctx', 'num_parallel', 'batch')
+# Lowest quantization `quant: auto` may pick when llms.yaml sets no `quant_floor`
+DEFAULT_QUANT_FLOOR = 'Q4_K_M'
+
 class LLMsConfig:
     def __init__(self, filename="llms.yaml"):
         self.data = {'models': {}}
@@ -15,14 +23,41 @@ class LLMsConfig:
             if 'model' in details and 'priority' in details:
                 # Check if 'priority' is either 'high' or 'low'
                 if details['priority'] in ['high', 'low']:
-                    models.append({
+                    model = {
                         'name': name,
                         'model': details['model'],
                         'priority': details['priority']
-                    })
+                    }
+                    model.update(self.model_options(name, details))
+                    models.append(model)
                 else:
                     raise ValueError(f"Invalid priority value for {name}: {details['priority']}")
             else:
                 raise KeyError(f"Missing required keys in model {name}")
         return models
 
+    def model_options(self, name, details):
+        """ Validates the optional keys of a model; keys it does not set fall back to the server settings. """
+        options = {}
+        for key in INT_OPTIONS:
+            if key in details:
+                value = details[key]
+                if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+                    raise ValueError(f"Invalid {key} value for {name}: {value}")
+                options[key] = value
+        if 'kv_cache_type' in details:
+            if details['kv_cache_type'] not in OLLAMA_KV_CACHE_TYPES:
+                raise ValueError(f"Invalid kv_cache_type value for {name}: {details['kv_cache_type']}")
+            options['kv_cache_type'] = details['kv_cache_type']
+        if 'quant' in details:
+            # The model is then a tag without quantization suffix, e.g. llama3:8b-instruct
+            if details['quant'] != 'auto':
+                raise ValueError(f"Invalid quant value for {name}: {details['quant']}, only 'auto' is supported")
+            floor = str(details.get('quant_floor', DEFAULT_QUANT_FLOOR)).upper()
+            if floor not in GGUF_QUANTS:
+                raise ValueError(f"Invalid quant_floor value for {name}: {details['quant_floor']}")
+            options.update(quant='auto', quant_floor=floor)
+        elif 'quant_floor' in details:
+            raise ValueError(f"quant_floor of {name} needs quant: auto")
+        return options
+
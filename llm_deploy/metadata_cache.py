@@ -0,0 +1,155 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = "~/.cache/llm-deploy"
+DEFAULT_TTL = 7 * 24 * 3600  # one week
+DEFAULT_MAX_ENTRIES = 2048
+LOCK_STRIPES = 64  # fetches of keys in different stripes never wait for each other
+
+
+class CacheMiss(LookupError):
+    """
+    Raised in offline mode when a key has never been cached.
+    """
+
+
+class MetadataCache:
+    """
+    Content-addressed on-disk cache for remote metadata lookups (Hugging Face
+    configs, index files, search results, ...).
+
+    Every key is hashed with SHA-256 and stored as a small JSON document under
+    `cache_dir` together with the TTL it was written with. Entries older than
+    their TTL (`ttl` seconds unless a lookup asks for another) are refreshed on
+    the next lookup and dropped by `prune`; if the refresh fails because the
+    network is unavailable, the stale entry is served instead. In `offline`
+    mode the network is never touched and stale entries are always served.
+
+    The cache keeps at most `max_entries` documents and evicts the least
+    recently used ones when that limit is exceeded.
+    """
+
+    def __init__(self, cache_dir=None, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, offline=False):
+        self.cache_dir = Path(os.path.expanduser(cache_dir or DEFAULT_CACHE_DIR))
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.offline = offline
+        # A fixed set of locks shared by all keys, so long-running processes do not keep one per key
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def get_or_fetch(self, key, fetch, ttl=None):
+        """
+        Returns the cached value for `key`, calling `fetch()` to (re)populate it when
+        the entry is missing or expired. `fetch` must return a JSON-serializable value.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        entry = self._read(key)
+        if entry is not None and (self.offline or self._is_fresh(entry, ttl)):
+            return entry["value"]
+        if self.offline:
+            raise CacheMiss(f"'{key}' is not cached and offline mode is enabled.")
+
+        # Only one thread fetches a given key; the others wait and reuse its result
+        with self._lock_for(key):
+            entry = self._read(key)
+            if entry is not None and self._is_fresh(entry, ttl):
+                return entry["value"]
+            try:
+                value = fetch()
+            except requests.exceptions.RequestException as e:
+                if entry is None:
+                    raise
+                logger.warning("Failed to refresh '%s' (%s), serving cached copy.", key, e)
+                return entry["value"]
+            self.put(key, value, ttl)
+            return value
+
+    def get(self, key):
+        """ Returns the cached value for `key` regardless of its age, or None. """
+        entry = self._read(key)
+        return entry["value"] if entry is not None else None
+
+    def put(self, key, value, ttl=None):
+        """ Stores `value` under `key` with its TTL (`ttl` by default) and evicts old entries if needed. """
+        ttl = self.ttl if ttl is None else ttl
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w") as file:
+            # JSON has no infinity; entries that never expire get a null TTL
+            json.dump({"key": key, "created_at": time.time(), "ttl": None if ttl == math.inf else ttl, "value": value}, file)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def clear(self):
+        """ Removes every entry from the cache. Returns the number of removed entries. """
+        removed = 0
+        for path in self._entries():
+            path.unlink(missing_ok=True)
+            removed += 1
+        return removed
+
+    def prune(self):
+        """
+        Removes entries older than the TTL they were written with; entries from earlier versions
+        without one use `ttl`. Returns the number of removed entries.
+        """
+        removed = 0
+        for path in self._entries():
+            entry = self._load(path)
+            if entry is None or not self._is_fresh(entry, entry["ttl"] if "ttl" in entry else self.ttl):
+                path.unlink(missing_ok=True)
+                removed += 1
+        return removed
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.cache_dir / digest[:2] / f"{digest}.json"
+
+    def _entries(self):
+        if not self.cache_dir.exists():
+            return []
+        return list(self.cache_dir.glob("*/*.json"))
+
+    def _read(self, key):
+        path = self._path(key)
+        entry = self._load(path)
+        if entry is None or entry.get("key") != key:
+            return None
+        # Touch the entry so eviction drops the least recently used documents first
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def _load(self, path):
+        try:
+            with open(path, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _is_fresh(self, entry, ttl):
+        return ttl is None or time.time() - entry.get("created_at", 0) < ttl
+
+    def _evict(self):
+        entries = self._entries()
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda path: path.stat().st_mtime)
+        for path in entries[:len(entries) - self.max_entries]:
+            path.unlink(missing_ok=True)
+
+    def _lock_for(self, key):
+        return self._locks[hash(key) % LOCK_STRIPES]
@@ -1,4 +1,12 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
 from llm_deploy.llm_calculator import LLMCalculator
+from llm_deploy.allocation_engines import ALLOCATION_ENGINES, plan_cost, sort_decreasing
+from llm_deploy.offer_catalog import OfferCatalog
+from llm_deploy.ollama_server import OllamaServerSettings
+from llm_deploy.utils import format_price, print_quant_tradeoffs
+from llm_deploy.vastai import gpu_total_ram
 
 PRIORITY_MAP = {
     'high': 2,
@@ -15,27 +23,52 @@ class ModelAllocator:
     the machine's GPU RAM. Low-priority models are allocated to any machine with enough space
     for the individual model.
 
+    On top of the pooled GPU RAM, every machine must be able to lay its models out on its
+    individual GPUs (`gpu_ram` each, `num_gpus` of them) the way ollama does: a model goes
+    onto the single GPU with the most free memory if it fits there, otherwise it is split
+    layer-wise across all GPUs, each paying its own compute buffer and CUDA overhead. A
+    placement that would spill layers to the CPU is rejected.
+
     The allocator uses the `vast` object to retrieve machine offers and caches the GPU RAM of
-    each machine for efficient space management.
+    each machine for efficient space management. The placement itself is done by a pluggable
+    allocation engine (see `allocation_engines.ALLOCATION_ENGINES`) that minimizes the total
+    price per hour; the plan's cost is reported next to the original greedy strategy.
 
     Methods:
     - `load_desired_models`: Loads and sorts the desired models based on priority and size.
+    - `size_models`: Sizes the desired models concurrently with bounded parallelism.
     - `get_available_offers`: Retrieves a list of available machines based on required GPU memory.
     - `allocate_models`: Allocates models to machines based on priority and available resources.
-    - `find_suitable_machine`: Finds the most suitable machine for a given model.
+    - `load_offer_catalog`: Fetches one indexed snapshot of all offers the engine may choose from.
+    - `choose_quants`: Picks the quantization of `quant: auto` models together with their placement.
+    - `fits`: Checks if a model can be added to a machine bin of the allocation engine.
+    - `gpu_layout`: Places a machine's models on its individual GPUs.
     - `allocate_model_to_machine`: Allocates a model to a specific machine.
     - `can_allocate`: Checks if a model can be allocated to a machine with available space.
     - `calculate_required_gpu_memory`: Calculates the required GPU memory for a model.
     - `update_available_space`: Updates the available GPU RAM of a machine after allocation.
     """
 
-    def __init__(self, vast, llms_config):
+    def __init__(self, vast, llms_config, calculator=None, max_workers=8, sizing_timeout=120, strategy='exact', offer_limit=1000, server=None):
         self.allocations = {}  # Maps machine ID to list of allocated models
         self.available_space = {}  # Tracks available GPU RAM for each machine
         self.gpu_ram_cache = {}  # Caches the GPU RAM of each machine
         self.machines = {} # Maps machine ID to machine object
+        self.gpu_layouts = {}  # Maps machine ID to the GPU indexes used by each allocated model
         self.vast = vast  # Vast object to interact with machine offers
         self.llms_config = llms_config  # Configuration object for LLMs
+        self.calculator = calculator or LLMCalculator()  # Sizes models, caching metadata lookups
+        self.server = server or OllamaServerSettings()  # Ollama runtime settings the models are sized for
+        self.max_workers = max_workers  # Maximum number of models sized concurrently
+        self.sizing_timeout = sizing_timeout  # Seconds allowed for sizing a single model
+        if strategy not in ALLOCATION_ENGINES:
+            raise ValueError(f"Unknown allocation strategy: {strategy}")
+        self.strategy = strategy  # Name of the allocation engine
+        self.offer_limit = offer_limit  # Maximum number of offers in the catalog snapshot
+        self.catalog = None  # Offer snapshot shared by all placement decisions
+        self.plan_cost = None  # Price per hour of the chosen plan
+        self.baseline_cost = None  # Price per hour of the greedy plan on the same offers
+        self.quant_tradeoffs = None  # Cost/quality rows of the `quant: auto` search, see `choose_quants`
         self.desired_models = self.load_desired_models()  # List of desired models
 
     def load_desired_models(self):
@@ -46,58 +79,264 @@ class ModelAllocator:
         Returns:
             List[dict]: Sorted list of models with their properties.
         """
-        calc = LLMCalculator()
         models = self.llms_config.get_models()
+        sizes = self.size_models(models)
         for model in models:
-            model_name = model['model']
-            print(f"Retrieving size for model: {model_name}")
-            model_size, context_size, total_size = calc.calculate(model_name, 8192)
-            print(f"Model Size (GB): {model_size:.2f}")
-            print(f"Context Size (GB): {context_size:.2f}")
-            print(f"Total Size (GB): {total_size:.2f}")
-            model_size_mb = total_size * 1024  # Convert GB to MB
-
-            model['size'] = model_size_mb
+            size = sizes[self.sizing_key(model)]
+            if model.get('quant') == 'auto':
+                # Start from the floor; `choose_quants` upgrades what the cheapest fleet has room for
+                model['base_model'] = model['model']
+                model['quant_options'] = size['quant_options']
+                self.apply_quant(model, size['quant_options'][-1])
+            else:
+                model['size'] = size['size']
+                model['download_size'] = size['download_size']
+                model['footprint'] = size['footprint']
+            model['settings'] = self.server.model_settings(model)
+            model['server_group'] = self.server.group(model)
 
         # Sorts models by priority (high first) and size (larger first)
         return sorted(models, key=lambda x: (-PRIORITY_MAP[x['priority']], -x['size']))
 
-    def get_available_offers(self, gpu_memory, min_gpu=1, max_gpu=2, disk_space=40, internet_speed=200, result_count=10, public_ip=True):
-        # Your existing implementation
+    def sizing_key(self, model):
+        """ Identifies a model together with the settings it is sized for (see `OllamaServerSettings.sizing`). """
+        key = (model['model'],) + tuple(sorted(self.server.sizing(model).items()))
+        if model.get('quant') == 'auto':
+            key += (('quant_floor', model['quant_floor']),)
+        return key
+
+    def size_models(self, models):
+        """
+        Sizes the given models (dicts from llms.yaml or plain names) concurrently for their context length,
+        parallel request slots, KV cache type and batch size, falling back to the server settings. Models
+        with the same name and settings are sized only once. Models with `quant: auto` are sized in every
+        quantization down to their `quant_floor` (see `LLMCalculator.quant_options`).
+
+        Returns:
+            dict: Maps the `sizing_key` of each model to its total VRAM size, its download size (None if
+            unknown) and its per-GPU footprint (see `LLMCalculator.config_footprint`), all in MB. For
+            `quant: auto` models these are the floor's, and `quant_options` lists every quantization
+            with its `quant`, tag (`model`), `bpw` and sizes, best first.
+
+        Raises:
+            TimeoutError: If sizing a single model takes longer than `sizing_timeout`.
+        """
+        models = [model if isinstance(model, dict) else {'model': model} for model in models]
+        unique = {self.sizing_key(model): model for model in models}
+        if not unique:
+            return {}
+
+        started = {}
+
+        def size(key, model):
+            started[key] = time.monotonic()
+            sizing = self.server.sizing(model)
+            if model.get('quant') == 'auto':
+                return self.calculator.quant_options(model['model'], model['quant_floor'], **sizing)
+            return [self.calculator.model_option(model['model'], **sizing)]
+
+        sizes = {}
+        executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(unique)))
+        try:
+            pending = {executor.submit(size, key, model): key for key, model in unique.items()}
+            while pending:
+                done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = pending.pop(future)
+                    options = future.result()
+                    sizing = self.server.sizing(unique[key])
+                    print(f"Retrieved size for model: {key[0]} ({sizing['context']} tokens x {sizing['num_parallel']}, "
+                          f"{sizing['kv_cache_type']} KV cache, batch {sizing['bsz']})")
+                    for option in options:
+                        quant = f"{option['quant']} " if option['quant'] else ""
+                        print(f"{quant}Model Size (GB): {option['model_size']:.2f}")
+                        print(f"{quant}Context Size (GB): {option['context_size']:.2f}")
+                        print(f"{quant}Total Size (GB): {option['total_size']:.2f}")
+                    options = [{
+                        'quant': option['quant'],
+                        'model': option['model'],
+                        'bpw': option['bpw'],
+                        'size': option['total_size'] * 1024,  # Convert GB to MB
+                        'download_size': option['download_size'] / 1024 / 1024 if option['download_size'] else None,
+                        'footprint': {part: value * 1024 for part, value in option['footprint'].items()}
+                    } for option in options]
+                    sizes[key] = {part: options[-1][part] for part in ('size', 'download_size', 'footprint')}
+                    if unique[key].get('quant') == 'auto':
+                        sizes[key]['quant_options'] = options
+
+                now = time.monotonic()
+                for key in pending.values():
+                    if key in started and now - started[key] > self.sizing_timeout:
+                        raise TimeoutError(f"Sizing model {key[0]} took longer than {self.sizing_timeout}s")
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return sizes
+
+    def get_available_offers(self, gpu_memory, min_gpu=1, max_gpu=2, disk_space=40, internet_speed=200, result_count=10, public_ip=True, limit=None, verbose=True):
         # Make sure to update self.gpu_ram_cache with the gpu_total_ram of each machine
-        machines = self.vast.get_available_offers(gpu_memory, min_gpu, max_gpu, disk_space, internet_speed, result_count, public_ip)
+        machines = self.vast.get_available_offers(gpu_memory, min_gpu, max_gpu, disk_space, internet_speed, result_count, public_ip, limit)
         for machine in machines:
-            print(machine)
+            if verbose:
+                print(machine)
+            machine['gpu_total_ram'] = gpu_total_ram(machine)
             self.gpu_ram_cache[machine['id']] = machine['gpu_total_ram']
         return machines
 
-    def allocate_models(self):
-        for model in self.desired_models:
-            machine = self.find_suitable_machine(model)
-            if not machine:
-                print(f"Failed to allocate model: {model['model']}")
-                continue
-            machine_id = machine['id']
-            self.machines[machine_id] = machine
-            self.allocate_model_to_machine(model, machine_id)
+    def allocate_models(self, models=None):
+        """
+        Places the models (all desired models by default) on newly rented machines.
+
+        Returns:
+            tuple: Maps machine ID to its allocated models, and machine ID to the machine offer.
+        """
+        models = self.desired_models if models is None else models
+        catalog = self.load_offer_catalog()
+        bins, _ = self.create_engine(self.strategy).allocate(models, catalog)
+        self.plan_cost = plan_cost(bins)
+
+        if self.strategy == 'greedy':
+            print(f"Plan cost (greedy): {format_price(self.plan_cost)}")
+        else:
+            baseline_bins, baseline_unallocated = self.create_engine('greedy').allocate(models, catalog)
+            self.baseline_cost = plan_cost(baseline_bins)
+            note = f", {len(baseline_unallocated)} models unallocated" if baseline_unallocated else ""
+            print(f"Plan cost ({self.strategy}): {format_price(self.plan_cost)} | greedy baseline: {format_price(self.baseline_cost)}{note}")
+
+        for machine_bin in bins:
+            self.machines[machine_bin.id] = machine_bin.machine
+            for model in machine_bin.models:
+                self.allocate_model_to_machine(model, machine_bin.id)
+            self.gpu_layouts[machine_bin.id] = self.gpu_layout(machine_bin.machine, machine_bin.models)
+            for model, gpus in self.gpu_layouts[machine_bin.id]:
+                if len(gpus) > 1:
+                    print(f"Model {model['model']} spans GPUs {', '.join(map(str, gpus))} on machine {machine_bin.id}")
 
         return self.allocations, self.machines
 
-    def find_suitable_machine(self, model):
-        for machine_id, space in self.available_space.items():
-            if self.can_allocate(model, space, self.allocations.get(machine_id, [])):
-                return self.machines[machine_id]
+    def apply_quant(self, model, option):
+        """ Switches a `quant: auto` model to one of its `quant_options`. """
+        model['model'] = option['model']
+        model['quant_size'] = option['quant']
+        model['bpw'] = option['bpw']
+        model['size'] = option['size']
+        model['download_size'] = option['download_size']
+        model['footprint'] = option['footprint']
+
+    def choose_quants(self):
+        """
+        Picks the quantization of every `quant: auto` model together with the placement. All of them start
+        at their floor, which gives the price of the cheapest fleet; then, high priority and larger models
+        first, each is raised to the best quantization that still places as many models at that price.
+        The cost and quality of choosing one quantization for all models is printed next to the choice.
+        Runs once; the placement does not consider instances that are already running.
+
+        Returns:
+            List[dict]: The trade-off rows, None without `quant: auto` models.
+        """
+        auto = [model for model in self.desired_models if model.get('quant_options')]
+        if not auto or self.quant_tradeoffs is not None:
+            return self.quant_tradeoffs
+        catalog = self.load_offer_catalog()
+        engine = self.create_engine(self.strategy)
+
+        def evaluate(label):
+            bins, unallocated = engine.allocate(self.desired_models, catalog)
+            return {
+                'plan': label,
+                'quants': {model['name']: model['quant_size'] for model in auto},
+                'machines': len(bins),
+                'unallocated': len(unallocated),
+                'cost': plan_cost(bins),
+                'bpw': sum(model['bpw'] for model in auto) / len(auto),
+            }
+
+        def assign(level_bpw):
+            # Every model at its best quantization not above the level, or its floor
+            for model in auto:
+                options = model['quant_options']
+                self.apply_quant(model, next((option for option in options if option['bpw'] <= level_bpw), options[-1]))
+
+        rows = []
+        levels = sorted({option['bpw']: option['quant'] for model in auto for option in model['quant_options']}.items(), reverse=True)
+        for level_bpw, quant_size in levels:
+            assign(level_bpw)
+            rows.append(evaluate(f"all {quant_size}"))
 
-        required_gpu_memory = self.calculate_required_gpu_memory(model)
-        machines = self.get_available_offers(gpu_memory=required_gpu_memory)
+        assign(0)
+        target = evaluate("floor")
+        for model in auto:
+            floor = model['quant_options'][-1]
+            for option in model['quant_options'][:-1]:
+                self.apply_quant(model, option)
+                result = evaluate("chosen")
+                if result['unallocated'] <= target['unallocated'] and result['cost'] <= target['cost'] + 1e-9:
+                    break
+            else:
+                self.apply_quant(model, floor)
 
-        # Filtering machines with more than two GPUs
-        suitable_machines = [m for m in machines if m['num_gpus'] <= 2]
+        rows.append(evaluate("chosen"))
+        self.desired_models.sort(key=lambda x: (-PRIORITY_MAP[x['priority']], -x['size']))
+        self.quant_tradeoffs = rows
+        print_quant_tradeoffs(rows)
+        return rows
 
-        # Selecting the machine based on total_flops and price
-        suitable_machines.sort(key=lambda m: (-m['total_flops'], m['dph_total']))
+    def create_engine(self, strategy):
+        return ALLOCATION_ENGINES[strategy](self.fits, self.calculate_required_gpu_memory)
+
+    def load_offer_catalog(self):
+        """
+        Fetches a single wide snapshot of offers with enough GPU RAM for the smallest model
+        and indexes it. All later placement lookups are in-memory range queries on it.
+        """
+        if self.catalog is None:
+            offers = []
+            if self.desired_models:
+                min_gpu_memory = min(model['size'] for model in self.desired_models)
+                machines = self.get_available_offers(gpu_memory=min_gpu_memory, result_count=None, limit=self.offer_limit, verbose=False)
+                # Filtering machines with more than two GPUs
+                offers = [m for m in machines if m['num_gpus'] <= 2]
+                print(f"Offer catalog: {len(offers)} offers with at least {min_gpu_memory} MB of GPU RAM")
+            self.catalog = OfferCatalog(offers)
+        return self.catalog
+
+    def fits(self, model, machine_bin):
+        # Parallel slots and the KV cache type are set for the whole ollama server
+        return (
+            all(self.server.group(other) == self.server.group(model) for other in machine_bin.models)
+            and self.can_allocate(model, machine_bin.free, machine_bin.models)
+            and self.gpu_layout(machine_bin.machine, machine_bin.models + [model]) is not None
+        )
+
+    def gpu_layout(self, machine, models):
+        """
+        Lays the models out on the machine's GPUs, high priority and larger models first, following
+        ollama's scheduler: the GPU with the most free memory if the whole model fits on it, otherwise
+        a layer split across all GPUs in proportion to their free memory.
+
+        Returns:
+            List[tuple]: (model, GPU indexes) pairs, or None if a model would not stay fully in VRAM.
+        """
+        num_gpus = machine.get('num_gpus') or 1
+        gpu_ram = machine.get('gpu_ram') or machine['gpu_total_ram'] / num_gpus
+        free = [gpu_ram] * num_gpus
+        layout = []
+        for model in sort_decreasing(models):
+            footprint = model['footprint']
+            best = max(range(num_gpus), key=lambda gpu: free[gpu])
+            if free[best] >= footprint['layered'] + footprint['per_gpu']:
+                free[best] -= footprint['layered'] + footprint['per_gpu']
+                layout.append((model, [best]))
+                continue
 
-        return suitable_machines[0] if suitable_machines else None
+            # Every GPU keeps its own buffers, and an uneven split may leave one extra layer on any of them
+            room = [f - footprint['per_gpu'] - footprint['layer'] for f in free]
+            if num_gpus == 1 or min(room) <= 0 or sum(room) < footprint['layered']:
+                return None
+            for gpu in range(num_gpus):
+                free[gpu] -= footprint['layered'] * room[gpu] / sum(room) + footprint['per_gpu']
+            layout.append((model, list(range(num_gpus))))
+        return layout
 
     def allocate_model_to_machine(self, model, machine_id):
         if machine_id in self.allocations:
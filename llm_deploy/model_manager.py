@@ -1,37 +1,153 @@
-from llm_deploy.ollama import OllamaInstance
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from llm_deploy.ollama import OllamaInstance, ollama_model_name, DEFAULT_KEEP_ALIVE
+from llm_deploy.pull_progress import PullProgress, ProgressDisplay
+from llm_deploy.pull_supervisor import PullSupervisor, DEFAULT_STALL_TIMEOUT, DEFAULT_RETRIES
 from llm_deploy.utils import print_pull_status
 
+# Concurrent pulls per ollama server; a few streams fill a fast link, more just compete for disk
+DEFAULT_PER_HOST_LIMIT = 2
+# Seconds an ollama server gets to list its models
+DEFAULT_LIST_TIMEOUT = 5
+MAX_LIST_WORKERS = 32
+
 class ModelManager:
-    def __init__(self, litellm, storage):
+    def __init__(self, litellm, storage, per_host_limit=DEFAULT_PER_HOST_LIMIT, stall_timeout=DEFAULT_STALL_TIMEOUT, pull_retries=DEFAULT_RETRIES, keep_alive=DEFAULT_KEEP_ALIVE):
         self.litellm = litellm
         self.storage = storage
+        self.per_host_limit = per_host_limit  # Maximum number of concurrent pulls per instance
+        self.stall_timeout = stall_timeout  # Seconds without progress before a pull is restarted
+        self.pull_retries = pull_retries
+        self.keep_alive = keep_alive  # How long warmed models stay loaded, see OllamaInstance.warm_model
+        self._host_slots = {}
+        self._host_slots_lock = threading.Lock()
 
-    def pull(self, model_name: str, instance_id: int):
+    def pull(self, model_name: str, instance_id: int, on_status=None, register=True):
         """
         Pull a model from the Ollama server.
         :param model_name: Model name
         :param instance_id: Instance ID
+        :param on_status: Called with every pull status instead of printing a progress bar
+        :param register: Warm the model up and add it to LiteLLM once it is pulled
         :return: Pull status
         """
-        print(f"Pulling model: {model_name}")
+        return self.pull_model(model_name, instance_id, on_status, register)['ok']
+
+    def pull_model(self, model_name: str, instance_id: int, on_status=None, register=True):
+        """
+        Pull a model from the Ollama server, waiting for a free slot of its host (see `per_host_limit`).
+        Stalled and interrupted pulls are resumed, see PullSupervisor. With `register`, the model is
+        only added to LiteLLM once `warm_model` confirmed it is loaded.
+        :return: Result dict with the model, instance ID, `ok`, the failure `reason`, the bytes and seconds taken,
+                 the number of attempts, the per-layer throughput and the `warm` result
+        """
+        result = {'model': model_name, 'instance_id': instance_id, 'ok': False, 'reason': None, 'bytes': 0, 'seconds': 0.0, 'attempts': 0, 'layers': []}
+        if not on_status:
+            print(f"Pulling model: {model_name}")
         # Get the instance address
         instance = self.storage.get_instance(instance_id)
         if not instance:
+            result['reason'] = "instance not found"
             print("Instance not found.")
-            return False
+            return result
         ollama_addr = instance.get('ollama_addr')
         if not ollama_addr:
+            result['reason'] = "ollama address not found"
             print("Ollama address not found.")
-            return False
+            return result
 
         # Create an instance of the OllamaInstance class
         ollama_instance = OllamaInstance(ollama_addr)
-        # Pull a model and print updates
-        model_pull_generator = ollama_instance.pull_model(model_name)
-        print_pull_status(model_pull_generator)
-        self.litellm.add_model(model_name, ollama_addr)
+        with self.host_slot(ollama_addr):
+            start = time.monotonic()
+            try:
+                supervisor = PullSupervisor(ollama_instance, self.stall_timeout, self.pull_retries)
+                statuses = supervisor.statuses(model_name, result)
+                if on_status:
+                    for status in statuses:
+                        on_status(status)
+                else:
+                    print_pull_status(statuses)
+            except Exception as e:
+                result['reason'] = str(e)
+            result['seconds'] = time.monotonic() - start
+
+        if not result['ok']:
+            result['reason'] = result['reason'] or "pull ended without success"
+            return result
+        if register:
+            result['warm'] = self.warm_model(model_name, instance_id, ollama_addr)
+            if not result['warm']['ok']:
+                result['ok'] = False
+                result['reason'] = f"warm-up failed: {result['warm']['reason']}"
+                return result
+            self.litellm.add_model(model_name, ollama_addr)
+        return result
+
+    def warm_model(self, model_name: str, instance_id: int, ollama_addr=None, options=None):
+        """
+        Loads a pulled model with `keep_alive` and checks that the server keeps it resident (`/api/ps`),
+        so the first request routed to it by LiteLLM does not pay for loading the weights.
+        :param ollama_addr: Address of the instance, looked up in the state when not given
+        :param options: Model options (num_ctx, num_batch) the model is loaded with
+        :return: Result dict with the model, instance ID, `ok`, the failure `reason`, the load time, the first
+                 token latency, the share of the weights in VRAM and when the model is unloaded
+        """
+        result = {'model': model_name, 'instance_id': instance_id, 'ok': False, 'reason': None, 'load_seconds': None,
+                  'first_token_seconds': None, 'seconds': None, 'gpu_share': None, 'expires_at': None}
+        ollama_addr = ollama_addr or (self.storage.get_instance(instance_id) or {}).get('ollama_addr')
+        if not ollama_addr:
+            result['reason'] = "ollama address not found"
+            return result
+
+        ollama_instance = OllamaInstance(ollama_addr)
+        try:
+            warm = ollama_instance.warm_model(model_name, self.keep_alive, options)
+            result.update(load_seconds=warm['load_seconds'], first_token_seconds=warm['first_token_seconds'], seconds=warm['seconds'])
+            if not warm['ok']:
+                result['reason'] = warm['error'] or "generation did not finish"
+                return result
+            running = {model['name']: model for model in ollama_instance.running_models()}
+        except Exception as e:
+            result['reason'] = str(e)
+            return result
+
+        loaded = running.get(ollama_model_name(model_name))
+        if not loaded:
+            result['reason'] = "model is not resident after loading"
+            return result
+        result['ok'] = True
+        result['gpu_share'] = loaded.get('size_vram', 0) / loaded['size'] if loaded.get('size') else None
+        result['expires_at'] = loaded.get('expires_at')
+        if result['gpu_share'] is not None and result['gpu_share'] < 1:
+            print(f"Warning: only {result['gpu_share']:.0%} of {model_name} is in VRAM on instance {instance_id}, the rest runs on the CPU.")
+        return result
+
+    def pull_many(self, pulls, max_workers=8):
+        """
+        Pulls (model name, instance ID) pairs concurrently, at most `per_host_limit` per instance,
+        with one aggregated progress display for all instances.
+        :return: List of result dicts, see `pull_model`
+        """
+        progress = PullProgress()
+
+        def pull(model_name, instance_id):
+            result = self.pull_model(model_name, instance_id, on_status=progress.tracker(instance_id, model_name))
+            progress.finish(instance_id, model_name, result['ok'], result['reason'])
+            return result
+
+        with ProgressDisplay(progress), ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pulls)))) as executor:
+            futures = [executor.submit(pull, model_name, instance_id) for model_name, instance_id in pulls]
+            return [future.result() for future in futures]
 
-        return True
+    def host_slot(self, ollama_addr):
+        """ Returns the semaphore limiting concurrent pulls on one ollama server. """
+        with self._host_slots_lock:
+            if ollama_addr not in self._host_slots:
+                self._host_slots[ollama_addr] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._host_slots[ollama_addr]
 
     def remove_model(self, model_name: str, instance_id: int):
         """
@@ -52,23 +168,48 @@ class ModelManager:
 
         # Create an instance of the OllamaInstance class
         ollama_instance = OllamaInstance(ollama_addr)
-        self.litellm.remove_model_by_id(model_name)
+        self.litellm.remove_model(model_name, ollama_addr)
         # Remove a model and print updates
         return ollama_instance.remove_model(model_name)
 
-    def models(self):
+    def models(self, instances, timeout=DEFAULT_LIST_TIMEOUT):
         """
-        List all models.
-        :return: List of models
+        List the models of all instances. The servers are asked concurrently and each gets `timeout`
+        seconds, so an unreachable instance (e.g. a dead tunnel) does not hold up the others.
+        :param instances: Instances with their `ollama_addr`, see InstanceManager.instances
+        :return: A row per model with its name, instance ID, size, quantization and the server's latency,
+                 and a row with the `error` for every instance that could not be listed
         """
-        instances = self.instances()
-        models = []
-        for instance in instances:
-            if instance['ollama_addr'] != '':
-                ollama_instance = OllamaInstance(instance['ollama_addr'])
-                list_of_models = ollama_instance.models()
-                for model in list_of_models:
-                    model['instance_id'] = instance['id']
-                models += list_of_models
-        return models
+        def list_models(instance):
+            start = time.monotonic()
+            tags = OllamaInstance(instance['ollama_addr']).models(timeout=(timeout, timeout))
+            return tags, time.monotonic() - start
 
+        listed = [instance for instance in instances if instance.get('ollama_addr')]
+        rows = {instance['id']: [{'instance_id': instance['id'], 'name': None, 'error': "no ollama address"}]
+                for instance in instances if not instance.get('ollama_addr')}
+        if listed:
+            executor = ThreadPoolExecutor(max_workers=min(len(listed), MAX_LIST_WORKERS))
+            futures = {instance['id']: executor.submit(list_models, instance) for instance in listed}
+            # The per-request timeout does not cover retries, so the whole listing gets a deadline too
+            wait(futures.values(), timeout=timeout * 2)
+            executor.shutdown(wait=False, cancel_futures=True)
+            for instance_id, future in futures.items():
+                if not future.done():
+                    rows[instance_id] = [{'instance_id': instance_id, 'name': None, 'error': f"unreachable: no answer within {timeout * 2:g}s"}]
+                elif future.exception():
+                    rows[instance_id] = [{'instance_id': instance_id, 'name': None, 'error': f"unreachable: {future.exception()}"}]
+                else:
+                    tags, latency = future.result()
+                    rows[instance_id] = [
+                        {
+                            'instance_id': instance_id,
+                            'name': tag.get('name'),
+                            'size': tag.get('size'),
+                            'quant': (tag.get('details') or {}).get('quantization_level'),
+                            'parameter_size': (tag.get('details') or {}).get('parameter_size'),
+                            'latency': latency,
+                        }
+                        for tag in tags
+                    ]
+        return [row for instance in instances for row in rows.get(instance['id'], [])]
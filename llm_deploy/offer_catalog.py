@@ -0,0 +1,69 @@
+from bisect import bisect_left, bisect_right
+
+# Offer fields the catalog keeps sorted indexes for
+INDEXED_FIELDS = ('gpu_total_ram', 'gpu_ram', 'dph_total', 'total_flops')
+
+
+def price_order(offer):
+    return offer['dph_total'], -offer['total_flops']
+
+
+class OfferCatalog:
+    """
+    In-memory snapshot of machine offers, indexed for range queries.
+
+    The allocator fetches one wide snapshot up front; every later lookup is a
+    bisect over one of the sorted indexes instead of another API call.
+    """
+
+    def __init__(self, offers):
+        self.offers = list(offers)
+        self._indexes = {}
+        for field in INDEXED_FIELDS:
+            ordered = sorted(self.offers, key=lambda offer: offer[field])
+            self._indexes[field] = ([offer[field] for offer in ordered], ordered)
+
+        # Cheapest offer (the faster one on equal prices) among those with at least the i-th smallest gpu_total_ram
+        self._by_price = sorted(self.offers, key=price_order)
+        _, by_total_ram = self._indexes['gpu_total_ram']
+        self._cheapest_from = [None] * (len(by_total_ram) + 1)
+        for i in range(len(by_total_ram) - 1, -1, -1):
+            cheapest = self._cheapest_from[i + 1]
+            if cheapest is None or price_order(by_total_ram[i]) < price_order(cheapest):
+                cheapest = by_total_ram[i]
+            self._cheapest_from[i] = cheapest
+
+    def __len__(self):
+        return len(self.offers)
+
+    def __iter__(self):
+        return iter(self.offers)
+
+    def range(self, field, low=None, high=None):
+        """ Returns the offers with low <= offer[field] <= high, ordered by that field. """
+        keys, ordered = self._indexes[field]
+        start = 0 if low is None else bisect_left(keys, low)
+        end = len(keys) if high is None else bisect_right(keys, high)
+        return ordered[start:end]
+
+    def with_min_total_ram(self, gpu_memory):
+        """ Offers with at least `gpu_memory` MB of total GPU RAM. """
+        return self.range('gpu_total_ram', low=gpu_memory)
+
+    def by_price(self):
+        """ All offers, cheapest first, faster machines first on equal prices. """
+        return self._by_price
+
+    def cheapest(self, gpu_memory=0, exclude=()):
+        """
+        Returns the cheapest offer with at least `gpu_memory` MB of total GPU RAM whose id is not in `exclude`,
+        the faster one on equal prices. Unless the cheapest one is excluded this is a single bisect.
+        """
+        keys, _ = self._indexes['gpu_total_ram']
+        cheapest = self._cheapest_from[bisect_left(keys, gpu_memory)]
+        if cheapest is None or cheapest['id'] not in exclude:
+            return cheapest
+        return next(
+            (offer for offer in self.by_price() if offer['gpu_total_ram'] >= gpu_memory and offer['id'] not in exclude),
+            None
+        )
@@ -1,19 +1,41 @@
-import requests
 import json
+import time
+from llm_deploy.http_client import get_http_client
 from llm_deploy.interfaces import OllamaInstanceInterface
 
+# Pulls and generations can stay silent for minutes (blob verification, model loading)
+STREAM_TIMEOUT = (10, 600)
+# Serving machines are sized for all of their models at once, so nothing has to be unloaded
+DEFAULT_KEEP_ALIVE = -1
+WARMUP_PROMPT = "Hi"
+
+
+def ollama_model_name(model):
+    """ Ollama lists tags pulled without a version as `<name>:latest`. """
+    return model if ':' in model else f"{model}:latest"
+
+
+def parse_keep_alive(value):
+    """ Ollama takes keep_alive as seconds or a duration string ("30m"); a negative value means forever. """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
 class OllamaInstance(OllamaInstanceInterface):
-    def __init__(self, address):
+    def __init__(self, address, http=None):
         self.address = address
+        self.http = http or get_http_client()
 
-    def pull_model(self, model_name):
+    def pull_model(self, model_name, timeout=STREAM_TIMEOUT):
         data = {"name": model_name}
-        response = requests.post(f"{self.address}/api/pull", json=data, stream=True)
+        response = self.http.post(f"{self.address}/api/pull", json=data, stream=True, timeout=timeout)
         return self._process_stream(response)
 
     def ollama_status(self):
         try:
-            response = requests.get(self.address)
+            response = self.http.get(self.address)
         except Exception as e:
             print(f"Error of getting ollama status: {e}")
             return None
@@ -22,32 +44,65 @@ class OllamaInstance(OllamaInstanceInterface):
         else:
             return "stopped"
 
-    def models(self):
-        response = requests.get(f"{self.address}/api/tags")
+    def models(self, timeout=None):
+        kwargs = {'timeout': timeout} if timeout else {}
+        response = self.http.get(f"{self.address}/api/tags", **kwargs)
         return response.json()["models"]
 
     def test_model(self, model_name):
         data = {"model": model_name, "prompt": "Who is the president of the United States?"}
-        response = requests.post(f"{self.address}/api/generate", json=data, stream=True)
+        response = self.http.post(f"{self.address}/api/generate", json=data, stream=True, timeout=STREAM_TIMEOUT)
         return self._process_test_stream(response)
 
+    def warm_model(self, model_name, keep_alive=DEFAULT_KEEP_ALIVE, options=None):
+        """
+        Loads the model with the given `options` (e.g. num_ctx) and generates a single token, keeping it
+        loaded for `keep_alive`.
+        Returns a dict with `ok`, the `error`, ollama's `load_seconds`, and the `first_token_seconds`
+        and `seconds` measured from the request, so the first token latency includes the load.
+        """
+        result = {'ok': False, 'error': None, 'load_seconds': None, 'first_token_seconds': None, 'seconds': None}
+        data = {"model": model_name, "prompt": WARMUP_PROMPT, "keep_alive": keep_alive, "options": dict(options or {}, num_predict=1)}
+        start = time.monotonic()
+        response = self.http.post(f"{self.address}/api/generate", json=data, stream=True, timeout=STREAM_TIMEOUT)
+        for status in self._process_stream(response):
+            if 'error' in status:
+                result['error'] = status['error']
+                break
+            if result['first_token_seconds'] is None and (status.get('response') or status.get('done')):
+                result['first_token_seconds'] = time.monotonic() - start
+            if status.get('done'):
+                result['ok'] = True
+                result['load_seconds'] = status.get('load_duration', 0) / 1e9
+        result['seconds'] = time.monotonic() - start
+        return result
+
+    def running_models(self):
+        """ Models loaded in memory (`/api/ps`), with their `size`, `size_vram` and `expires_at`. """
+        response = self.http.get(f"{self.address}/api/ps")
+        return response.json()["models"]
+
     def remove_model(self, model_name):
         data = {"name": model_name}
-        response = requests.delete(f"{self.address}/api/delete", json=data)
+        response = self.http.delete(f"{self.address}/api/delete", json=data)
         # check if the response is 200 return True
         if response.status_code == 200:
             return True
         return False
 
     def _process_stream(self, response):
-        if response.status_code != 200:
-            yield {"error": response.text}
+        # Closing the generator early (e.g. on a stalled pull) releases the connection
+        try:
+            if response.status_code != 200:
+                yield {"error": response.text}
 
-        for line in response.iter_lines():
-            if line:
-                decoded_line = line.decode("utf-8")
-                status = json.loads(decoded_line)
-                yield status
+            for line in response.iter_lines():
+                if line:
+                    decoded_line = line.decode("utf-8")
+                    status = json.loads(decoded_line)
+                    yield status
+        finally:
+            response.close()
 
     def _process_test_stream(self, response):
         if response.status_code != 200:
@@ -0,0 +1,136 @@
+import json
+import math
+
+from llm_deploy.gguf import GGUFFile, GGUFTruncatedError
+from llm_deploy.http_client import get_http_client
+
+OLLAMA_REGISTRY_URL = "https://registry.ollama.ai"
+MANIFEST_MEDIA_TYPE = "application/vnd.docker.distribution.manifest.v2+json"
+MODEL_LAYER_MEDIA_TYPE = "application/vnd.ollama.image.model"
+PARAMS_LAYER_MEDIA_TYPE = "application/vnd.ollama.image.params"
+
+# The GGUF header (metadata + tensor infos) is read with growing range requests
+HEADER_READ_SIZES = [4 * 1024 * 1024, 16 * 1024 * 1024, 64 * 1024 * 1024]
+
+
+class OllamaRegistry:
+    """
+    Reads model manifests and blobs from an Ollama registry.
+
+    The manifest of a tag lists the digest and size of every layer, so a single
+    request gives the exact download size. The architecture is read from the
+    GGUF header at the start of the model blob with range requests, so the
+    weights themselves are never downloaded.
+
+    `base_url` can point to any registry speaking the same protocol, e.g. a
+    local stand-in in tests.
+    """
+
+    def __init__(self, base_url=None, cache=None, timeout=30, http=None):
+        self.base_url = (base_url or OLLAMA_REGISTRY_URL).rstrip("/")
+        self.cache = cache
+        self.timeout = timeout
+        self.http = http or get_http_client()
+        self._model_infos = {}  # Model infos already resolved in this process
+
+    def parse_model_name(self, model: str) -> tuple:
+        """
+        Splits an ollama model name into namespace, name and tag, e.g.
+        "mixtral:8x7b-text-v0.1-q5_K_M" -> ("library", "mixtral", "8x7b-text-v0.1-q5_K_M").
+        """
+        name, _, tag = model.partition(":")
+        parts = name.split("/")
+        if len(parts) == 1:
+            return "library", parts[0], tag or "latest"
+        if len(parts) == 2:
+            return parts[0], parts[1], tag or "latest"
+        raise ValueError(f"Unsupported model name for the Ollama registry: {model}")
+
+    def manifest(self, model: str) -> dict:
+        """ Retrieves the manifest of a model tag. """
+        namespace, name, tag = self.parse_model_name(model)
+        url = f"{self.base_url}/v2/{namespace}/{name}/manifests/{tag}"
+
+        def fetch():
+            response = self.http.get(url, headers={"Accept": MANIFEST_MEDIA_TYPE}, timeout=self.timeout)
+            if response.status_code == 404:
+                raise ValueError(f"Model {model} not found in the Ollama registry.")
+            response.raise_for_status()
+            return response.json()
+
+        return self.cache.get_or_fetch(url, fetch) if self.cache else fetch()
+
+    def blob(self, model: str, digest: str) -> bytes:
+        """ Downloads a (small) blob such as the config or params layer. """
+        namespace, name, _ = self.parse_model_name(model)
+        response = self.http.get(f"{self.base_url}/v2/{namespace}/{name}/blobs/{digest}", timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    def blob_head(self, model: str, digest: str, size: int) -> bytes:
+        """ Downloads only the first `size` bytes of a blob. """
+        namespace, name, _ = self.parse_model_name(model)
+        url = f"{self.base_url}/v2/{namespace}/{name}/blobs/{digest}"
+        with self.http.get(url, headers={"Range": f"bytes=0-{size - 1}"}, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            # Servers that ignore the range header would send the whole blob, so stop reading after `size` bytes
+            data = bytearray()
+            for chunk in response.iter_content(chunk_size=1024 * 1024):
+                data += chunk
+                if len(data) >= size:
+                    break
+            return bytes(data[:size])
+
+    def model_config(self, model: str, digest: str, blob_size: int) -> dict:
+        """
+        Reads the model configuration from the GGUF header of the model blob.
+        Blobs are content-addressed, so the result is cached forever.
+        """
+        def fetch():
+            for read_size in HEADER_READ_SIZES:
+                header = self.blob_head(model, digest, min(read_size, blob_size))
+                try:
+                    return GGUFFile.from_buffer(header).model_config()
+                except GGUFTruncatedError:
+                    if read_size >= blob_size:
+                        raise
+            raise ValueError(f"GGUF header of {model} is larger than {HEADER_READ_SIZES[-1]} bytes.")
+
+        key = f"gguf-config:{digest}"
+        return self.cache.get_or_fetch(key, fetch, ttl=math.inf) if self.cache else fetch()
+
+    def model_info(self, model: str) -> dict:
+        """
+        Returns the exact download size, the model layer and the architecture of a model tag.
+        """
+        if model in self._model_infos:
+            return self._model_infos[model]
+
+        manifest = self.manifest(model)
+        layers = manifest.get("layers", [])
+        model_layer = next((layer for layer in layers if layer.get("mediaType") == MODEL_LAYER_MEDIA_TYPE), None)
+        if model_layer is None:
+            raise ValueError(f"Manifest of {model} has no model layer.")
+
+        params = {}
+        params_layer = next((layer for layer in layers if layer.get("mediaType") == PARAMS_LAYER_MEDIA_TYPE), None)
+        if params_layer is not None:
+            params = self._cached_blob_json(model, params_layer["digest"])
+
+        download_size = sum(layer.get("size", 0) for layer in layers) + manifest.get("config", {}).get("size", 0)
+        self._model_infos[model] = {
+            "model": model,
+            "download_size": download_size,
+            "model_digest": model_layer["digest"],
+            "model_blob_size": model_layer["size"],
+            "params": params,
+            "config": self.model_config(model, model_layer["digest"], model_layer["size"]),
+        }
+        return self._model_infos[model]
+
+    def _cached_blob_json(self, model, digest):
+        def fetch():
+            return json.loads(self.blob(model, digest))
+
+        key = f"blob:{digest}"
+        return self.cache.get_or_fetch(key, fetch, ttl=math.inf) if self.cache else fetch()
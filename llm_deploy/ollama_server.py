@@ -0,0 +1,125 @@
+from llm_deploy.llm_calculator import KV_CACHE_BYTES
+from llm_deploy.ollama import DEFAULT_KEEP_ALIVE
+
+# Cache types ollama accepts in OLLAMA_KV_CACHE_TYPE
+OLLAMA_KV_CACHE_TYPES = ('f16', 'q8_0', 'q4_0')
+# Model options used when llms.yaml does not set them
+DEFAULT_NUM_CTX = 8192
+DEFAULT_BATCH = 512
+
+
+class OllamaServerSettings:
+    """
+    Runtime settings of the ollama servers on rented machines.
+
+    The same settings size the models (`sizing`), become the server's environment (`env`) and the
+    options models are loaded with (`options`), so the memory the allocator plans for is the memory
+    ollama allocates:
+    - `num_parallel`: request slots per loaded model; every slot gets its own context, so the KV
+      cache and the buffers grow with it;
+    - `flash_attention`: required by ollama for a quantized KV cache, it falls back to f16 without it;
+    - `kv_cache_type`: f16, q8_0 or q4_0;
+    - `keep_alive`: how long idle models stay loaded;
+    - `num_ctx` and `batch`: context length and batch size of models that do not set their own.
+    OLLAMA_MAX_LOADED_MODELS is set to the number of models allocated to the machine, so ollama
+    does not evict models the allocator packed together.
+
+    Models in llms.yaml may override `num_ctx`, `num_parallel`, `kv_cache_type` and `batch`. The
+    parallel slots and the KV cache type are server-wide, so only models that agree on them
+    (the same `group`) can share a machine.
+    """
+
+    def __init__(self, num_parallel=1, flash_attention=True, kv_cache_type='f16', keep_alive=DEFAULT_KEEP_ALIVE,
+                 num_ctx=DEFAULT_NUM_CTX, batch=DEFAULT_BATCH):
+        if num_parallel < 1:
+            raise ValueError(f"num_parallel must be at least 1, got {num_parallel}")
+        if kv_cache_type not in OLLAMA_KV_CACHE_TYPES:
+            raise ValueError(f"Unknown KV cache type: {kv_cache_type}, expected one of {', '.join(OLLAMA_KV_CACHE_TYPES)}")
+        self.num_parallel = num_parallel
+        self.flash_attention = flash_attention
+        self.kv_cache_type = kv_cache_type
+        self.keep_alive = keep_alive
+        self.num_ctx = num_ctx
+        self.batch = batch
+
+    @property
+    def effective_kv_cache_type(self):
+        """ The KV cache type ollama actually uses. """
+        return self.kv_cache_type if self.flash_attention else 'f16'
+
+    def model_settings(self, model=None):
+        """ The `num_ctx`, `num_parallel`, `kv_cache_type` and `batch` a model runs with. """
+        model = model or {}
+        kv_cache_type = model.get('kv_cache_type') or self.kv_cache_type
+        return {
+            'num_ctx': model.get('num_ctx') or self.num_ctx,
+            'num_parallel': model.get('num_parallel') or self.num_parallel,
+            'kv_cache_type': kv_cache_type if self.flash_attention else 'f16',
+            'batch': model.get('batch') or self.batch,
+        }
+
+    def group(self, model=None):
+        """ The server-wide settings a model needs: (parallel slots, KV cache type). """
+        settings = self.model_settings(model)
+        return settings['num_parallel'], settings['kv_cache_type']
+
+    def sizing(self, model=None):
+        """ Keyword arguments of `LLMCalculator.calculate`, `calculate_footprint` and `model_option` for a model. """
+        settings = self.model_settings(model)
+        return {
+            'context': settings['num_ctx'],
+            'num_parallel': settings['num_parallel'],
+            'kv_cache_type': settings['kv_cache_type'],
+            'bsz': settings['batch'],
+        }
+
+    def options(self, model=None):
+        """
+        Ollama request options of a model. Ollama reloads a model whose options change, so the warm-up
+        and every request routed through LiteLLM have to use the same ones. The batch size is only
+        passed when it differs from ollama's default.
+        """
+        settings = self.model_settings(model)
+        options = {'num_ctx': settings['num_ctx']}
+        if settings['batch'] != DEFAULT_BATCH:
+            options['num_batch'] = settings['batch']
+        return options
+
+    def env(self, models=None):
+        """
+        Environment of an ollama server holding `models` (the allocation of its machine, all of one group).
+        Without models ollama picks the number of loaded models itself.
+        """
+        num_parallel, kv_cache_type = self.group(models[0] if models else None)
+        env = {
+            'OLLAMA_NUM_PARALLEL': str(num_parallel),
+            'OLLAMA_KEEP_ALIVE': str(self.keep_alive),
+            'OLLAMA_FLASH_ATTENTION': '1' if self.flash_attention else '0',
+            'OLLAMA_KV_CACHE_TYPE': kv_cache_type,
+        }
+        if models:
+            env['OLLAMA_MAX_LOADED_MODELS'] = str(len(models))
+        return env
+
+    def compatible(self, env, model):
+        """ Whether a server started with `env` runs the model with its settings; unknown envs are accepted. """
+        if not env:
+            return True
+        num_parallel, kv_cache_type = self.group(model)
+        return env.get('OLLAMA_NUM_PARALLEL') == str(num_parallel) and env.get('OLLAMA_KV_CACHE_TYPE') == kv_cache_type
+
+    def holds(self, env, count):
+        """
+        Whether a server started with `env` keeps `count` models loaded at once. Its OLLAMA_MAX_LOADED_MODELS
+        was set for the allocation it was rented for; more models would make ollama evict one of them.
+        """
+        max_loaded = (env or {}).get('OLLAMA_MAX_LOADED_MODELS')
+        return not max_loaded or count <= int(max_loaded)
+
+    def describe(self):
+        kv_bits = KV_CACHE_BYTES[self.effective_kv_cache_type] * 8
+        return (
+            f"{self.num_parallel} parallel request(s) per model, flash attention {'on' if self.flash_attention else 'off'}, "
+            f"{self.effective_kv_cache_type} KV cache ({kv_bits:.1f} bits per element), keep alive {self.keep_alive}; "
+            f"models default to a {self.num_ctx} token context and batches of {self.batch}"
+        )
@@ -0,0 +1,135 @@
+import queue
+import threading
+import time
+
+
+class Stage:
+    """
+    One step of a pipeline: a handler run by `concurrency` worker threads on the items of its queue.
+
+    The handler returns the items for the next stage as a list, so one item may fan out into
+    several (a machine into its models) or be filtered out (an empty list). Raising marks the
+    item as failed.
+    """
+
+    def __init__(self, name, handler, concurrency=1):
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.queue = queue.Queue()
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.busy_seconds = 0.0
+        self.first_done = None  # Seconds after the start of the pipeline
+        self.last_done = None
+        self._lock = threading.Lock()
+
+    def record(self, outcome, busy_seconds=0.0, done_at=None):
+        """ Counts a processed, failed or skipped item. """
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+            if outcome == 'processed':
+                self.busy_seconds += busy_seconds
+                if self.first_done is None:
+                    self.first_done = done_at
+                self.last_done = done_at
+
+    def timings(self):
+        return {
+            'stage': self.name,
+            'concurrency': self.concurrency,
+            'processed': self.processed,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'busy_seconds': self.busy_seconds,
+            'avg_seconds': self.busy_seconds / self.processed if self.processed else 0.0,
+            'first_done': self.first_done,
+            'last_done': self.last_done,
+        }
+
+
+class Pipeline:
+    """
+    Runs items through a chain of stages connected by queues.
+
+    Every stage has its own worker threads, so an item moves on as soon as its stage is done with
+    it: the first machine's models are pulled while other machines are still booting. Items may
+    enter at any stage. With `stop_on_error`, the first failure stops the pipeline: queued items
+    are skipped, items in progress finish their current stage.
+    """
+
+    def __init__(self, stages, stop_on_error=True):
+        self.stages = stages
+        self.stop_on_error = stop_on_error
+        self.failed = threading.Event()
+        self._pending = 0
+        self._done = threading.Condition()
+        self._start = None
+
+    def stage(self, name):
+        return next(stage for stage in self.stages if stage.name == name)
+
+    def run(self, items):
+        """
+        Processes the (stage name, item) pairs until every queue is drained.
+
+        Returns:
+            bool: Whether no item failed.
+        """
+        self._start = time.monotonic()
+        for name, item in items:
+            self._put(self.stage(name), item)
+
+        workers = []
+        for index, stage in enumerate(self.stages):
+            next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+            for _ in range(stage.concurrency):
+                worker = threading.Thread(target=self._work, args=(stage, next_stage), daemon=True)
+                worker.start()
+                workers.append(worker)
+
+        with self._done:
+            self._done.wait_for(lambda: self._pending == 0)
+        for stage in self.stages:
+            for _ in range(stage.concurrency):
+                stage.queue.put(None)
+        for worker in workers:
+            worker.join()
+        return not self.failed.is_set()
+
+    def timings(self):
+        """ Per-stage counters: items processed, failed and skipped, busy time and completion times. """
+        return [stage.timings() for stage in self.stages]
+
+    def _put(self, stage, item):
+        with self._done:
+            self._pending += 1
+        stage.queue.put(item)
+
+    def _work(self, stage, next_stage):
+        while True:
+            item = stage.queue.get()
+            if item is None:
+                return
+            try:
+                if self.stop_on_error and self.failed.is_set():
+                    stage.record('skipped')
+                    continue
+                started = time.monotonic()
+                try:
+                    results = stage.handler(item) or []
+                except Exception as e:
+                    print(f"[{stage.name}] failed: {e}")
+                    stage.record('failed')
+                    self.failed.set()
+                    continue
+                finished = time.monotonic()
+                stage.record('processed', finished - started, finished - self._start)
+                if next_stage:
+                    for result in results:
+                        self._put(next_stage, result)
+            finally:
+                with self._done:
+                    self._pending -= 1
+                    self._done.notify_all()
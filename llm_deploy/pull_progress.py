@@ -0,0 +1,133 @@
+import sys
+import threading
+import time
+from collections import deque
+
+from llm_deploy.utils import format_bytes, format_duration
+
+
+class PullProgress:
+    """
+    Aggregates the status streams of concurrent ollama pulls.
+
+    Every pull reports through the callback returned by `tracker`; the status lines carry the layer
+    digest with its total and completed bytes. `snapshot` sums them up per instance and for the
+    whole fleet, with the throughput over the last `window` seconds and the resulting ETA.
+    """
+
+    def __init__(self, window=10):
+        self.window = window
+        self._layers = {}  # Maps (instance, model, digest) to [completed, total]
+        self._models = {}  # Maps (instance, model) to 'pulling', 'done' or the failure reason
+        self._samples = {}  # Maps instance (None for the fleet) to (time, completed bytes) samples
+        self._lock = threading.Lock()
+
+    def tracker(self, instance, model):
+        """ Returns the `on_status` callback for one pull. """
+        with self._lock:
+            self._models[(instance, model)] = 'pulling'
+
+        def on_status(status):
+            if 'digest' in status and status.get('total'):
+                with self._lock:
+                    self._layers[(instance, model, status['digest'])] = [status.get('completed') or 0, status['total']]
+        return on_status
+
+    def finish(self, instance, model, ok, reason=None):
+        with self._lock:
+            self._models[(instance, model)] = 'done' if ok else (reason or 'failed')
+            if ok:
+                # A finished pull has all its layers, even if the last status line did not say so
+                for key, layer in self._layers.items():
+                    if key[:2] == (instance, model):
+                        layer[0] = layer[1]
+
+    def snapshot(self):
+        """
+        Returns per-instance rows and a fleet row with the bytes done and total, MB/s, ETA in seconds
+        (None while unknown) and the number of active and failed pulls.
+        """
+        now = time.monotonic()
+        with self._lock:
+            rows = {}
+            for (instance, model, _), (completed, total) in self._layers.items():
+                row = rows.setdefault(instance, {'instance': instance, 'done': 0, 'total': 0})
+                row['done'] += completed
+                row['total'] += total
+            for (instance, model), state in self._models.items():
+                row = rows.setdefault(instance, {'instance': instance, 'done': 0, 'total': 0})
+                row['active'] = row.get('active', 0) + (state == 'pulling')
+                row['failed'] = row.get('failed', 0) + (state not in ('pulling', 'done'))
+
+            fleet = {'instance': None, 'done': 0, 'total': 0, 'active': 0, 'failed': 0}
+            for row in rows.values():
+                for key in ('done', 'total', 'active', 'failed'):
+                    fleet[key] += row.get(key, 0)
+
+            result = []
+            for row in list(rows.values()) + [fleet]:
+                row.setdefault('active', 0)
+                row.setdefault('failed', 0)
+                samples = self._samples.setdefault(row['instance'], deque())
+                samples.append((now, row['done']))
+                while len(samples) > 2 and now - samples[0][0] > self.window:
+                    samples.popleft()
+                elapsed = now - samples[0][0]
+                row['rate'] = (row['done'] - samples[0][1]) / elapsed if elapsed > 0 else 0.0
+                remaining = row['total'] - row['done']
+                row['eta'] = remaining / row['rate'] if row['rate'] > 0 else (0 if remaining <= 0 else None)
+                result.append(row)
+        return result
+
+    def lines(self):
+        """ Renders the snapshot as one line per instance and a fleet line. """
+        lines = []
+        for row in self.snapshot():
+            name = "fleet" if row['instance'] is None else f"instance {row['instance']}"
+            eta = format_duration(row['eta']) if row['eta'] is not None else '?'
+            failed = f", {row['failed']} failed" if row['failed'] else ""
+            lines.append(
+                f"{name:>18}: {format_bytes(row['done'])} / {format_bytes(row['total'])} "
+                f"{row['rate'] / 1e6:6.1f} MB/s ETA {eta} ({row['active']} pulling{failed})"
+            )
+        return lines
+
+
+class ProgressDisplay:
+    """
+    Shows the lines of a PullProgress while it is used as a context manager. On a terminal they are
+    redrawn in place as one status line every `interval` seconds, so progress lines of other threads
+    are not overwritten; otherwise the full block is printed every `log_interval` seconds.
+    """
+
+    def __init__(self, progress, interval=1, log_interval=30, stream=None):
+        self.progress = progress
+        self.interval = interval
+        self.log_interval = log_interval
+        self.stream = stream or sys.stdout
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        if self.stream.isatty():
+            self.stream.write("\r\x1b[2K")
+        self.stream.write("\n".join(self.progress.lines()) + "\n")
+        self.stream.flush()
+
+    def _run(self):
+        interactive = self.stream.isatty()
+        while not self._stop.wait(self.interval if interactive else self.log_interval):
+            lines = self.progress.lines()
+            if interactive:
+                # The fleet line first, it is the one that matters when the terminal is narrow
+                self.stream.write("\r\x1b[2K" + " | ".join(line.strip() for line in lines[-1:] + lines[:-1]))
+            else:
+                self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
@@ -0,0 +1,136 @@
+import random
+import time
+
+import requests
+
+from llm_deploy.ollama import ollama_model_name
+
+DEFAULT_STALL_TIMEOUT = 60  # seconds without new bytes or a new status before a pull counts as stalled
+DEFAULT_RETRIES = 4
+DEFAULT_BACKOFF = 2  # seconds before the first retry, doubled for every further one
+DEFAULT_MAX_BACKOFF = 60
+
+# Errors retrying can not fix: the tag does not exist or the server refuses it
+FATAL_ERRORS = ("file does not exist", "not found", "invalid model name", "unauthorized")
+
+
+class PullStalled(Exception):
+    pass
+
+
+class PullSupervisor:
+    """
+    Supervises `/api/pull` streams of one ollama server.
+
+    A pull that makes no progress (no new completed bytes and no new status) for `stall_timeout`
+    seconds, loses its connection or reports a transient error is started again after an
+    exponential, jittered backoff. Ollama keeps partially downloaded blobs, so a retry resumes
+    where the previous attempt stopped. A pull only succeeds when the stream went through
+    ollama's sha256 verification and ended with `success`, and the tag is listed by the server
+    afterwards.
+
+    Throughput is recorded per layer: the bytes downloaded by this pull (not the ones resumed
+    from disk) and the time it took.
+    """
+
+    def __init__(self, ollama_instance, stall_timeout=DEFAULT_STALL_TIMEOUT, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF):
+        self.ollama = ollama_instance
+        self.stall_timeout = stall_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def statuses(self, model_name, result):
+        """
+        Yields the pull statuses of all attempts. Fills `result` with `ok`, the failure `reason`,
+        `bytes`, `attempts` and `layers` (digest, total and downloaded bytes, seconds, bytes per second).
+        """
+        layers = {}
+        result.update(ok=False, attempts=0, layers=[])
+        for attempt in range(self.retries + 1):
+            result['attempts'] = attempt + 1
+            result['reason'] = None
+            verified = succeeded = False
+            try:
+                for status in self._attempt(model_name, layers):
+                    if 'error' in status:
+                        result['reason'] = status['error']
+                    elif status.get('status') == 'verifying sha256 digest':
+                        verified = True
+                    elif status.get('status') == 'success':
+                        succeeded = True
+                    yield status
+            except PullStalled as e:
+                result['reason'] = str(e)
+            except requests.exceptions.RequestException as e:
+                result['reason'] = f"connection failed: {e}"
+
+            if succeeded:
+                # Models that were already complete skip the download and its verification
+                if not verified and any(layer['downloaded'] for layer in layers.values()):
+                    result['reason'] = "pull finished without verifying the downloaded blobs"
+                elif not self._listed(model_name):
+                    result['reason'] = "pulled model is not listed by the server"
+                else:
+                    result['ok'] = True
+                    break
+
+            result['reason'] = result['reason'] or "pull ended without success"
+            if any(error in result['reason'].lower() for error in FATAL_ERRORS) or attempt == self.retries:
+                break
+            delay = min(self.backoff * 2 ** attempt, self.max_backoff) * random.uniform(0.5, 1)
+            print(f"Pull of {model_name} failed ({result['reason']}), retrying in {delay:.0f}s (attempt {attempt + 2}/{self.retries + 1})")
+            time.sleep(delay)
+
+        result['bytes'] = sum(layer['total'] for layer in layers.values())
+        result['layers'] = [
+            {
+                'digest': digest,
+                'total': layer['total'],
+                'downloaded': layer['downloaded'],
+                'seconds': layer['seconds'],
+                'rate': layer['downloaded'] / layer['seconds'] if layer['seconds'] else 0.0,
+            }
+            for digest, layer in layers.items()
+        ]
+
+    def _attempt(self, model_name, layers):
+        """ Streams one pull, raising PullStalled when it stops making progress. """
+        # No line at all within the stall timeout surfaces as a read timeout
+        stream = self.ollama.pull_model(model_name, timeout=(10, self.stall_timeout))
+        last_progress, last_status = time.monotonic(), None
+        for layer in layers.values():
+            layer['seen'] = None
+        try:
+            for status in stream:
+                now = time.monotonic()
+                progressed = status.get('status') != last_status
+                last_status = status.get('status')
+
+                digest = status.get('digest')
+                if digest and status.get('total'):
+                    completed = status.get('completed') or 0
+                    layer = layers.setdefault(digest, {'total': status['total'], 'downloaded': 0, 'seconds': 0.0, 'completed': completed, 'seen': None})
+                    if layer['seen'] is None or completed < layer['completed']:
+                        # First status of the layer in this attempt; a resumed blob may restart at a part boundary
+                        layer['seen'], layer['completed'] = now, completed
+                    elif completed > layer['completed']:
+                        layer['downloaded'] += completed - layer['completed']
+                        layer['seconds'] += now - layer['seen']
+                        layer['seen'], layer['completed'] = now, completed
+                        progressed = True
+
+                if progressed:
+                    last_progress = now
+                elif now - last_progress > self.stall_timeout:
+                    raise PullStalled(f"no progress for {self.stall_timeout}s")
+                yield status
+        finally:
+            stream.close()
+
+    def _listed(self, model_name):
+        try:
+            names = {model['name'] for model in self.ollama.models()}
+        except requests.exceptions.RequestException:
+            return False
+        return ollama_model_name(model_name) in names
@@ -0,0 +1,420 @@
+import threading
+import time
+
+from llm_deploy.allocation_engines import MachineBin, sort_decreasing
+from llm_deploy.model_manager import DEFAULT_LIST_TIMEOUT
+from llm_deploy.ollama import ollama_model_name
+from llm_deploy.pipeline import Pipeline, Stage
+from llm_deploy.pull_progress import PullProgress, ProgressDisplay
+from llm_deploy.utils import format_duration, print_stage_timings, print_pull_results, print_warmup_results
+from llm_deploy.vastai import gpu_total_ram
+
+# Disk space needed next to the model blobs for the ollama image and its runtime files
+DISK_OVERHEAD_MB = 4096
+# Rough durations used to estimate how long applying a plan takes
+INSTANCE_BOOT_SECONDS = 180
+REMOVE_SECONDS = 2
+DESTROY_SECONDS = 5
+DEFAULT_INTERNET_SPEED = 100  # Mbps, for machines that do not report their download speed
+
+# Order in which plan actions run: free VRAM and disk first, rent new machines last
+ACTION_ORDER = ('remove', 'destroy', 'reuse', 'pull', 'create')
+# Stages a machine goes through; offers are selected by the plan beforehand
+PROVISION_STAGES = ('rent', 'boot', 'ready', 'pull', 'warm', 'register')
+# Renting and LiteLLM registration are quick API calls that do not need a worker per machine
+DEFAULT_STAGE_LIMITS = {'rent': 2, 'register': 2}
+
+
+def disk_space_for(models):
+    """
+    Disk space in GB for a machine: the exact registry download size of its models plus the ollama image.
+    Models the registry does not know fall back to their VRAM size plus a safety margin.
+    """
+    if all(model.get('download_size') for model in models):
+        return (sum(model['download_size'] for model in models) + DISK_OVERHEAD_MB) / 1024
+    return (sum(model['size'] for model in models) + 5000) / 1024
+
+
+def download_seconds(models, internet_speed):
+    """ Estimated time to download the models at the machine's download speed (Mbps). """
+    megabytes = sum(model.get('download_size') or model['size'] for model in models)
+    return megabytes * 8 / (internet_speed or DEFAULT_INTERNET_SPEED)
+
+
+class Reconciler:
+    """
+    Brings the running fleet in line with llms.yaml by applying only the difference.
+
+    `plan` diffs the allocator's desired models against the instances reported by vast and
+    the state database, and the models their ollama servers hold. The plan is a list of actions:
+    - `reuse`: an instance keeps desired models it already serves;
+    - `pull`: a missing model goes onto an existing instance that has room for it;
+    - `remove`: a model that is no longer desired is deleted from an instance;
+    - `destroy`: an instance left without desired models is destroyed;
+    - `create`: a machine is rented for the models no existing instance can take.
+    Every action carries its price per hour and an estimated duration. `apply` runs the plan;
+    new machines and pulls onto existing instances go through a staged pipeline (see `provision`)
+    with up to `max_workers` items per stage unless `stage_limits` says otherwise.
+
+    Instances without an ollama address or whose server does not answer within `list_timeout`
+    seconds are left untouched; the models recorded for them in the state database still count
+    as served.
+    """
+
+    def __init__(self, allocator, instance_manager, model_manager, max_workers=4, stage_limits=None, list_timeout=DEFAULT_LIST_TIMEOUT):
+        self.allocator = allocator
+        self.instance_manager = instance_manager
+        self.model_manager = model_manager
+        self.storage = instance_manager.storage
+        self.max_workers = max_workers  # Maximum number of machines provisioned at the same time
+        self.stage_limits = dict(DEFAULT_STAGE_LIMITS, **(stage_limits or {}))  # Worker threads per stage
+        self.list_timeout = list_timeout  # Seconds each ollama server gets to list its models
+        self._print_lock = threading.Lock()
+        self.registered = []  # Deployments registered by the last `provision`
+
+    def current_fleet(self):
+        """
+        Returns the running instances as dicts with the instance `id`, the `machine` in offer format,
+        the `models` it holds (ollama name to size in MB) and whether its ollama server is `reachable`.
+        """
+        instances = []
+        for instance in self.instance_manager.instances():
+            if instance.get('ollama_addr'):
+                instances.append(instance)
+            else:
+                print(f"Skipping instance {instance['id']}: no ollama address in state.")
+        # All servers are asked at once, so a dead tunnel costs `list_timeout` instead of stalling the plan
+        rows = {}
+        for row in self.model_manager.models(instances, timeout=self.list_timeout):
+            rows.setdefault(row['instance_id'], []).append(row)
+
+        fleet = []
+        for instance in instances:
+            machine = dict(instance)
+            machine['gpu_total_ram'] = gpu_total_ram(instance)
+
+            state = self.storage.get_instance(instance['id']) or {}
+            machine['server_env'] = state.get('server_env')
+            listed = rows.get(instance['id'], [])
+            errors = [row['error'] for row in listed if row.get('error')]
+            if errors:
+                print(f"Ollama on instance {instance['id']} is not reachable, leaving it as is: {errors[0]}")
+                models = {ollama_model_name(name): 0 for name in state.get('models', [])}
+                reachable = False
+            else:
+                models = {row['name']: (row.get('size') or 0) / 1024 / 1024 for row in listed}
+                reachable = True
+            fleet.append({'id': instance['id'], 'machine': machine, 'models': models, 'reachable': reachable})
+        return fleet
+
+    def plan(self):
+        """
+        Builds the plan for the desired models.
+
+        Returns:
+            dict: `actions`, the desired models that fit no offer (`unallocated`), the price per hour
+            of the fleet now (`current_cost`) and after the plan (`cost`), and the estimated `seconds`.
+        """
+        # `quant: auto` models get their tag before they are matched against the running instances
+        self.allocator.choose_quants()
+        fleet = self.current_fleet()
+        bins = {entry['id']: MachineBin(entry['machine']) for entry in fleet}
+        pulls = {entry['id']: [] for entry in fleet}
+
+        # Keep desired models on the instances that already serve them
+        pending = []
+        for model in sort_decreasing(self.allocator.desired_models):
+            name = ollama_model_name(model['model'])
+            entry = next((e for e in fleet if name in e['models'] and self.serves(e, model, bins[e['id']])), None)
+            if entry:
+                bins[entry['id']].models.append(model)
+            else:
+                pending.append(model)
+
+        # Pull the others onto reachable instances with room for them, tightest fit first
+        unplaced = []
+        for model in pending:
+            candidates = [
+                e for e in fleet
+                if e['reachable'] and self.serves(e, model, bins[e['id']]) and self.has_disk_for(e, bins[e['id']].models + [model])
+            ]
+            if candidates:
+                entry = min(candidates, key=lambda e: bins[e['id']].free - model['size'])
+                bins[entry['id']].models.append(model)
+                pulls[entry['id']].append(model)
+            else:
+                unplaced.append(model)
+
+        actions = []
+        for entry in fleet:
+            machine_bin, machine = bins[entry['id']], entry['machine']
+            if not machine_bin.models:
+                if entry['reachable']:
+                    actions.append({'action': 'destroy', 'instance_id': entry['id'], 'models': [],
+                                    'cost': -machine['dph_total'], 'seconds': DESTROY_SECONDS})
+                continue
+
+            kept = [model for model in machine_bin.models if model not in pulls[entry['id']]]
+            if kept:
+                actions.append({'action': 'reuse', 'instance_id': entry['id'], 'models': kept, 'cost': 0, 'seconds': 0})
+            for model in pulls[entry['id']]:
+                actions.append({'action': 'pull', 'instance_id': entry['id'], 'models': [model], 'cost': 0,
+                                'seconds': download_seconds([model], machine.get('inet_down'))})
+            if entry['reachable']:
+                desired = {ollama_model_name(model['model']) for model in machine_bin.models}
+                for name in entry['models']:
+                    if name not in desired:
+                        actions.append({'action': 'remove', 'instance_id': entry['id'], 'models': [{'model': name}],
+                                        'cost': 0, 'seconds': REMOVE_SECONDS})
+
+        unallocated = []
+        if unplaced:
+            allocations, machines = self.allocator.allocate_models(unplaced)
+            for machine_id, models in allocations.items():
+                machine = machines[machine_id]
+                actions.append({'action': 'create', 'machine_id': machine_id, 'models': models, 'cost': machine['dph_total'],
+                                'seconds': INSTANCE_BOOT_SECONDS + download_seconds(models, machine.get('inet_down'))})
+            allocated = [model for models in allocations.values() for model in models]
+            unallocated = [model for model in unplaced if model not in allocated]
+
+        actions.sort(key=lambda action: ACTION_ORDER.index(action['action']))
+        current_cost = sum(entry['machine']['dph_total'] for entry in fleet)
+        return {
+            'actions': actions,
+            'unallocated': unallocated,
+            'current_cost': current_cost,
+            'cost': current_cost + sum(action['cost'] for action in actions),
+            'seconds': self.estimate_seconds(actions),
+        }
+
+    def estimate_seconds(self, actions):
+        """
+        Estimated wall-clock time of a plan: removals and destroys run one after another, then the
+        machines are provisioned `max_workers` at a time, each taking the sum of its own actions.
+        """
+        machines = {}
+        for action in actions:
+            if action['action'] in ('pull', 'create'):
+                key = (action['action'] == 'create', action.get('instance_id', action.get('machine_id')))
+                machines[key] = machines.get(key, 0) + action['seconds']
+
+        # Longest machines first onto the earliest free worker
+        workers = [0] * min(self.max_workers, len(machines) or 1)
+        for seconds in sorted(machines.values(), reverse=True):
+            workers[workers.index(min(workers))] += seconds
+        return sum(action['seconds'] for action in actions if action['action'] in ('remove', 'destroy')) + max(workers)
+
+    def serves(self, entry, model, machine_bin):
+        """
+        Whether the instance has room for the model and its ollama server runs with the model's settings and
+        keeps it loaded next to the models already placed on it.
+        """
+        env = entry['machine'].get('server_env')
+        return (self.allocator.server.compatible(env, model) and self.allocator.server.holds(env, len(machine_bin.models) + 1)
+                and self.allocator.fits(model, machine_bin))
+
+    def has_disk_for(self, entry, models):
+        """ Whether the instance's disk holds the given models next to the ollama image. """
+        disk_space = entry['machine'].get('disk_space')
+        if not disk_space:
+            return True
+        needed = sum(
+            entry['models'].get(ollama_model_name(model['model'])) or model.get('download_size') or model['size']
+            for model in models
+        )
+        return needed + DISK_OVERHEAD_MB <= disk_space * 1024
+
+    def apply(self, plan):
+        """
+        Runs the plan: removals and destroys first, then all pulls and new machines concurrently.
+        Records the models of every touched instance in the state database.
+
+        Returns:
+            bool: Whether all actions succeeded.
+        """
+        for action in plan['actions']:
+            if action['action'] == 'remove':
+                self.model_manager.remove_model(action['models'][0]['model'], action['instance_id'])
+                self.record_models(action['instance_id'])
+        destroys = [action['instance_id'] for action in plan['actions'] if action['action'] == 'destroy']
+        if destroys:
+            self.instance_manager.destroy_instances(destroys)
+        ok = self.provision([action for action in plan['actions'] if action['action'] in ('pull', 'create')])
+        self.sync_deployments(plan)
+        return ok
+
+    def sync_deployments(self, plan):
+        """
+        Makes LiteLLM route exactly to the models the fleet serves after the plan: the reused models and
+        the ones `provision` registered, with their current options. Reused models whose options changed
+        are warmed up with the new ones first. Duplicates, deployments of removed models and ones with
+        outdated options on these instances are deleted, in one reconcile pass.
+        :return: The result of `LiteLLManager.reconcile`, or None without instances to sync
+        """
+        desired = [(model, address, options) for model, address, options, _ in self.registered]
+        api_bases = {address for _, address, _ in desired}
+        reused = []
+        for action in plan['actions']:
+            if action['action'] not in ('reuse', 'pull'):
+                continue
+            address = (self.storage.get_instance(action['instance_id']) or {}).get('ollama_addr')
+            if not address:
+                continue
+            api_bases.add(address)
+            if action['action'] == 'reuse':
+                reused += [(model['model'], address, self.allocator.server.options(model), action['instance_id']) for model in action['models']]
+        if not api_bases:
+            return None
+
+        litellm = self.model_manager.litellm
+        deployments = litellm.get_deployments()
+        if deployments is None:
+            return None
+        # Reused models whose num_ctx or batch changed in llms.yaml are loaded with the new options before
+        # LiteLLM routes to them; models that do not come up with them are not registered
+        changed = {entry[:2] for entry in litellm.missing([entry[:3] for entry in reused], deployments)}
+        for model, address, options, instance_id in reused:
+            if (model, address) in changed:
+                result = self.model_manager.warm_model(model, instance_id, address, options)
+                if not result['ok']:
+                    print(f"Could not reload {model} on instance {instance_id} with {options}: {result['reason']}")
+                    continue
+                print(f"Reloaded {model} on instance {instance_id} with {options}")
+            desired.append((model, address, options))
+
+        result = litellm.reconcile(desired, api_bases=api_bases, deployments=deployments)
+        print(f"LiteLLM deployments: {len(result['added'])} added, {len(result['removed'])} removed, "
+              f"{result['kept']} unchanged, {len(result['failed'])} failed")
+        return result
+
+    def provision(self, actions):
+        """
+        Provisions the pull and create actions as a staged pipeline:
+        rent -> boot -> ready -> pull -> warm -> register.
+        Every stage has its own worker threads (see `stage_limits`) and a queue in front of it, so
+        a model is registered with LiteLLM as soon as it is pulled and resident in memory (see
+        `ModelManager.warm_model`), while other models are still downloading and other machines are
+        still booting. Pulls onto existing instances enter at the pull stage. If anything fails, queued
+        work is skipped and every instance created by this call is destroyed.
+        New machines start their ollama server with the allocator's server settings for their models
+        (see `OllamaServerSettings.env`).
+
+        Returns:
+            bool: Whether every machine and model was provisioned.
+        """
+        if not actions:
+            return True
+
+        created = []
+        self.registered = []  # (model, address, options, instance ID) of every model registered with LiteLLM
+        progress = PullProgress()
+        pull_results = []
+        warm_results = []
+
+        def rent(job):
+            self.report(job['label'], "renting machine")
+            env = self.allocator.server.env(job['models'])
+            instance_id = self.instance_manager.rent(job['offer_id'], disk_space_for(job['models']), True, env)
+            if not instance_id:
+                raise RuntimeError(f"vast refused to rent offer {job['offer_id']}")
+            created.append(instance_id)
+            self.storage.save_allocation(instance_id, job['models'])
+            self.storage.log_event(instance_id, 'rented', {'offer_id': job['offer_id'], 'env': env})
+            return [dict(job, instance_id=instance_id, env=env)]
+
+        def boot(job):
+            address = self.instance_manager.boot(job['instance_id'], True)
+            if not address:
+                raise RuntimeError(f"instance {job['instance_id']} did not boot")
+            # Later plans only pull models with matching settings onto this server
+            self.storage.update_instance(job['instance_id'], server_env=job['env'])
+            self.storage.log_event(job['instance_id'], 'booted', {'ollama_addr': address})
+            return [dict(job, address=address)]
+
+        def ready(job):
+            if not self.instance_manager.wait_for_ollama(job['address']):
+                raise RuntimeError(f"ollama on instance {job['instance_id']} did not start")
+            self.report(job['label'], f"instance {job['instance_id']} is ready")
+            return [dict(job, model=model) for model in job['models']]
+
+        def pull(job):
+            name, instance_id = job['model']['model'], job['instance_id']
+            self.report(job['label'], f"pulling {name}")
+            result = self.model_manager.pull_model(name, instance_id, on_status=progress.tracker(instance_id, name), register=False)
+            progress.finish(instance_id, name, result['ok'], result['reason'])
+            pull_results.append(result)
+            self.storage.log_event(instance_id, 'pull', {key: result.get(key) for key in ('model', 'ok', 'reason', 'attempts')})
+            if not result['ok']:
+                raise RuntimeError(f"failed to pull {name} on instance {instance_id}: {result['reason']}")
+            return [job]
+
+        def warm(job):
+            name, instance_id = job['model']['model'], job['instance_id']
+            result = self.model_manager.warm_model(name, instance_id, job['address'], self.allocator.server.options(job['model']))
+            warm_results.append(result)
+            if not result['ok']:
+                raise RuntimeError(f"failed to load {name} on instance {instance_id}: {result['reason']}")
+            self.report(job['label'], f"{name} loaded in {result['load_seconds']:.1f}s, first token after {result['first_token_seconds']:.2f}s")
+            return [job]
+
+        def register(job):
+            options = self.allocator.server.options(job['model'])
+            self.model_manager.litellm.add_model(job['model']['model'], job['address'], options)
+            self.registered.append((job['model']['model'], job['address'], options, job['instance_id']))
+            self.record_models(job['instance_id'])
+            self.report(job['label'], f"{job['model']['model']} is servable after {format_duration(time.monotonic() - start)}")
+
+        handlers = {'rent': rent, 'boot': boot, 'ready': ready, 'pull': pull, 'warm': warm, 'register': register}
+        pipeline = Pipeline([Stage(name, handlers[name], self.stage_limit(name)) for name in PROVISION_STAGES])
+
+        items = []
+        for action in actions:
+            if action['action'] == 'create':
+                items.append(('rent', {'label': f"offer {action['machine_id']}", 'offer_id': action['machine_id'], 'models': action['models']}))
+            else:
+                address = (self.storage.get_instance(action['instance_id']) or {}).get('ollama_addr')
+                items.append(('pull', {'label': f"instance {action['instance_id']}", 'instance_id': action['instance_id'],
+                                       'address': address, 'model': action['models'][0]}))
+
+        start = time.monotonic()
+        with ProgressDisplay(progress):
+            ok = pipeline.run(items)
+        print_stage_timings(pipeline.timings())
+        if pull_results:
+            print_pull_results(pull_results)
+        if warm_results:
+            print_warmup_results(warm_results)
+
+        if not ok:
+            print(f"Provisioning failed, destroying the {len(created)} instances created in this run...")
+            if created:
+                self.instance_manager.destroy_instances(created)
+                self.registered = [entry for entry in self.registered if entry[3] not in created]
+            return False
+
+        print(f"Provisioned {len(actions)} actions in {format_duration(time.monotonic() - start)}")
+        return True
+
+    def stage_limit(self, name):
+        """
+        Worker threads of a provisioning stage: `stage_limits` or `max_workers`. The pull stage gets a
+        worker per concurrent pull the model manager allows on each machine.
+        """
+        if name == 'pull':
+            return self.stage_limits.get(name) or self.max_workers * self.model_manager.per_host_limit
+        return self.stage_limits.get(name) or self.max_workers
+
+    def report(self, label, message):
+        """ Prints a progress line of one machine; lines of concurrent machines do not interleave. """
+        with self._print_lock:
+            print(f"[{label}] {message}")
+
+    def record_models(self, instance_id):
+        """ Stores the models an instance serves in the state database, so they are known even when it is unreachable. """
+        instance = self.storage.get_instance(instance_id) or {}
+        rows = self.model_manager.models([{'id': instance_id, 'ollama_addr': instance.get('ollama_addr')}], timeout=self.list_timeout)
+        errors = [row['error'] for row in rows if row.get('error')]
+        if errors:
+            print(f"Could not list the models of instance {instance_id}: {errors[0]}")
+            return
+        self.storage.update_instance(instance_id, models=[row['name'] for row in rows])
@@ -0,0 +1,128 @@
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+DEFAULT_MIN_INTERVAL = 2  # seconds between polls while statuses are changing
+DEFAULT_MAX_INTERVAL = 30  # seconds between polls once nothing changes any more
+DEFAULT_BACKOFF = 1.5
+DEFAULT_JITTER = 0.2  # +-20% of the interval, so several processes do not poll in lockstep
+
+
+def is_running(instance):
+    """ Whether vast reports the instance as running on all of its status fields. """
+    return all(
+        (instance.get(field) or '').lower() == 'running'
+        for field in ('actual_status', 'intended_status', 'cur_state')
+    )
+
+
+class InstanceStatusPoller:
+    """
+    Watches booting instances with one shared background poller.
+
+    Every tick fetches the instance list once for all watched instances and fans the result out
+    to their waiters, so watching N instances costs one API call per tick instead of N. Nothing
+    is written to the state database. The poll interval starts at `min_interval`, grows by `backoff` up to
+    `max_interval` while no watched status changes, resets when one does, and is jittered.
+
+    `watch` returns a Future resolved with the instance dict once it is ready, or with None if its
+    status reports an error or it is not ready before its deadline.
+    """
+
+    def __init__(self, vast, min_interval=DEFAULT_MIN_INTERVAL, max_interval=DEFAULT_MAX_INTERVAL, backoff=DEFAULT_BACKOFF, jitter=DEFAULT_JITTER):
+        self.vast = vast
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.ticks = 0  # Number of instance list requests made
+        self._watchers = {}  # Maps instance ID to a list of (future, deadline, ready) tuples
+        self._statuses = {}  # Last status seen per watched instance
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def watch(self, instance_id, timeout=300, ready=None):
+        """
+        Starts watching an instance.
+        :param timeout: Seconds until the future is resolved with None
+        :param ready: Predicate on the instance dict, `is_running` by default
+        :return: Future of the instance dict or None
+        """
+        future = Future()
+        with self._lock:
+            self._watchers.setdefault(instance_id, []).append((future, time.monotonic() + timeout, ready or is_running))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        # Poll right away instead of waiting out a long interval
+        self._wakeup.set()
+        return future
+
+    def wait(self, instance_id, timeout=300, ready=None):
+        """ Blocks until the instance is ready; returns the instance dict or None. """
+        return self.watch(instance_id, timeout, ready).result()
+
+    def _run(self):
+        interval = self.min_interval
+        while True:
+            with self._lock:
+                if not self._watchers:
+                    self._thread = None
+                    return
+            self._wakeup.clear()
+
+            try:
+                instances = {instance['id']: instance for instance in self.vast.list_instances()}
+            except Exception as e:
+                print(f"Failed to list instances: {e}")
+                instances = {}
+            self.ticks += 1
+
+            changed = self._dispatch(instances)
+            interval = self.min_interval if changed else min(interval * self.backoff, self.max_interval)
+            delay = interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+            # Never sleep past the nearest deadline
+            with self._lock:
+                deadlines = [deadline for waiters in self._watchers.values() for _, deadline, _ in waiters]
+            if deadlines:
+                delay = max(0, min(delay, min(deadlines) - time.monotonic()))
+            self._wakeup.wait(delay)
+
+    def _dispatch(self, instances):
+        """ Resolves the waiters of ready, failed and expired instances. Returns whether any status changed. """
+        changed = False
+        now = time.monotonic()
+        with self._lock:
+            for instance_id in list(self._watchers):
+                instance = instances.get(instance_id)
+                status = None
+                if instance:
+                    status = tuple((instance.get(field) or '').lower() for field in ('actual_status', 'intended_status', 'cur_state', 'status_msg'))
+                if status != self._statuses.get(instance_id):
+                    changed = True
+                    self._statuses[instance_id] = status
+                    if status:
+                        print(f"Instance {instance_id} status: {status[0] or '-'} (intended {status[1] or '-'}, state {status[2] or '-'}) {status[3]}".rstrip())
+
+                waiting = []
+                for future, deadline, ready in self._watchers[instance_id]:
+                    if instance and ready(instance):
+                        future.set_result(instance)
+                    elif instance and 'error' in status[3]:
+                        print(f"Error encountered with instance {instance_id}.")
+                        future.set_result(None)
+                    elif now >= deadline:
+                        print(f"Instance {instance_id} was not ready before the deadline.")
+                        future.set_result(None)
+                    else:
+                        waiting.append((future, deadline, ready))
+
+                if waiting:
+                    self._watchers[instance_id] = waiting
+                else:
+                    del self._watchers[instance_id]
+                    self._statuses.pop(instance_id, None)
+        return changed
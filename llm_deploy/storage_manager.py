@@ -1,44 +1,202 @@
 import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS instances (
+    id INTEGER PRIMARY KEY,
+    ollama_addr TEXT NOT NULL DEFAULT '',
+    server_env TEXT,
+    extra TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS models (
+    instance_id INTEGER NOT NULL REFERENCES instances(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    PRIMARY KEY (instance_id, name)
+);
+CREATE TABLE IF NOT EXISTS allocations (
+    instance_id INTEGER NOT NULL REFERENCES instances(id) ON DELETE CASCADE,
+    model TEXT NOT NULL,
+    name TEXT,
+    size_mb REAL,
+    PRIMARY KEY (instance_id, model)
+);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    at REAL NOT NULL,
+    instance_id INTEGER,
+    event TEXT NOT NULL,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS history_instance ON history (instance_id, at);
+"""
+
+# Record keys stored in their own columns or tables; anything else is kept as JSON in `extra`
+COLUMNS = ('ollama_addr', 'server_env', 'models')
+BUSY_TIMEOUT = 30  # seconds another process may hold the write lock
+
+
 class StorageManager:
-    def __init__(self, filename="state.json"):
+    """
+    Local state of the instances, kept in a SQLite database in WAL mode.
+
+    An instance record is a dict with its `ollama_addr`, the `models` its server holds, the
+    `server_env` it was started with and any other keys. Every change is a transaction of its
+    own: `update_instance` changes single fields, so concurrent threads and concurrent CLI runs
+    (e.g. `apply` next to `model ls`) no longer overwrite each other's updates. Writers take the
+    database lock up front and wait up to `BUSY_TIMEOUT` seconds for it; readers never block.
+
+    Besides the instances, the database keeps the models allocated to each instance and a
+    provisioning history. A state.json from earlier versions is imported on first use and
+    renamed to state.json.migrated.
+    """
+
+    def __init__(self, filename="state.db", legacy_filename="state.json"):
         self.filename = filename
-        self.data = self._load_data()
+        self.legacy_filename = legacy_filename
+        # One connection shared by the threads of this process, serialized by the lock
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(filename, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        self._migrate_json()
+
+    @contextmanager
+    def _transaction(self):
+        """ A write transaction holding the database lock from its start, so read-modify-write is atomic. """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _migrate_json(self):
+        legacy = Path(self.legacy_filename)
+        if not legacy.exists():
+            return
+        with self._transaction():
+            # Another process may have migrated it while this one waited for the lock
+            if not legacy.exists():
+                return
+            with open(legacy, 'r') as file:
+                data = json.load(file)
+            for id, value in data.items():
+                self._write(int(id), value, replace=True)
+            self._log(None, 'migrated', {'file': str(legacy), 'instances': len(data)})
+        try:
+            legacy.rename(legacy.with_name(legacy.name + '.migrated'))
+            print(f"Migrated {len(data)} instances from {legacy} to {self.filename}")
+        except FileNotFoundError:
+            pass
 
-    def _load_data(self):
-        """ Load data from a JSON file. """
-        if Path(self.filename).exists():
-            with open(self.filename, 'r') as file:
-                return json.load(file)
+    def _write(self, id, value, replace=False):
+        """ Writes the given fields of a record; with `replace`, fields that are not given are cleared. """
+        row = self._conn.execute("SELECT * FROM instances WHERE id = ?", (id,)).fetchone()
+        extra = {} if replace or not row else json.loads(row['extra'])
+        extra.update({key: field for key, field in value.items() if key not in COLUMNS})
+        ollama_addr = value.get('ollama_addr', '' if replace or not row else row['ollama_addr'])
+        if 'server_env' in value:
+            server_env = json.dumps(value['server_env']) if value['server_env'] is not None else None
         else:
-            return {}
+            server_env = None if replace or not row else row['server_env']
 
-    def _save_data(self):
-        """ Save data to a JSON file. """
-        with open(self.filename, 'w') as file:
-            json.dump(self.data, file, indent=4)
+        self._conn.execute(
+            "INSERT INTO instances (id, ollama_addr, server_env, extra, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET ollama_addr = excluded.ollama_addr, server_env = excluded.server_env, "
+            "extra = excluded.extra, updated_at = excluded.updated_at",
+            (id, ollama_addr or '', server_env, json.dumps(extra), time.time())
+        )
+        if 'models' in value or replace:
+            self._conn.execute("DELETE FROM models WHERE instance_id = ?", (id,))
+            self._conn.executemany("INSERT OR IGNORE INTO models (instance_id, name) VALUES (?, ?)",
+                                   [(id, name) for name in value.get('models') or []])
+
+    def _log(self, instance_id, event, detail=None):
+        self._conn.execute("INSERT INTO history (at, instance_id, event, detail) VALUES (?, ?, ?, ?)",
+                           (time.time(), instance_id, event, json.dumps(detail) if detail is not None else None))
 
     def sync_instances(self, ids):
-        # Convert incoming IDs to strings
-        string_ids = set(str(id) for id in ids)
-        # Remove instances not in the new list of IDs
-        ids_to_remove = set(self.data.keys()) - string_ids
-        for id in ids_to_remove:
-            del self.data[id]
+        """ Drops the records of instances that no longer exist and adds empty ones for new instances. """
+        ids = {int(id) for id in ids}
+        with self._transaction() as conn:
+            known = {row['id'] for row in conn.execute("SELECT id FROM instances")}
+            for id in known - ids:
+                conn.execute("DELETE FROM instances WHERE id = ?", (id,))
+                self._log(id, 'gone')
+            for id in ids - known:
+                self._write(id, {})
 
-        for id in string_ids:
-            if id not in self.data:
-                self.data[id] = {"ollama_addr": ""}
+    def save_instance(self, id, value):
+        """ Add or replace a record. """
+        with self._transaction():
+            self._write(int(id), value, replace=True)
 
-        # Save changes
-        self._save_data()
+    def update_instance(self, id, **fields):
+        """ Changes only the given fields of a record, creating it if needed. """
+        with self._transaction():
+            self._write(int(id), fields)
 
-    def save_instance(self, id, value):
-        """ Add or update a record in the data. """
-        self.data[str(id)] = value
-        self._save_data()
+    def remove_instance(self, id):
+        """ Drops the record of a destroyed instance. """
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM instances WHERE id = ?", (int(id),))
+            self._log(int(id), 'destroyed')
 
     def get_instance(self, id):
-        """ Retrieve a single record from the data. """
-        return self.data.get(str(id), None)
+        """ Retrieve a single record. """
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM instances WHERE id = ?", (int(id),)).fetchone()
+            if not row:
+                return None
+            models = [model['name'] for model in self._conn.execute(
+                "SELECT name FROM models WHERE instance_id = ? ORDER BY name", (int(id),))]
+        record = json.loads(row['extra'])
+        record['ollama_addr'] = row['ollama_addr']
+        if row['server_env'] is not None:
+            record['server_env'] = json.loads(row['server_env'])
+        if models:
+            record['models'] = models
+        return record
+
+    def save_allocation(self, instance_id, models):
+        """ Records the models the allocator placed on an instance. """
+        with self._transaction() as conn:
+            if not conn.execute("SELECT 1 FROM instances WHERE id = ?", (int(instance_id),)).fetchone():
+                self._write(int(instance_id), {})
+            conn.execute("DELETE FROM allocations WHERE instance_id = ?", (int(instance_id),))
+            conn.executemany(
+                "INSERT OR REPLACE INTO allocations (instance_id, model, name, size_mb) VALUES (?, ?, ?, ?)",
+                [(int(instance_id), model['model'], model.get('name'), model.get('size')) for model in models]
+            )
+
+    def get_allocation(self, instance_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT model, name, size_mb FROM allocations WHERE instance_id = ? ORDER BY model", (int(instance_id),)).fetchall()
+        return [{'model': row['model'], 'name': row['name'], 'size': row['size_mb']} for row in rows]
+
+    def log_event(self, instance_id, event, detail=None):
+        """ Appends an entry to the provisioning history. """
+        with self._transaction():
+            self._log(instance_id, event, detail)
+
+    def history(self, instance_id=None, limit=100):
+        """ The latest history entries, newest first, of one instance or all of them. """
+        query = "SELECT at, instance_id, event, detail FROM history"
+        params = ()
+        if instance_id is not None:
+            query += " WHERE instance_id = ?"
+            params = (int(instance_id),)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY id DESC LIMIT ?", params + (limit,)).fetchall()
+        return [{'at': row['at'], 'instance_id': row['instance_id'], 'event': row['event'],
+                 'detail': json.loads(row['detail']) if row['detail'] else None} for row in rows]
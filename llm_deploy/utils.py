@@ -1,5 +1,6 @@
 from prettytable import PrettyTable
 import datetime
+import csv
 
 def format_ram(ram_in_mb):
     """Helper function to convert RAM from MB to GB and format it as a string."""
@@ -7,6 +8,13 @@ def format_ram(ram_in_mb):
         return f"{ram_in_mb / 1024:.1f} GB"
     return 'N/A'
 
+def format_bytes(size):
+    """Helper function to format a byte count with a binary unit."""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
+        size /= 1024
+
 def format_price(price):
     """Helper function to format the price as a string with '$/h' suffix."""
     if price is not None and price != 'N/A':
@@ -113,14 +121,179 @@ def print_pull_status(pull_model_generator):
 
 def print_models(models):
     table = PrettyTable()
-    table.field_names = ["Model Name", "Instance"]
+    table.field_names = ["Model Name", "Instance", "Size", "Params", "Quant", "Latency (ms)", "Status"]
     table.align["Model Name"] = "l"  # Left aligns the 'Model Name' column
 
     for model in models:
-        model_name = model.get('name', 'N/A')
-        instance_id = model.get('instance_id', 'N/A')
+        if model.get('error'):
+            table.add_row(['-', model.get('instance_id', 'N/A'), '-', '-', '-', '-', model['error']])
+            continue
+        size = format_bytes(model['size']) if model.get('size') else 'N/A'
+        latency = f"{model['latency'] * 1000:.0f}" if model.get('latency') is not None else 'N/A'
+        table.add_row([model.get('name', 'N/A'), model.get('instance_id', 'N/A'), size, model.get('parameter_size') or 'N/A',
+                       model.get('quant') or 'N/A', latency, 'ok'])
+
+    print(table)
+
+
+SWEEP_COLUMNS = ["context", "quant", "batch", "kv_cache_type", "model_size", "kv_cache", "input_buffer", "compute_buffer", "total_size"]
+
+def print_sweep_table(rows):
+    table = PrettyTable()
+    table.field_names = ["Context", "Quant", "Batch", "KV Cache", "Model (GB)", "KV Cache (GB)", "Input (GB)", "Compute (GB)", "Total (GB)"]
+
+    for row in rows:
+        sizes = [f"{row[column]:.2f}" for column in SWEEP_COLUMNS[4:]]
+        table.add_row([row['context'], row['quant'], row['batch'], row['kv_cache_type']] + sizes)
+
+    print(table)
+
+def write_sweep_csv(rows, path):
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=SWEEP_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def print_max_context_table(rows, vram_budget):
+    table = PrettyTable()
+    table.field_names = ["Quant", "Batch", "KV Cache", f"Max Context ({vram_budget:g} GB)"]
+
+    for row in rows:
+        max_context = row['max_context'] if row['max_context'] else "does not fit"
+        table.add_row([row['quant'], row['batch'], row['kv_cache_type'], max_context])
+
+    print(table)
+
+def print_http_stats(stats):
+    table = PrettyTable()
+    table.field_names = ["Endpoint", "Requests", "Errors", "Received", "Total Latency", "Avg Latency"]
+    table.align["Endpoint"] = "l"
+
+    for entry in stats:
+        table.add_row([
+            entry['endpoint'],
+            entry['requests'],
+            entry['errors'],
+            f"{entry['bytes'] / 1024:.1f} KB",
+            f"{entry['latency']:.2f}s",
+            f"{entry['avg_latency'] * 1000:.0f}ms"
+        ])
+
+    print(table)
+
+def format_duration(seconds):
+    """Helper function to format a duration in seconds as minutes and seconds."""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    if minutes > 0:
+        return f"{minutes}m {seconds}s"
+    return f"{seconds}s"
+
+def print_plan(plan):
+    table = PrettyTable()
+    table.field_names = ["Action", "Instance/Offer", "Models", "Price Change", "Est. Time"]
+    table.align["Models"] = "l"
 
-        table.add_row([model_name, instance_id])
+    for action in plan['actions']:
+        target = action.get('instance_id', action.get('machine_id'))
+        models = ", ".join(model['model'] for model in action['models'])
+        price = f"{action['cost']:+.3f}$/h" if action['cost'] else ""
+        table.add_row([action['action'], target, models, price, format_duration(action['seconds'])])
 
     print(table)
+    for model in plan['unallocated']:
+        print(f"No offer can hold model: {model['model']}")
+    print(f"Price: {format_price(plan['current_cost'])} -> {format_price(plan['cost'])} | Estimated time: {format_duration(plan['seconds'])}")
 
+def print_stage_timings(timings):
+    table = PrettyTable()
+    table.field_names = ["Stage", "Workers", "Done", "Failed", "Skipped", "Avg Time", "First Done", "Last Done"]
+    table.align["Stage"] = "l"
+
+    for entry in timings:
+        first_done = format_duration(entry['first_done']) if entry['first_done'] is not None else '-'
+        last_done = format_duration(entry['last_done']) if entry['last_done'] is not None else '-'
+        table.add_row([entry['stage'], entry['concurrency'], entry['processed'], entry['failed'], entry['skipped'],
+                       format_duration(entry['avg_seconds']), first_done, last_done])
+
+    print(table)
+
+def print_pull_results(results):
+    table = PrettyTable()
+    table.field_names = ["Model", "Instance", "Result", "Size", "Time", "Attempts", "MB/s", "Slowest layer MB/s"]
+    table.align["Model"] = "l"
+    table.align["Result"] = "l"
+
+    for result in results:
+        rate = result['bytes'] / result['seconds'] / 1e6 if result['ok'] and result['seconds'] else 0
+        # Layers resumed from disk or already present were not downloaded and say nothing about the link
+        layer_rates = [layer['rate'] / 1e6 for layer in result.get('layers', []) if layer['downloaded']]
+        table.add_row([
+            result['model'],
+            result['instance_id'],
+            "ok" if result['ok'] else f"failed: {result['reason']}",
+            format_bytes(result['bytes']),
+            format_duration(result['seconds']),
+            result.get('attempts', 1),
+            f"{rate:.1f}" if rate else "-",
+            f"{min(layer_rates):.1f}" if layer_rates else "-"
+        ])
+
+    print(table)
+
+def print_destroy_results(results, seconds):
+    table = PrettyTable()
+    table.field_names = ["Instance", "GPU", "Price", "Result", "Time", "Deployments removed"]
+    table.align["Result"] = "l"
+
+    for result in results:
+        gpus = f"{result.get('num_gpus') or 1}x {result['gpu_name']}" if result.get('gpu_name') else "-"
+        table.add_row([
+            result['id'],
+            gpus,
+            format_price(result.get('dph_total')) if result.get('dph_total') is not None else "-",
+            "destroyed" if result['ok'] else f"failed: {result['reason']}",
+            f"{result['seconds']:.1f}s",
+            len(result['deployments'])
+        ])
+
+    print(table)
+    destroyed = [result for result in results if result['ok']]
+    freed = sum(result.get('dph_total') or 0 for result in destroyed)
+    print(f"Destroyed {len(destroyed)}/{len(results)} instances in {format_duration(seconds)}, freeing {format_price(freed)}")
+
+def print_warmup_results(results):
+    table = PrettyTable()
+    table.field_names = ["Model", "Instance", "Result", "Load", "First token", "In VRAM", "Loaded until"]
+    table.align["Model"] = "l"
+    table.align["Result"] = "l"
+
+    for result in results:
+        table.add_row([
+            result['model'],
+            result['instance_id'],
+            "resident" if result['ok'] else f"failed: {result['reason']}",
+            f"{result['load_seconds']:.1f}s" if result['load_seconds'] is not None else "-",
+            f"{result['first_token_seconds']:.2f}s" if result['first_token_seconds'] is not None else "-",
+            f"{result['gpu_share']:.0%}" if result['gpu_share'] is not None else "-",
+            # e.g. 2024-06-01T12:00:00.123+00:00; keep_alive -1 shows up as a date centuries ahead
+            (result['expires_at'] or "-")[:19]
+        ])
+
+    print(table)
+
+def print_quant_tradeoffs(rows):
+    table = PrettyTable()
+    table.field_names = ["Plan", "Quantizations", "Machines", "Unallocated", "Price/h", "Avg bits/weight"]
+    table.align["Quantizations"] = "l"
+
+    for row in rows:
+        table.add_row([
+            row['plan'],
+            ", ".join(f"{name}={quant}" for name, quant in row['quants'].items()),
+            row['machines'],
+            row['unallocated'],
+            format_price(row['cost']),
+            f"{row['bpw']:.2f}"
+        ])
+
+    print(table)
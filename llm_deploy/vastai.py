@@ -1,11 +1,22 @@
-import requests
 import time
 import re
+from llm_deploy.http_client import get_http_client
 from llm_deploy.interfaces import VastAIInterface
 
+
+def gpu_total_ram(machine):
+    """
+    Total GPU RAM in MB of a vast offer or instance. Vast reports it as `gpu_totalram`, llm_deploy
+    reads `gpu_total_ram`; machines with neither get their per-GPU RAM times their GPUs.
+    """
+    return (machine.get('gpu_total_ram') or machine.get('gpu_totalram')
+            or machine.get('gpu_ram', 0) * (machine.get('num_gpus') or 1))
+
+
 class VastAI(VastAIInterface):
-    def __init__(self, api_key):
+    def __init__(self, api_key, http=None):
         self.api_key = api_key
+        self.http = http or get_http_client()
         self.base_url = 'https://console.vast.ai/api/v0/'
         self.headers = {'Accept': 'application/json'}
 
@@ -32,7 +43,8 @@ class VastAI(VastAIInterface):
             disk_space=40, 
             internet_speed=100, 
             result_count=10, 
-            public_ip=True
+            public_ip=True,
+            limit=None
          ):
         url = self.base_url + 'bundles/'
         query_params = {
@@ -53,7 +65,9 @@ class VastAI(VastAIInterface):
         }
         if public_ip:
             query_params['static_ip'] = {"eq": True}
-        response = requests.post(url, headers=self.headers, json=query_params)
+        if limit:
+            query_params['limit'] = limit
+        response = self.http.post(url, headers=self.headers, json=query_params, idempotent=True)
         all_offers = response.json()['offers']
 
         # Set up filters
@@ -65,9 +79,10 @@ class VastAI(VastAIInterface):
         filtered_offers = self.filter_offers(all_offers, filters)
         return filtered_offers[:result_count]
 
-    def create_instance(self, machine_id, disk_space, image="g1ibby/ollama-cloudflared", ports=[]):
+    def create_instance(self, machine_id, disk_space, image="g1ibby/ollama-cloudflared", ports=[], env=None):
         url = self.base_url + f'asks/{machine_id}/?api_key={self.api_key}'
         env_dict = {f"-p {port}:{port}": "1" for port in ports}
+        env_dict.update(env or {})
         data = {
                 "client_id": "me",
                 "image": image,
@@ -76,7 +91,7 @@ class VastAI(VastAIInterface):
                 "use_jupyter_lab": False,
                 "disk": disk_space,
             }
-        response = requests.put(url, headers=self.headers, json=data)
+        response = self.http.put(url, headers=self.headers, json=data)
         payload = response.json()
         print(payload)
         if payload.get('success') == False:
@@ -85,12 +100,12 @@ class VastAI(VastAIInterface):
 
     def list_instances(self):
         url = self.base_url + f'instances?api_key={self.api_key}'
-        response = requests.get(url, headers=self.headers).json()
+        response = self.http.get(url, headers=self.headers).json()
         return response.get('instances', [])
 
     def destroy_instance(self, instance_id):
         url = self.base_url + f'instances/{instance_id}/?api_key={self.api_key}'
-        response = requests.delete(url, headers=self.headers)
+        response = self.http.delete(url, headers=self.headers)
         return response.json()
 
     def get_instance_logs(self, instance_id, max_attempts=10):
@@ -98,7 +113,7 @@ class VastAI(VastAIInterface):
         data = {"tail": "1000"}  # Modify as needed
 
         for attempt in range(max_attempts):
-            response = requests.put(url, headers=self.headers, json=data).json()
+            response = self.http.put(url, headers=self.headers, json=data).json()
             if not response.get('success'):
                 print(f"Attempt {attempt + 1}: Failed to get response")
                 time.sleep(1)  # Wait for 1 second before retrying
@@ -110,7 +125,7 @@ class VastAI(VastAIInterface):
                 time.sleep(1)  # Wait for 1 second before retrying
                 continue
 
-            log_data = requests.get(logs_url).text
+            log_data = self.http.get(logs_url).text
             if "Access Denied" in log_data:
                 print(f"Attempt {attempt + 1}: Access Denied. Retrying...")
                 time.sleep(1)  # Wait for 1 second before retrying
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Lets the test modules import the builders they share from helpers.py
+sys.path.insert(0, os.path.dirname(__file__))
@@ -0,0 +1,68 @@
+""" Builders shared by the test modules (see conftest.py). """
+import struct
+from unittest.mock import Mock
+
+from llm_deploy.model_allocator import ModelAllocator
+
+def gguf_string(value):
+    data = value.encode("utf-8")
+    return struct.pack("<Q", len(data)) + data
+
+def build_gguf(metadata, tensors):
+    """ Serializes a minimal GGUF v3 file: header, metadata and tensor infos, followed by fake data. """
+    out = b"GGUF" + struct.pack("<IQQ", 3, len(tensors), len(metadata))
+    for key, (value_type, value) in metadata.items():
+        out += gguf_string(key) + struct.pack("<I", value_type)
+        if value_type == 8:
+            out += gguf_string(value)
+        elif value_type == 9:
+            item_type, items = value
+            out += struct.pack("<IQ", item_type, len(items))
+            for item in items:
+                out += gguf_string(item) if item_type == 8 else struct.pack("<I", item)
+        else:
+            out += struct.pack("<I", value)
+    for name, shape, tensor_type in tensors:
+        out += gguf_string(name) + struct.pack("<I", len(shape))
+        out += b"".join(struct.pack("<Q", dim) for dim in shape)
+        out += struct.pack("<IQ", tensor_type, 0)
+    return out + b"\0" * 4096
+
+METADATA = {
+    "general.architecture": (8, "llama"),
+    "general.file_type": (4, 15),
+    "llama.embedding_length": (4, 4096),
+    "llama.block_count": (4, 32),
+    "llama.context_length": (4, 4096),
+    "llama.feed_forward_length": (4, 11008),
+    "llama.attention.head_count": (4, 32),
+    "llama.attention.head_count_kv": (4, 8),
+    "tokenizer.ggml.tokens": (9, (8, [f"tok{i}" for i in range(1000)])),
+}
+TENSORS = [
+    ("token_embd.weight", [4096, 32000], 12),  # Q4_K
+    ("blk.0.attn_q.weight", [4096, 4096], 14),  # Q6_K
+    ("output_norm.weight", [4096], 0),  # F32
+]
+
+def footprint(size_gb, per_gpu_gb=0, layers=32):
+    # Per-GPU footprint in GB, like LLMCalculator.calculate_footprint
+    return {'layered': size_gb - per_gpu_gb, 'layer': (size_gb - per_gpu_gb) / layers, 'per_gpu': per_gpu_gb}
+
+def model_option(model, size_gb, per_gpu_gb=0):
+    # Sizes in GB, like LLMCalculator.model_option
+    return {'quant': None, 'model': model, 'bpw': None, 'model_size': size_gb, 'context_size': 0, 'total_size': size_gb,
+            'footprint': footprint(size_gb, per_gpu_gb), 'download_size': None}
+
+def mock_calculator(sizes_gb, per_gpu_gb=0):
+    return Mock(model_option=Mock(side_effect=lambda model, context, **sizing: model_option(model, sizes_gb[model], per_gpu_gb)))
+
+def offer(offer_id, gpu_total_ram, dph_total, total_flops=10, num_gpus=1):
+    return {'id': offer_id, 'gpu_total_ram': gpu_total_ram, 'gpu_ram': gpu_total_ram // num_gpus,
+            'num_gpus': num_gpus, 'dph_total': dph_total, 'total_flops': total_flops}
+
+def allocator_for(models, offers, strategy, per_gpu_gb=0):
+    llms_config_mock = Mock(get_models=Mock(return_value=[dict(m) for m in models]))
+    calculator_mock = mock_calculator({m['model']: m['size'] / 1024 for m in models}, per_gpu_gb)
+    vast_mock = Mock(get_available_offers=Mock(return_value=offers))
+    return ModelAllocator(vast_mock, llms_config_mock, calculator=calculator_mock, strategy=strategy)
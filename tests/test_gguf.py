@@ -0,0 +1,39 @@
+import pytest
+
+from llm_deploy.gguf import GGUFFile, GGUFError, GGUFTruncatedError
+from llm_deploy.llm_calculator import LLMCalculator
+from helpers import build_gguf, METADATA, TENSORS
+
+def test_parse_header(tmp_path):
+    path = tmp_path / "model.gguf"
+    path.write_bytes(build_gguf(METADATA, TENSORS))
+
+    gguf = GGUFFile.from_path(path)
+
+    assert gguf.version == 3
+    assert gguf.architecture == "llama"
+    assert gguf.quant_type == "Q4_K_M"
+    assert len(gguf.metadata["tokenizer.ggml.tokens"]) == 1000
+    assert [t["n_bytes"] for t in gguf.tensors] == [4096 * 32000 // 256 * 144, 4096 * 4096 // 256 * 210, 4096 * 4]
+
+    config = gguf.model_config()
+    assert config["num_key_value_heads"] == 8
+    assert config["num_hidden_layers"] == 32
+    assert config["model_bytes"] == gguf.tensor_bytes
+
+def test_truncated_and_invalid_headers():
+    data = build_gguf(METADATA, TENSORS)
+    with pytest.raises(GGUFTruncatedError):
+        GGUFFile.from_buffer(data[:200])
+    with pytest.raises(GGUFError):
+        GGUFFile.from_buffer(b"GGML" + data[4:])
+
+def test_calculate_from_gguf_is_offline(tmp_path):
+    path = tmp_path / "model.gguf"
+    path.write_bytes(build_gguf(METADATA, TENSORS))
+    calculator = LLMCalculator(cache=False)
+
+    model_size, context_size, total_size = calculator.calculate(str(path), 2048)
+
+    assert model_size == GGUFFile.from_path(path).tensor_bytes / 1e9
+    assert total_size == pytest.approx(model_size + context_size)
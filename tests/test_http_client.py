@@ -0,0 +1,51 @@
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_deploy.http_client import HTTPClient
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """ Answers 503 to the first request of every path, then 200. """
+    seen = set()
+
+    def do_GET(self):
+        self._respond()
+
+    def do_POST(self):
+        self._respond()
+
+    def _respond(self):
+        status = 200 if self.path in self.seen else 503
+        self.seen.add(self.path)
+        body = b"ok" if status == 200 else b"busy"
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server_url():
+    FlakyHandler.seen = set()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FlakyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+def test_get_is_retried_on_server_errors(server_url):
+    client = HTTPClient(backoff_factor=0)
+
+    assert client.get(f"{server_url}/instances/123").status_code == 200
+    stats = client.stats()
+    assert len(stats) == 1
+    assert stats[0]["endpoint"].endswith("/instances/{id}")
+    assert stats[0]["requests"] == 1
+    assert stats[0]["bytes"] == 2
+
+def test_post_is_only_retried_when_idempotent(server_url):
+    client = HTTPClient(backoff_factor=0)
+
+    assert client.post(f"{server_url}/model/new").status_code == 503
+    assert client.post(f"{server_url}/bundles/", idempotent=True).status_code == 200
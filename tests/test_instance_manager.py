@@ -0,0 +1,84 @@
+import time
+from unittest.mock import Mock, patch
+
+from llm_deploy.instance_manager import InstanceManager
+
+def manager_for(instance_ids, cache_ttl=10):
+    vast = Mock(
+        list_instances=Mock(side_effect=lambda: [{'id': instance_id, 'actual_status': 'running'} for instance_id in instance_ids]),
+        destroy_instance=Mock(return_value={'success': True}),
+        create_instance=Mock(return_value=9),
+    )
+    storage = Mock(get_instance=Mock(side_effect=lambda instance_id: {'ollama_addr': f"http://host{instance_id}"}))
+    return InstanceManager(vast, storage, Mock(), poller=Mock(), cache_ttl=cache_ttl)
+
+def test_one_listing_per_command():
+    manager = manager_for([1, 2])
+
+    with patch('llm_deploy.instance_manager.OllamaInstance') as ollama:
+        ollama.return_value.models.return_value = [{'name': 'a:7b'}]
+        instance = manager.get_instance_by_id(2)
+        manager.destroy_instance(instance['id'])
+        assert ollama.return_value.models.call_count == 1
+
+    assert instance['ollama_addr'] == "http://host2" and instance['models'] == [{'name': 'a:7b'}]
+    assert manager.vast.list_instances.call_count == 1
+    manager.storage.remove_instance.assert_called_once_with(2)
+    manager.litellm.remove_models_by_api_bases.assert_called_once_with({"http://host2"})
+
+    # The destroy invalidated the listing
+    assert manager.get_instance_by_id(3) is None
+    assert manager.vast.list_instances.call_count == 2
+
+def test_cached_instances_are_copies_and_expire():
+    manager = manager_for([1])
+    manager.instances()[0]['models'] = ['changed']
+    assert 'models' not in manager.instances()[0]
+    assert manager.vast.list_instances.call_count == 1
+
+    manager.rent(5, 40)
+    manager.instances()
+    assert manager.vast.list_instances.call_count == 2
+
+    manager.cache_ttl = 0
+    manager.instances()
+    manager.instances()
+    assert manager.vast.list_instances.call_count == 4
+
+def test_destroy_instances_concurrently_with_one_litellm_pass():
+    manager = manager_for([1, 2, 3, 4])
+    manager.vast.list_instances = Mock(return_value=[{'id': i, 'dph_total': 0.25, 'gpu_name': 'RTX 4090'} for i in (1, 2, 3, 4)])
+    manager.vast.destroy_instance = Mock(side_effect=lambda instance_id: time.sleep(0.2) or {'success': instance_id != 3, 'msg': 'busy'})
+    manager.litellm.remove_models_by_api_bases = Mock(return_value={"http://host1": ['a'], "http://host2": ['b', 'c'], "http://host4": []})
+
+    start = time.monotonic()
+    results = manager.destroy_instances([1, 2, 3, 4, 5])
+    elapsed = time.monotonic() - start
+
+    assert elapsed < 0.6
+    assert manager.vast.list_instances.call_count == 1
+    manager.litellm.remove_models_by_api_bases.assert_called_once_with({"http://host1", "http://host2", "http://host4", "http://host5"})
+    assert [result['ok'] for result in results] == [True, True, False, True, True]
+    assert results[1]['deployments'] == ['b', 'c'] and results[1]['dph_total'] == 0.25
+    assert results[2]['reason'] == 'busy'
+    assert sorted(call.args[0] for call in manager.storage.remove_instance.call_args_list) == [1, 2, 4, 5]
+
+def test_destroys_a_rolled_back_rental_missing_from_the_listing():
+    # Vast's listing can lag behind a rental; a rollback must still destroy the instance
+    manager = manager_for([1])
+    manager.instances()
+
+    result, = manager.destroy_instances([9])
+
+    manager.vast.destroy_instance.assert_called_once_with(9)
+    assert result['ok'] and result['dph_total'] is None
+    manager.storage.remove_instance.assert_called_once_with(9)
+    manager.litellm.remove_models_by_api_bases.assert_called_once_with({"http://host9"})
+
+def test_create_stops_when_vast_refuses_the_rental():
+    manager = manager_for([])
+    manager.vast.create_instance = Mock(return_value=None)
+    manager.boot = Mock()
+
+    assert manager.create(5, 40) is None
+    manager.boot.assert_not_called()
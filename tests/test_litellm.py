@@ -0,0 +1,81 @@
+import threading
+from unittest.mock import Mock
+
+from llm_deploy.litellm import LiteLLManager, deployment_id
+
+class FakeProxy:
+    """ In-memory /model/info, /model/new and /model/delete of a LiteLLM proxy. """
+    def __init__(self, deployments):
+        self.deployments = list(deployments)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        self.calls.append(('GET', url))
+        return Mock(status_code=200, json=Mock(return_value={'data': list(self.deployments)}))
+
+    def post(self, url, json=None, **kwargs):
+        with self.lock:
+            self.calls.append(('POST', url))
+            if url.endswith('/model/new'):
+                self.deployments.append(json)
+            else:
+                self.deployments = [d for d in self.deployments if d['model_info']['id'] != json['id']]
+        return Mock(status_code=200)
+
+def deployment(model, api_base, id=None, **options):
+    return {'model_name': model, 'litellm_params': {'model': f"ollama/{model}", 'api_base': api_base, **options},
+            'model_info': {'id': id or deployment_id(model, api_base)}}
+
+def test_reconcile_adds_and_deletes_only_the_difference():
+    proxy = FakeProxy([
+        deployment('a:7b', 'http://host1', num_ctx=8192),
+        deployment('a:7b', 'http://host1', id='a:7b'),  # duplicate from an older version
+        deployment('b:7b', 'http://host1', num_ctx=2048),  # registered with other options
+        deployment('c:7b', 'http://host1'),  # no longer desired
+        deployment('gpt-4o', 'https://api.openai.com'),  # not managed
+    ])
+    manager = LiteLLManager(http=proxy)
+    desired = [('a:7b', 'http://host1', {'num_ctx': 8192}), ('b:7b', 'http://host1', {'num_ctx': 8192}), ('a:7b', 'http://host2')]
+
+    result = manager.reconcile(desired)
+
+    assert result['kept'] == 1
+    assert sorted(result['removed']) == ['a:7b', deployment_id('b:7b', 'http://host1'), deployment_id('c:7b', 'http://host1')]
+    assert sorted(result['added']) == [('a:7b', 'http://host2'), ('b:7b', 'http://host1')]
+    assert sorted((d['model_name'], d['litellm_params']['api_base']) for d in proxy.deployments) == [
+        ('a:7b', 'http://host1'), ('a:7b', 'http://host2'), ('b:7b', 'http://host1'), ('gpt-4o', 'https://api.openai.com')]
+    assert [call for call in proxy.calls if call[0] == 'GET'] == [('GET', 'http://localhost:4000/model/info')]
+
+    proxy.calls.clear()
+    assert manager.reconcile(desired) == {'added': [], 'removed': [], 'kept': 3, 'failed': []}
+    assert len(proxy.calls) == 1
+
+def test_add_model_is_idempotent_and_removal_by_api_base_is_one_pass():
+    proxy = FakeProxy([deployment('gpt-4o', 'https://api.openai.com')])
+    manager = LiteLLManager(http=proxy)
+
+    for _ in range(2):
+        assert manager.add_model('a:7b', 'http://host1', {'num_ctx': 4096})
+        assert manager.add_model('a:7b', 'http://host2', {'num_ctx': 4096})
+    assert len(proxy.deployments) == 3
+
+    proxy.calls.clear()
+    removed = manager.remove_models_by_api_bases(['http://host1', 'http://host2', 'http://host3'])
+    assert removed == {'http://host1': [deployment_id('a:7b', 'http://host1')], 'http://host2': [deployment_id('a:7b', 'http://host2')], 'http://host3': []}
+    assert [call[0] for call in proxy.calls] == ['GET', 'POST', 'POST']
+    assert [d['model_name'] for d in proxy.deployments] == ['gpt-4o']
+
+def test_add_model_replaces_a_deployment_with_other_options():
+    proxy = FakeProxy([deployment('a:7b', 'http://host1', num_ctx=2048)])
+    manager = LiteLLManager(http=proxy)
+
+    assert manager.add_model('a:7b', 'http://host1', {'num_ctx': 8192})
+
+    assert [(d['model_info']['id'], d['litellm_params']['num_ctx']) for d in proxy.deployments] == [(deployment_id('a:7b', 'http://host1'), 8192)]
+
+def test_missing_compares_options():
+    deployments = [deployment('a:7b', 'http://host1', num_ctx=8192)]
+    desired = [('a:7b', 'http://host1', {'num_ctx': 8192}), ('a:7b', 'http://host1', {'num_ctx': 4096}), ('a:7b', 'http://host2', None)]
+
+    assert LiteLLManager(http=FakeProxy([])).missing(desired, deployments) == desired[1:]
@@ -1,4 +1,123 @@
-from llm_deploy.llm_calculator import LLMCalculator
+import json
+import pytest
+from unittest.mock import patch, Mock
+from llm_deploy.llm_calculator import LLMCalculator, GPU_OVERHEAD, quant_tag
+
+# KV cache sizes of dense, grouped-query, mixture-of-experts and sliding-window models, taken from llama.cpp
+# load logs or its allocation rule; every case records its source
+with open("tests/mocks/calculator_corpus.json", "r") as file:
+    CORPUS = json.load(file)
+
+# Subset of the config.json of mistralai/Mistral-7B-v0.1
+MISTRAL_CONFIG = {
+    "hidden_size": 4096,
+    "num_attention_heads": 32,
+    "num_key_value_heads": 8,
+    "num_hidden_layers": 32,
+    "max_position_embeddings": 32768,
+    "parameters": 7241732096,
+}
+
+def test_sweep_matches_calculate_sizes():
+    calculator = LLMCalculator(cache=False)
+    rows = calculator.sweep_config(MISTRAL_CONFIG, [2048, 8192], ["Q4_K_M", "Q8_0"], [512], [False, True])
+
+    assert len(rows) == 8
+    for row in rows:
+        model_size, context_size, total_size = calculator.calculate_config_sizes(
+            MISTRAL_CONFIG, row["quant"], row["context"], row["batch"], row["kv_cache_type"] == "fp8")
+        assert row["model_size"] == pytest.approx(model_size)
+        assert row["kv_cache"] + row["input_buffer"] + row["compute_buffer"] == pytest.approx(context_size)
+        assert row["total_size"] == pytest.approx(total_size)
+
+@pytest.mark.parametrize("entry", CORPUS, ids=[entry["model"] for entry in CORPUS])
+def test_regression_corpus(entry):
+    calculator = LLMCalculator(cache=False)
+    model_config = calculator.normalize_config(dict(entry["config"]))
+
+    for case in entry["cases"]:
+        assert calculator.kv_cache(case["context"], model_config, case["kv_cache_type"]) == case["kv_cache"], case["source"]
+
+def test_compute_buffer_scales_with_batch_size():
+    calculator = LLMCalculator(cache=False)
+    at_512 = calculator.compute_buffer(8192, MISTRAL_CONFIG, 512)
+
+    assert calculator.compute_buffer(8192, MISTRAL_CONFIG, 2048) == pytest.approx(at_512 * 4)
+
+@pytest.mark.parametrize("bsz", [512, 2048])
+def test_compute_buffer_grows_by_the_kq_scores(bsz):
+    # llama.cpp keeps the attention scores of a batch as one f32 tensor of [n_kv, n_tokens, n_head]
+    calculator = LLMCalculator(cache=False)
+    model_config = next(entry["config"] for entry in CORPUS if entry["model"] == "Llama-2-7b-hf")
+
+    growth = calculator.compute_buffer(4096, model_config, bsz) - calculator.compute_buffer(2048, model_config, bsz)
+    assert growth == (4096 - 2048) * bsz * 32 * 4
+
+def test_compute_buffer_holds_the_expert_activations():
+    # llama.cpp's MoE FFN adds the router logits, f32 [n_expert, n_tokens], and the up and gate projections
+    # of the selected experts, f32 [n_ff, n_expert_used, n_tokens] each
+    calculator = LLMCalculator(cache=False)
+    model_config = next(entry["config"] for entry in CORPUS if entry["model"] == "Mixtral-8x7B-v0.1")
+    dense_config = {key: value for key, value in model_config.items() if key != "num_local_experts"}
+
+    moe = calculator.compute_buffer(8192, model_config, 512) - calculator.compute_buffer(8192, dense_config, 512)
+    assert moe == 8 * 512 * 4 + 2 * 14336 * 2 * 512 * 4
+
+def test_max_context_fits_budget():
+    calculator = LLMCalculator(cache=False)
+    max_context = calculator.max_context(MISTRAL_CONFIG, "Q4_K_M", 8)
+
+    assert max_context % 256 == 0
+    assert calculator.calculate_config_sizes(MISTRAL_CONFIG, "Q4_K_M", max_context)[2] <= 8
+    assert calculator.calculate_config_sizes(MISTRAL_CONFIG, "Q4_K_M", max_context + 256)[2] > 8
+    assert calculator.max_context(MISTRAL_CONFIG, "Q4_K_M", 1000) == 32768
+    assert calculator.max_context(MISTRAL_CONFIG, "Q8_0", 4) == 0
+
+def test_footprint_adds_per_gpu_overhead_when_split():
+    calculator = LLMCalculator(cache=False)
+    footprint = calculator.config_footprint(MISTRAL_CONFIG, "Q4_K_M", 8192)
+    total_size = calculator.calculate_config_sizes(MISTRAL_CONFIG, "Q4_K_M", 8192)[2]
+
+    assert footprint["layered"] + footprint["per_gpu"] == pytest.approx(total_size + GPU_OVERHEAD / 1e9, rel=1e-6)
+
+def test_parallel_slots_and_kv_cache_type():
+    calculator = LLMCalculator(cache=False)
+    f16 = calculator.kv_cache(8192, MISTRAL_CONFIG, "f16")
+
+    assert calculator.kv_cache(8192, MISTRAL_CONFIG, False) == f16
+    assert calculator.kv_cache(8192, MISTRAL_CONFIG, "q8_0") == pytest.approx(f16 * 17 / 32)
+    assert calculator.kv_cache(8192, MISTRAL_CONFIG, "q4_0") == pytest.approx(f16 * 9 / 32)
+
+    with patch.object(calculator, "resolve_model_config", return_value=(MISTRAL_CONFIG, "Q4_K_M")):
+        single = calculator.calculate_footprint("mistral:7b-instruct-q4_K_M", 8192)
+        parallel = calculator.calculate_footprint("mistral:7b-instruct-q4_K_M", 8192, num_parallel=4)
+    weights = calculator.model_size(MISTRAL_CONFIG, "Q4_K_M") / 1e9
+    assert parallel["layered"] - weights == pytest.approx((single["layered"] - weights) * 4)
+    assert parallel["per_gpu"] > single["per_gpu"]
+
+def test_model_option_resolves_the_config_once():
+    calculator = LLMCalculator(cache=False, registry=Mock(model_info=Mock(return_value={"config": dict(MISTRAL_CONFIG, quant_size="Q4_K_M"), "download_size": 1000})))
+    option = calculator.model_option("mistral:7b-instruct-q4_K_M", 4096, num_parallel=2, kv_cache_type="q8_0")
+
+    assert calculator.registry.model_info.call_count == 2  # the config, then the download size
+    assert (option["model_size"], option["context_size"], option["total_size"]) == calculator.calculate_config_sizes(MISTRAL_CONFIG, "Q4_K_M", 8192, kv_cache_type="q8_0")
+    assert option["footprint"] == calculator.config_footprint(MISTRAL_CONFIG, "Q4_K_M", 8192, kv_cache_type="q8_0")
+    assert option["download_size"] == 1000 and option["quant"] is None
+
+def test_quant_options_skip_unpublished_tags():
+    published = {"mistral:7b-instruct", "mistral:7b-instruct-q8_0", "mistral:7b-instruct-q5_K_M", "mistral:7b-instruct-q4_K_M", "mistral:7b-instruct-q3_K_M"}
+
+    def model_info(tag):
+        if tag not in published:
+            raise KeyError(tag)
+        return {"config": dict(MISTRAL_CONFIG, quant_size="Q4_0"), "download_size": 1000}
+
+    calculator = LLMCalculator(cache=False, registry=Mock(model_info=Mock(side_effect=model_info)))
+    options = calculator.quant_options("mistral:7b-instruct", "Q4_K_M", 8192)
+
+    assert quant_tag("mistral:7b-instruct", "Q4_K_M") == "mistral:7b-instruct-q4_K_M"
+    assert [option["quant"] for option in options] == ["Q8_0", "Q5_K_M", "Q4_K_M"]
+    assert options[0]["total_size"] > options[-1]["total_size"]
 
 def main():
     models = [
@@ -0,0 +1,51 @@
+import pytest
+
+from llm_deploy.llms_config import LLMsConfig
+
+def config_with(tmp_path, text):
+    path = tmp_path / "llms.yaml"
+    path.write_text(text)
+    return LLMsConfig(str(path))
+
+def test_optional_model_settings(tmp_path):
+    config = config_with(tmp_path, """
+models:
+  chat:
+    model: llama3:8b-instruct-q4_0
+    priority: high
+    num_ctx: 32768
+    num_parallel: 2
+    kv_cache_type: q8_0
+    batch: 1024
+  embed:
+    model: nomic-embed-text
+    priority: low
+""")
+    chat, embed = config.get_models()
+
+    assert (chat['num_ctx'], chat['num_parallel'], chat['kv_cache_type'], chat['batch']) == (32768, 2, 'q8_0', 1024)
+    assert embed == {'name': 'embed', 'model': 'nomic-embed-text', 'priority': 'low'}
+
+def test_auto_quant_with_floor(tmp_path):
+    config = config_with(tmp_path, """
+models:
+  chat:
+    model: llama3:8b-instruct
+    priority: high
+    quant: auto
+    quant_floor: q5_k_m
+  code:
+    model: qwen2.5-coder:7b-instruct
+    priority: low
+    quant: auto
+""")
+    chat, code = config.get_models()
+
+    assert (chat['quant'], chat['quant_floor']) == ('auto', 'Q5_K_M')
+    assert code['quant_floor'] == 'Q4_K_M'
+
+@pytest.mark.parametrize("line", ["num_ctx: 0", "num_parallel: two", "kv_cache_type: fp8", "quant: Q4_K_M", "quant_floor: Q4_K_M"])
+def test_invalid_model_settings(tmp_path, line):
+    config = config_with(tmp_path, f"models:\n  chat:\n    model: llama3\n    priority: low\n    {line}\n")
+    with pytest.raises(ValueError):
+        config.get_models()
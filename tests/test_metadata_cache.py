@@ -0,0 +1,64 @@
+import math
+import pytest
+import requests
+from unittest.mock import Mock
+
+from llm_deploy.metadata_cache import MetadataCache, CacheMiss, LOCK_STRIPES
+
+def test_get_or_fetch_uses_cached_value(tmp_path):
+    cache = MetadataCache(tmp_path)
+    fetch = Mock(return_value={"status": 200, "text": "{}"})
+
+    assert cache.get_or_fetch("https://example.com/a", fetch) == {"status": 200, "text": "{}"}
+    assert cache.get_or_fetch("https://example.com/a", fetch) == {"status": 200, "text": "{}"}
+    assert fetch.call_count == 1
+
+def test_expired_entry_is_refetched(tmp_path):
+    cache = MetadataCache(tmp_path, ttl=0)
+    fetch = Mock(side_effect=["old", "new"])
+
+    cache.get_or_fetch("key", fetch)
+    assert cache.get_or_fetch("key", fetch) == "new"
+
+def test_stale_entry_is_served_when_network_fails(tmp_path, caplog):
+    cache = MetadataCache(tmp_path, ttl=0)
+    cache.get_or_fetch("key", lambda: "cached")
+
+    fetch = Mock(side_effect=requests.exceptions.ConnectionError("down"))
+    assert cache.get_or_fetch("key", fetch) == "cached"
+    assert [(record.name, record.levelname) for record in caplog.records] == [("llm_deploy.metadata_cache", "WARNING")]
+
+def test_offline_mode(tmp_path):
+    MetadataCache(tmp_path, ttl=0).put("key", "stale")
+    cache = MetadataCache(tmp_path, ttl=0, offline=True)
+    fetch = Mock()
+
+    assert cache.get_or_fetch("key", fetch) == "stale"
+    with pytest.raises(CacheMiss):
+        cache.get_or_fetch("missing", fetch)
+    fetch.assert_not_called()
+
+def test_eviction_keeps_max_entries(tmp_path):
+    cache = MetadataCache(tmp_path, max_entries=3)
+    for i in range(5):
+        cache.put(f"key-{i}", i)
+
+    assert len(cache._entries()) == 3
+    assert cache.get("key-4") == 4
+
+def test_prune_honours_the_ttl_of_each_entry(tmp_path):
+    cache = MetadataCache(tmp_path, ttl=0)
+    cache.get_or_fetch("manifest", lambda: "pinned", ttl=math.inf)
+    cache.put("search", "expired")
+    cache.put("config", "fresh", ttl=3600)
+
+    assert cache.prune() == 1
+    assert cache.get("manifest") == "pinned" and cache.get("config") == "fresh" and cache.get("search") is None
+
+def test_locks_are_striped(tmp_path):
+    cache = MetadataCache(tmp_path)
+    for i in range(1000):
+        cache.get_or_fetch(f"key-{i}", lambda: i)
+
+    assert len(cache._locks) == LOCK_STRIPES
+    assert cache._lock_for("key-1") is cache._lock_for("key-1")
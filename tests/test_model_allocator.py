@@ -1,7 +1,12 @@
 import json
+import threading
+import time
 import pytest
-from unittest.mock import patch
-from llm_deploy.ollama import ModelAllocator, retrieve_model_size
+from unittest.mock import patch, Mock
+from llm_deploy.allocation_engines import BranchAndBoundEngine, MachineBin
+from llm_deploy.model_allocator import ModelAllocator
+from llm_deploy.offer_catalog import OfferCatalog
+from helpers import allocator_for, footprint, mock_calculator, model_option, offer
 
 # Utility function to load mock data
 def load_mock_data(file_name):
@@ -15,8 +20,9 @@ def test_allocate_models():
         {'model': 'ModelA', 'priority': 'high', 'size': 8 * 1024},  # 8GB in MB
         {'model': 'ModelB', 'priority': 'low', 'size': 12 * 1024}   # 12GB in MB
     ]))
+    calculator_mock = mock_calculator({'ModelA': 8, 'ModelB': 12})
 
-    allocator = ModelAllocator(vast=vast_mock, llms_config=llms_config_mock)
+    allocator = ModelAllocator(vast=vast_mock, llms_config=llms_config_mock, calculator=calculator_mock)
 
     # Mock data files corresponding to different GPU memory sizes
     mock_files = {
@@ -26,10 +32,163 @@ def test_allocate_models():
     }
 
     # Patch the get_available_offers method
-    with patch.object(vast_mock, 'get_available_offers', side_effect=lambda gpu_memory, **kwargs: load_mock_data(mock_files[gpu_memory])):
+    with patch.object(vast_mock, 'get_available_offers', side_effect=lambda gpu_memory, *args, **kwargs: load_mock_data(mock_files[gpu_memory])):
         allocations, machines = allocator.allocate_models()
 
         # Assertions go here
         # Example: assert len(allocations) == expected_number_of_allocations
         # More detailed assertions can be added based on the expected outcome
 
+def test_load_desired_models_sizes_concurrently_and_deduplicates():
+    calls = []
+    lock = threading.Lock()
+
+    def size(model, context, **sizing):
+        with lock:
+            calls.append(model)
+        time.sleep(0.2)
+        return model_option(model, {'a:7b-q4_0': 4, 'b:13b-q4_0': 8}[model])
+
+    llms_config_mock = Mock(get_models=Mock(return_value=[
+        {'name': 'first', 'model': 'a:7b-q4_0', 'priority': 'low'},
+        {'name': 'second', 'model': 'b:13b-q4_0', 'priority': 'low'},
+        {'name': 'third', 'model': 'a:7b-q4_0', 'priority': 'high'},
+    ]))
+
+    start = time.monotonic()
+    allocator = ModelAllocator(Mock(), llms_config_mock, calculator=Mock(model_option=Mock(side_effect=size)))
+    elapsed = time.monotonic() - start
+
+    assert sorted(calls) == ['a:7b-q4_0', 'b:13b-q4_0']
+    assert elapsed < 0.4
+    assert [m['name'] for m in allocator.desired_models] == ['third', 'second', 'first']
+    assert allocator.desired_models[1]['size'] == 8 * 1024
+
+def test_size_models_times_out():
+    calculator_mock = Mock(model_option=Mock(side_effect=lambda model, context, **sizing: time.sleep(2)))
+    allocator = ModelAllocator(Mock(), Mock(get_models=Mock(return_value=[])), calculator=calculator_mock, sizing_timeout=0.1)
+
+    with pytest.raises(TimeoutError):
+        allocator.size_models(['slow:7b-q4_0'])
+
+def test_exact_strategy_beats_greedy_baseline():
+    models = [
+        {'name': 'a', 'model': 'a:7b-q4_0', 'priority': 'low', 'size': 10 * 1024},
+        {'name': 'b', 'model': 'b:7b-q4_0', 'priority': 'low', 'size': 10 * 1024},
+    ]
+    offers = [offer(1, 24 * 1024, 0.30, total_flops=50), offer(2, 12 * 1024, 0.10), offer(3, 12 * 1024, 0.11)]
+
+    allocator = allocator_for(models, offers, 'exact')
+    allocations, machines = allocator.allocate_models()
+
+    assert sorted(machines) == [2, 3]
+    assert allocator.plan_cost == pytest.approx(0.21)
+    assert allocator.baseline_cost == pytest.approx(0.30)
+
+@pytest.mark.parametrize("strategy", ['greedy', 'ffd', 'best-fit', 'exact'])
+def test_strategies_respect_capacity(strategy):
+    models = [
+        {'name': f'm{i}', 'model': f'm{i}:7b-q4_0', 'priority': 'high' if i < 2 else 'low', 'size': size * 1024}
+        for i, size in enumerate([6, 5, 9, 4, 3])
+    ]
+    offers = load_mock_data('case_8GB.json') + load_mock_data('case_16GB.json') + load_mock_data('case_24GB.json')
+
+    allocator = allocator_for(models, offers, strategy)
+    allocations, machines = allocator.allocate_models()
+
+    assert sum(len(models_on_machine) for models_on_machine in allocations.values()) == len(models)
+    assert all(space >= 0 for space in allocator.available_space.values())
+    if strategy == 'exact':
+        assert allocator.plan_cost <= allocator.baseline_cost + 1e-9
+
+def test_offer_catalog_range_queries_and_single_fetch():
+    offers = [offer(1, 8 * 1024, 0.20), offer(2, 24 * 1024, 0.15), offer(3, 48 * 1024, 0.40, num_gpus=2), offer(4, 16 * 1024, 0.10)]
+    catalog = OfferCatalog(offers)
+
+    assert [o['id'] for o in catalog.with_min_total_ram(16 * 1024)] == [4, 2, 3]
+    assert [o['id'] for o in catalog.range('dph_total', 0.15, 0.20)] == [2, 1]
+    assert catalog.cheapest(20 * 1024)['id'] == 2
+    assert catalog.cheapest(20 * 1024, exclude={2})['id'] == 3
+    assert catalog.cheapest(64 * 1024) is None
+    assert OfferCatalog([offer(5, 24 * 1024, 0.15, total_flops=10), offer(6, 24 * 1024, 0.15, total_flops=30)]).cheapest(0)['id'] == 6
+
+    models = [{'name': 'a', 'model': 'a:7b-q4_0', 'priority': 'low', 'size': 10 * 1024}]
+    allocator = allocator_for(models, offers, 'exact')
+    allocator.allocate_models()
+    assert allocator.vast.get_available_offers.call_count == 1
+
+def test_per_gpu_placement_rejects_split_that_would_spill():
+    # A 22 GB model does not fit 2x12 GB once each GPU pays its own buffers, a 20 GB one does when split
+    models = [{'name': 'big', 'model': 'big:34b-q4_0', 'priority': 'low', 'size': 22 * 1024}]
+    offers = [offer(1, 24 * 1024, 0.15, num_gpus=2), offer(2, 24 * 1024, 0.25)]
+
+    allocator = allocator_for(models, offers, 'exact', per_gpu_gb=1.5)
+    allocations, machines = allocator.allocate_models()
+    assert list(machines) == [2]
+
+    models[0]['size'] = 20 * 1024
+    allocator = allocator_for(models, offers, 'exact', per_gpu_gb=1.5)
+    allocations, machines = allocator.allocate_models()
+    assert list(machines) == [1]
+    assert [gpus for _, gpus in allocator.gpu_layouts[1]] == [[0, 1]]
+
+def test_exact_strategy_tries_machines_whose_models_differ_only_in_footprint():
+    # Same priority and size, but one model is split over both GPUs and leaves less room on each
+    machines = [MachineBin(offer(i, 24 * 1024, 0.1, num_gpus=2),
+                           [{'model': f'm{i}', 'priority': 'low', 'size': 8 * 1024, 'footprint': footprint(8, per_gpu_gb=per_gpu_gb)}])
+                for i, per_gpu_gb in ((1, 0), (2, 2))]
+    tried = []
+    engine = BranchAndBoundEngine(lambda model, machine_bin: tried.append(machine_bin.id) or True, Mock())
+    engine.best_cost, engine.nodes = float('inf'), 0
+
+    engine._search([{'model': 'n', 'priority': 'low', 'size': 4 * 1024}], [], 0, machines, 0.2, [4 * 1024, 0])
+
+    assert tried == [1, 2]
+
+def test_per_model_settings_drive_sizing_and_placement():
+    # Two small models fit one 24 GB offer together, unless their server-wide settings differ
+    models = [
+        {'name': 'short', 'model': 'a:7b-q4_0', 'priority': 'low', 'size': 8 * 1024, 'num_ctx': 2048},
+        {'name': 'long', 'model': 'a:7b-q4_0', 'priority': 'low', 'size': 8 * 1024, 'num_ctx': 32768},
+        {'name': 'busy', 'model': 'b:7b-q4_0', 'priority': 'low', 'size': 8 * 1024, 'num_parallel': 4},
+    ]
+    offers = [offer(1, 24 * 1024, 0.20), offer(2, 24 * 1024, 0.21)]
+
+    allocator = allocator_for(models, offers, 'exact')
+    contexts = sorted(call.kwargs['context'] for call in allocator.calculator.model_option.call_args_list if call.args[0] == 'a:7b-q4_0')
+    assert contexts == [2048, 32768]
+    busy = next(model for model in allocator.desired_models if model['name'] == 'busy')
+    assert [call.kwargs['num_parallel'] for call in allocator.calculator.model_option.call_args_list if call.args[0] == 'b:7b-q4_0'] == [4]
+    assert busy['settings'] == {'num_ctx': 8192, 'num_parallel': 4, 'kv_cache_type': 'f16', 'batch': 512}
+
+    allocations, machines = allocator.allocate_models()
+    assert sorted(sorted(model['name'] for model in placed) for placed in allocations.values()) == [['busy'], ['long', 'short']]
+    busy_machine = next(placed for placed in allocations.values() if busy in placed)
+    assert allocator.server.env(busy_machine)['OLLAMA_NUM_PARALLEL'] == '4'
+
+def test_auto_quant_upgrades_within_the_cheapest_fleet():
+    options = {
+        'chat:8b': [('Q8_0', 8.5, 9), ('Q5_K_M', 5.69, 6.5), ('Q4_K_M', 4.85, 5)],
+        'code:7b': [('Q8_0', 8.5, 9), ('Q4_K_M', 4.85, 5)],
+    }
+
+    def quant_options(model, floor, **sizing):
+        return [dict(model_option(f"{model}-{quant.lower()}", size_gb), quant=quant, bpw=bpw) for quant, bpw, size_gb in options[model]]
+
+    models = [
+        {'name': 'chat', 'model': 'chat:8b', 'priority': 'high', 'quant': 'auto', 'quant_floor': 'Q4_K_M'},
+        {'name': 'code', 'model': 'code:7b', 'priority': 'low', 'quant': 'auto', 'quant_floor': 'Q4_K_M'},
+    ]
+    calculator_mock = Mock(quant_options=Mock(side_effect=quant_options))
+    vast_mock = Mock(get_available_offers=Mock(return_value=[offer(1, 16 * 1024, 0.10), offer(2, 24 * 1024, 0.20)]))
+    allocator = ModelAllocator(vast_mock, Mock(get_models=Mock(return_value=models)), calculator=calculator_mock)
+
+    assert [m['model'] for m in allocator.desired_models] == ['chat:8b-q4_k_m', 'code:7b-q4_k_m']
+    rows = {row['plan']: row for row in allocator.choose_quants()}
+
+    assert rows['chosen']['quants'] == {'chat': 'Q8_0', 'code': 'Q4_K_M'}
+    assert rows['chosen']['cost'] == pytest.approx(0.10)
+    assert rows['all Q8_0']['cost'] == pytest.approx(0.20)
+    assert [m['model'] for m in allocator.desired_models] == ['chat:8b-q8_0', 'code:7b-q4_k_m']
+    allocations, machines = allocator.allocate_models()
+    assert list(machines) == [1]
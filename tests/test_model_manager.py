@@ -0,0 +1,120 @@
+import threading
+import time
+from unittest.mock import patch, Mock
+
+from llm_deploy.model_manager import ModelManager
+from llm_deploy.pull_progress import PullProgress
+
+def pull_stream(model_name, fail=False):
+    yield {"status": "pulling manifest"}
+    yield {"status": f"pulling {model_name}", "digest": f"sha256:{model_name}", "total": 1000, "completed": 500}
+    time.sleep(0.1)
+    if fail:
+        yield {"error": "max retries exceeded: unexpected EOF"}
+        return
+    yield {"status": f"pulling {model_name}", "digest": f"sha256:{model_name}", "total": 1000, "completed": 1000}
+    yield {"status": "verifying sha256 digest"}
+    yield {"status": "success"}
+
+class FakeOllama:
+    """ Counts concurrent pulls per address. """
+    active = {}
+    peak = {}
+    lock = threading.Lock()
+
+    def __init__(self, address):
+        self.address = address
+
+    def models(self):
+        return [{"name": name} for name in ("a:7b", "b:7b", "c:7b", "d:7b")]
+
+    def warm_model(self, model_name, keep_alive, options=None):
+        return {'ok': True, 'error': None, 'load_seconds': 0.5, 'first_token_seconds': 0.6, 'seconds': 0.6}
+
+    def running_models(self):
+        return [{"name": name, "size": 1000, "size_vram": 1000} for name in ("a:7b", "b:7b", "c:7b", "d:7b")]
+
+    def pull_model(self, model_name, timeout=None):
+        with self.lock:
+            self.active[self.address] = self.active.get(self.address, 0) + 1
+            self.peak[self.address] = max(self.peak.get(self.address, 0), self.active[self.address])
+        try:
+            yield from pull_stream(model_name, fail=model_name.startswith("broken"))
+        finally:
+            with self.lock:
+                self.active[self.address] -= 1
+
+def test_pull_many_limits_pulls_per_host_and_reports_failures():
+    storage = Mock(get_instance=Mock(side_effect=lambda instance_id: {"ollama_addr": f"http://host{instance_id}"}))
+    manager = ModelManager(Mock(), storage, per_host_limit=2, pull_retries=0)
+    pulls = [("a:7b", 1), ("b:7b", 1), ("c:7b", 1), ("broken:7b", 2), ("d:7b", 2)]
+
+    with patch('llm_deploy.model_manager.OllamaInstance', FakeOllama):
+        results = manager.pull_many(pulls)
+
+    assert FakeOllama.peak == {"http://host1": 2, "http://host2": 2}
+    assert [r['ok'] for r in results] == [True, True, True, False, True]
+    assert results[3]['reason'] == "max retries exceeded: unexpected EOF"
+    assert results[0]['bytes'] == 1000
+    assert results[0]['attempts'] == 1
+    assert manager.litellm.add_model.call_count == 4
+    assert results[0]['warm']['first_token_seconds'] == 0.6
+
+def test_warm_model_requires_residency():
+    storage = Mock(get_instance=Mock(return_value={"ollama_addr": "http://host1"}))
+    manager = ModelManager(Mock(), storage, keep_alive="30m")
+    ollama = Mock()
+    ollama.warm_model.return_value = {'ok': True, 'error': None, 'load_seconds': 12.0, 'first_token_seconds': 12.5, 'seconds': 12.5}
+    ollama.running_models.return_value = [{"name": "llama3:latest", "size": 8000, "size_vram": 6000, "expires_at": "2024-06-01T12:30:00Z"}]
+
+    with patch('llm_deploy.model_manager.OllamaInstance', return_value=ollama):
+        result = manager.warm_model("llama3", 1)
+        missing = manager.warm_model("mistral", 1)
+
+    ollama.warm_model.assert_called_with("mistral", "30m", None)
+    assert result['ok'] and result['gpu_share'] == 0.75 and result['load_seconds'] == 12.0
+    assert not missing['ok']
+    assert missing['reason'] == "model is not resident after loading"
+
+def test_progress_aggregates_instances_and_fleet():
+    progress = PullProgress()
+    first, second = progress.tracker(1, "a"), progress.tracker(2, "b")
+    first({"digest": "sha256:1", "total": 4000, "completed": 1000})
+    second({"digest": "sha256:2", "total": 2000, "completed": 2000})
+    progress.finish(2, "b", True)
+
+    rows = {row['instance']: row for row in progress.snapshot()}
+    assert (rows[1]['done'], rows[1]['total'], rows[1]['active']) == (1000, 4000, 1)
+    assert rows[None]['done'] == 3000
+    assert rows[None]['total'] == 6000
+
+    time.sleep(0.05)
+    first({"digest": "sha256:1", "total": 4000, "completed": 3000})
+    rows = {row['instance']: row for row in progress.snapshot()}
+    assert rows[1]['rate'] > 0
+    assert rows[1]['eta'] is not None
+    assert len(progress.lines()) == 3
+
+def test_models_lists_instances_concurrently_and_marks_unreachable():
+    def ollama_for(address):
+        def models(timeout=None):
+            if address == "http://dead":
+                raise ConnectionError("tunnel closed")
+            time.sleep(2 if address == "http://hung" else 0.2)
+            return [{"name": "a:7b", "size": 4 * 1024 ** 3, "details": {"quantization_level": "Q4_0", "parameter_size": "7B"}}]
+        return Mock(models=models)
+
+    instances = [{'id': i, 'ollama_addr': f"http://host{i}"} for i in range(5)]
+    instances += [{'id': 5, 'ollama_addr': "http://dead"}, {'id': 6, 'ollama_addr': "http://hung"}, {'id': 7, 'ollama_addr': ''}]
+
+    start = time.monotonic()
+    with patch('llm_deploy.model_manager.OllamaInstance', side_effect=ollama_for):
+        rows = ModelManager(Mock(), Mock()).models(instances, timeout=0.4)
+    elapsed = time.monotonic() - start
+
+    assert elapsed < 1.2
+    assert [row['instance_id'] for row in rows] == list(range(8))
+    assert rows[0]['quant'] == "Q4_0" and rows[0]['size'] == 4 * 1024 ** 3 and rows[0]['latency'] >= 0.2
+    assert rows[5]['error'] == "unreachable: tunnel closed"
+    assert rows[6]['error'].startswith("unreachable: no answer")
+    assert rows[7]['error'] == "no ollama address"
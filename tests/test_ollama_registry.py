@@ -0,0 +1,79 @@
+import json
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_deploy.llm_calculator import LLMCalculator
+from llm_deploy.ollama_registry import OllamaRegistry, MODEL_LAYER_MEDIA_TYPE, PARAMS_LAYER_MEDIA_TYPE
+from helpers import build_gguf, METADATA, TENSORS
+
+MODEL_BLOB = build_gguf(METADATA, TENSORS)
+PARAMS_BLOB = json.dumps({"stop": ["</s>"]}).encode()
+BLOBS = {"sha256:model": MODEL_BLOB, "sha256:params": PARAMS_BLOB}
+MANIFEST = {
+    "schemaVersion": 2,
+    "config": {"digest": "sha256:config", "size": 100},
+    "layers": [
+        {"mediaType": MODEL_LAYER_MEDIA_TYPE, "digest": "sha256:model", "size": len(MODEL_BLOB)},
+        {"mediaType": PARAMS_LAYER_MEDIA_TYPE, "digest": "sha256:params", "size": len(PARAMS_BLOB)},
+    ],
+}
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    """ Local stand-in for the Ollama registry serving a single tag. """
+    requested_ranges = []
+
+    def do_GET(self):
+        if self.path == "/v2/library/tiny/manifests/1b-q4_K_M":
+            self._send(200, json.dumps(MANIFEST).encode())
+        elif self.path.startswith("/v2/library/tiny/blobs/"):
+            blob = BLOBS[self.path.rsplit("/", 1)[1]]
+            range_header = self.headers.get("Range")
+            if range_header:
+                self.requested_ranges.append(range_header)
+                start, end = range_header.split("=")[1].split("-")
+                self._send(206, blob[int(start):int(end) + 1])
+            else:
+                self._send(200, blob)
+        else:
+            self._send(404, b"not found")
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def registry_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RegistryHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+def test_parse_model_name():
+    registry = OllamaRegistry()
+    assert registry.parse_model_name("mixtral:8x7b-text-v0.1-q5_K_M") == ("library", "mixtral", "8x7b-text-v0.1-q5_K_M")
+    assert registry.parse_model_name("user/model") == ("user", "model", "latest")
+
+def test_model_info_from_local_registry(registry_url):
+    info = OllamaRegistry(registry_url).model_info("tiny:1b-q4_K_M")
+
+    assert info["download_size"] == len(MODEL_BLOB) + len(PARAMS_BLOB) + 100
+    assert info["params"] == {"stop": ["</s>"]}
+    assert info["config"]["quant_size"] == "Q4_K_M"
+    assert info["config"]["num_key_value_heads"] == 8
+    assert all(r.startswith("bytes=0-") for r in RegistryHandler.requested_ranges)
+
+def test_calculator_sizes_from_registry(registry_url):
+    calculator = LLMCalculator(cache=False, registry=OllamaRegistry(registry_url))
+
+    model_size, context_size, total_size = calculator.calculate("tiny:1b-q4_K_M", 2048)
+
+    assert model_size * 1e9 == pytest.approx(calculator.registry.model_info("tiny:1b-q4_K_M")["config"]["model_bytes"])
+    assert total_size == pytest.approx(model_size + context_size)
+    assert calculator.download_size("tiny:1b-q4_K_M") == len(MODEL_BLOB) + len(PARAMS_BLOB) + 100
@@ -0,0 +1,38 @@
+import pytest
+
+from llm_deploy.ollama_server import OllamaServerSettings
+
+def test_env_follows_the_allocation():
+    settings = OllamaServerSettings(num_parallel=4, kv_cache_type='q8_0', keep_alive=-1)
+    env = settings.env([{'model': 'a:7b'}, {'model': 'b:13b'}])
+
+    assert env == {
+        'OLLAMA_NUM_PARALLEL': '4',
+        'OLLAMA_MAX_LOADED_MODELS': '2',
+        'OLLAMA_KEEP_ALIVE': '-1',
+        'OLLAMA_FLASH_ATTENTION': '1',
+        'OLLAMA_KV_CACHE_TYPE': 'q8_0',
+    }
+    assert settings.sizing() == {'context': 8192, 'num_parallel': 4, 'kv_cache_type': 'q8_0', 'bsz': 512}
+    assert 'OLLAMA_MAX_LOADED_MODELS' not in settings.env()
+
+def test_quantized_kv_cache_needs_flash_attention():
+    settings = OllamaServerSettings(flash_attention=False, kv_cache_type='q4_0')
+
+    # Ollama falls back to f16, so the models are sized for it
+    assert settings.env()['OLLAMA_KV_CACHE_TYPE'] == 'f16'
+    assert settings.sizing()['kv_cache_type'] == 'f16'
+    with pytest.raises(ValueError):
+        OllamaServerSettings(kv_cache_type='fp8')
+
+def test_model_settings_override_the_server_defaults():
+    settings = OllamaServerSettings(num_parallel=2, kv_cache_type='q8_0')
+    model = {'model': 'llama3', 'num_ctx': 32768, 'batch': 1024}
+
+    assert settings.sizing(model) == {'context': 32768, 'num_parallel': 2, 'kv_cache_type': 'q8_0', 'bsz': 1024}
+    assert settings.options(model) == {'num_ctx': 32768, 'num_batch': 1024}
+    assert settings.options() == {'num_ctx': 8192}
+    assert settings.group(model) != settings.group({'num_parallel': 4})
+    assert settings.compatible(settings.env([model]), model)
+    assert not settings.compatible(settings.env([model]), {'kv_cache_type': 'f16'})
+    assert settings.compatible(None, {'kv_cache_type': 'f16'})
@@ -0,0 +1,36 @@
+import threading
+import time
+
+from llm_deploy.pipeline import Pipeline, Stage
+
+def test_items_flow_through_stages_and_fan_out():
+    results = []
+    lock = threading.Lock()
+
+    def collect(item):
+        with lock:
+            results.append(item)
+
+    pipeline = Pipeline([
+        Stage('split', lambda item: [f"{item}-{i}" for i in range(2)], 2),
+        Stage('upper', lambda item: [item.upper()], 2),
+        Stage('collect', collect),
+    ])
+
+    assert pipeline.run([('split', 'a'), ('split', 'b'), ('upper', 'c')])
+    assert sorted(results) == ['A-0', 'A-1', 'B-0', 'B-1', 'C']
+    assert [entry['processed'] for entry in pipeline.timings()] == [2, 5, 5]
+
+def test_failure_skips_queued_items():
+    def slow_or_fail(item):
+        if item == 'bad':
+            raise ValueError(item)
+        time.sleep(0.05)
+        return [item]
+
+    pipeline = Pipeline([Stage('work', slow_or_fail), Stage('done', lambda item: None)])
+
+    assert not pipeline.run([('work', 'bad'), ('work', 'x'), ('work', 'y')])
+    work = pipeline.timings()[0]
+    assert work['failed'] == 1
+    assert work['skipped'] == 2
@@ -0,0 +1,75 @@
+import time
+
+import requests
+
+from llm_deploy.pull_supervisor import PullSupervisor
+
+LAYER = {"status": "pulling weights", "digest": "sha256:weights", "total": 1000}
+
+class ScriptedOllama:
+    """ Plays one scripted status stream per pull attempt. """
+
+    def __init__(self, attempts, listed=("llama3:latest",)):
+        self.attempts = list(attempts)
+        self.listed = listed
+        self.pulls = 0
+
+    def pull_model(self, model_name, timeout=None):
+        self.pulls += 1
+        return iter_statuses(self.attempts.pop(0))
+
+    def models(self):
+        return [{"name": name} for name in self.listed]
+
+def iter_statuses(script):
+    for item in script:
+        if isinstance(item, Exception):
+            raise item
+        if isinstance(item, (int, float)):
+            time.sleep(item)
+            continue
+        yield item
+
+def supervise(ollama, **kwargs):
+    result = {}
+    statuses = list(PullSupervisor(ollama, backoff=0, **kwargs).statuses("llama3", result))
+    return result, statuses
+
+def test_stalled_pull_is_resumed_and_verified():
+    ollama = ScriptedOllama([
+        [dict(LAYER, completed=0), dict(LAYER, completed=400), 0.05, {"status": "pulling weights"}, 0.05, {"status": "pulling weights"}],
+        [dict(LAYER, completed=400), 0.01, dict(LAYER, completed=1000), {"status": "verifying sha256 digest"}, {"status": "success"}],
+    ])
+    result, statuses = supervise(ollama, stall_timeout=0.05)
+
+    assert result['ok']
+    assert result['attempts'] == 2
+    assert result['bytes'] == 1000
+    [layer] = result['layers']
+    assert layer['downloaded'] == 1000
+    assert layer['rate'] > 0
+    assert statuses[-1] == {"status": "success"}
+
+def test_connection_errors_are_retried_but_fatal_errors_are_not():
+    ollama = ScriptedOllama([
+        [dict(LAYER, completed=0), requests.exceptions.ConnectionError("reset")],
+        [{"error": "pull model manifest: file does not exist"}],
+        [{"status": "success"}],
+    ])
+    result, _ = supervise(ollama, retries=4)
+
+    assert not result['ok']
+    assert ollama.pulls == 2
+    assert result['reason'] == "pull model manifest: file does not exist"
+
+def test_success_requires_verification_and_listing():
+    ollama = ScriptedOllama([[dict(LAYER, completed=0), dict(LAYER, completed=1000), {"status": "success"}]])
+    result, _ = supervise(ollama, retries=0)
+    assert not result['ok']
+    assert "verifying" in result['reason']
+
+    # Already present models skip the download, but still have to be listed
+    ollama = ScriptedOllama([[dict(LAYER, completed=1000), {"status": "success"}]], listed=())
+    result, _ = supervise(ollama, retries=0)
+    assert not result['ok']
+    assert result['reason'] == "pulled model is not listed by the server"
@@ -0,0 +1,189 @@
+import time
+import pytest
+from unittest.mock import Mock
+
+from llm_deploy.reconciler import Reconciler, ollama_model_name
+from helpers import allocator_for, offer
+
+GB = 1024 ** 3
+
+def instance(instance_id, gpu_total_ram, dph_total, num_gpus=1):
+    return dict(offer(instance_id, gpu_total_ram, dph_total, num_gpus=num_gpus),
+                ollama_addr=f"http://10.0.0.{instance_id}:11434", disk_space=100, inet_down=800)
+
+def reconciler_for(models, instances, tags, offers=()):
+    allocator = allocator_for(models, list(offers), 'exact')
+    instance_manager = Mock(instances=Mock(return_value=instances), storage=Mock(get_instance=Mock(return_value={})))
+    # Rows like ModelManager.models
+    listing = lambda instances, timeout: [{'instance_id': instance['id'], 'name': name, 'size': 4 * GB}
+                                          for instance in instances for name in tags[instance['ollama_addr']]]
+    return Reconciler(allocator, instance_manager, Mock(per_host_limit=2, models=Mock(side_effect=listing)))
+
+def test_ollama_model_name():
+    assert ollama_model_name("mistral") == "mistral:latest"
+    assert ollama_model_name("mistral:7b-q4_0") == "mistral:7b-q4_0"
+
+def test_plan_keeps_warm_instance_and_applies_only_the_delta():
+    models = [
+        {'name': 'a', 'model': 'a:7b-q4_0', 'priority': 'low', 'size': 6 * 1024},
+        {'name': 'b', 'model': 'b:7b-q4_0', 'priority': 'low', 'size': 6 * 1024},
+    ]
+    running = [instance(1, 24 * 1024, 0.30)]
+    tags = {running[0]['ollama_addr']: ['a:7b-q4_0', 'old:7b-q4_0']}
+    reconciler = reconciler_for(models, running, tags)
+
+    plan = reconciler.plan()
+
+    assert [(a['action'], a['instance_id'], [m['model'] for m in a['models']]) for a in plan['actions']] == [
+        ('remove', 1, ['old:7b-q4_0']),
+        ('reuse', 1, ['a:7b-q4_0']),
+        ('pull', 1, ['b:7b-q4_0']),
+    ]
+    assert plan['cost'] == pytest.approx(plan['current_cost'])
+    assert reconciler.allocator.vast.get_available_offers.call_count == 0
+
+def test_plan_does_not_pull_onto_a_server_at_its_loaded_model_limit():
+    models = [
+        {'name': 'a', 'model': 'a:7b-q4_0', 'priority': 'low', 'size': 6 * 1024},
+        {'name': 'b', 'model': 'b:7b-q4_0', 'priority': 'low', 'size': 6 * 1024},
+    ]
+    running = [instance(1, 24 * 1024, 0.30)]
+    tags = {running[0]['ollama_addr']: ['a:7b-q4_0']}
+    reconciler = reconciler_for(models, running, tags, offers=[offer(7, 12 * 1024, 0.10)])
+    # Rented for a single model: a second one would make ollama evict the first
+    env = dict(reconciler.allocator.server.env(models[:1]))
+    reconciler.storage.get_instance = Mock(return_value={'server_env': env})
+    assert env['OLLAMA_MAX_LOADED_MODELS'] == '1'
+
+    plan = reconciler.plan()
+
+    assert [(a['action'], a.get('instance_id', a.get('machine_id')), [m['model'] for m in a['models']]) for a in plan['actions']] == [
+        ('reuse', 1, ['a:7b-q4_0']),
+        ('create', 7, ['b:7b-q4_0']),
+    ]
+
+def test_plan_destroys_idle_instances_and_rents_for_what_does_not_fit():
+    models = [{'name': 'big', 'model': 'big:34b-q4_0', 'priority': 'low', 'size': 20 * 1024}]
+    running = [instance(1, 12 * 1024, 0.10)]
+    tags = {running[0]['ollama_addr']: ['old:7b-q4_0']}
+    reconciler = reconciler_for(models, running, tags, offers=[offer(7, 24 * 1024, 0.25)])
+
+    plan = reconciler.plan()
+
+    assert [(a['action'], a.get('instance_id', a.get('machine_id'))) for a in plan['actions']] == [('destroy', 1), ('create', 7)]
+    assert plan['cost'] == pytest.approx(0.25)
+    assert plan['seconds'] > 0
+
+def test_plan_lists_the_fleet_at_once_and_leaves_unreachable_instances_as_is():
+    models = [{'name': 'a', 'model': 'a:7b-q4_0', 'priority': 'low', 'size': 6 * 1024}]
+    running = [instance(1, 24 * 1024, 0.30), instance(2, 24 * 1024, 0.30)]
+    reconciler = reconciler_for(models, running, {})
+    reconciler.model_manager.models = Mock(return_value=[
+        {'instance_id': 1, 'name': None, 'error': "unreachable: no answer within 10s"},
+        {'instance_id': 2, 'name': 'old:7b-q4_0', 'size': 4 * GB},
+    ])
+    reconciler.storage.get_instance = Mock(side_effect=lambda instance_id: {'models': ['a:7b-q4_0']} if instance_id == 1 else {})
+
+    plan = reconciler.plan()
+
+    reconciler.model_manager.models.assert_called_once_with(running, timeout=reconciler.list_timeout)
+    assert [(a['action'], a['instance_id']) for a in plan['actions']] == [('destroy', 2), ('reuse', 1)]
+
+def create_actions(*machine_ids):
+    return [{'action': 'create', 'machine_id': machine_id, 'cost': 0.1, 'seconds': 60,
+             'models': [{'model': f'm{machine_id}:7b-q4_0', 'size': 4096, 'download_size': 4000}]}
+            for machine_id in machine_ids]
+
+def provisioning_reconciler(boot_seconds, fail_boot=(), not_resident=()):
+    def boot(instance_id, public_ip):
+        time.sleep(boot_seconds[instance_id - 100])
+        return None if instance_id - 100 in fail_boot else f"http://10.0.0.{instance_id}:11434"
+
+    reconciler = reconciler_for([], [], {})
+    reconciler.instance_manager.rent = Mock(side_effect=lambda offer_id, disk_space, public_ip, env: offer_id + 100)
+    reconciler.instance_manager.boot = Mock(side_effect=boot)
+    reconciler.instance_manager.wait_for_ollama = Mock(return_value=True)
+    reconciler.model_manager.pull_model = Mock(side_effect=lambda model, instance_id, on_status, register: {
+        'model': model, 'instance_id': instance_id, 'ok': True, 'reason': None, 'bytes': 4 * GB, 'seconds': 0.01})
+    reconciler.model_manager.warm_model = Mock(side_effect=lambda model, instance_id, address, options: {
+        'model': model, 'instance_id': instance_id, 'ok': model not in not_resident, 'reason': "model is not resident after loading",
+        'load_seconds': 0.01, 'first_token_seconds': 0.02, 'seconds': 0.02, 'gpu_share': 1.0, 'expires_at': None})
+    reconciler.record_models = Mock()
+    return reconciler
+
+def test_provision_registers_models_while_other_machines_boot():
+    reconciler = provisioning_reconciler({1: 0.0, 2: 0.3, 3: 0.3})
+    registered = []
+    reconciler.model_manager.litellm.add_model = Mock(side_effect=lambda model, address, options: registered.append((model, time.monotonic())))
+
+    start = time.monotonic()
+    assert reconciler.provision(create_actions(1, 2, 3))
+    elapsed = time.monotonic() - start
+
+    assert elapsed < 0.6
+    assert len(registered) == 3
+    assert registered[0][0] == 'm1:7b-q4_0' and registered[0][1] - start < 0.2
+    assert reconciler.model_manager.pull_model.call_args.kwargs['register'] is False
+
+def test_provision_rolls_back_created_instances_on_failure():
+    reconciler = provisioning_reconciler({1: 0.0, 2: 0.1}, fail_boot={2})
+
+    assert not reconciler.provision(create_actions(1, 2))
+
+    reconciler.instance_manager.destroy_instances.assert_called_once()
+    assert sorted(reconciler.instance_manager.destroy_instances.call_args.args[0]) == [101, 102]
+
+def test_provision_registers_only_resident_models():
+    reconciler = provisioning_reconciler({1: 0.0, 2: 0.0}, not_resident={'m2:7b-q4_0'})
+
+    assert not reconciler.provision(create_actions(1, 2))
+
+    registered = [call.args[0] for call in reconciler.model_manager.litellm.add_model.call_args_list]
+    assert 'm2:7b-q4_0' not in registered
+
+def test_provision_rolls_back_only_rented_instances_when_vast_refuses():
+    reconciler = provisioning_reconciler({1: 0.0, 2: 0.0})
+    reconciler.instance_manager.rent = Mock(side_effect=lambda offer_id, disk_space, public_ip, env: None if offer_id == 2 else offer_id + 100)
+
+    assert not reconciler.provision(create_actions(1, 2))
+
+    reconciler.storage.save_allocation.assert_called_once()
+    assert reconciler.storage.save_allocation.call_args.args[0] == 101
+    assert reconciler.instance_manager.destroy_instances.call_args.args[0] == [101]
+
+def test_apply_finishes_with_one_litellm_reconcile_of_the_fleet():
+    reconciler = provisioning_reconciler({1: 0.0})
+    reconciler.storage.get_instance = Mock(return_value={'ollama_addr': "http://10.0.0.1:11434"})
+    litellm = reconciler.model_manager.litellm
+    litellm.reconcile = Mock(return_value={'added': [], 'removed': ['stale'], 'kept': 2, 'failed': []})
+    litellm.get_deployments = Mock(return_value=[])
+    litellm.missing = Mock(return_value=[])
+    reused = {'name': 'a', 'model': 'a:7b-q4_0', 'priority': 'low', 'size': 4096, 'num_ctx': 4096}
+    plan = {'actions': [{'action': 'reuse', 'instance_id': 1, 'models': [reused], 'cost': 0, 'seconds': 0}] + create_actions(1)}
+
+    assert reconciler.apply(plan)
+
+    litellm.reconcile.assert_called_once()
+    desired = sorted(litellm.reconcile.call_args.args[0])
+    assert desired == [('a:7b-q4_0', "http://10.0.0.1:11434", {'num_ctx': 4096}), ('m1:7b-q4_0', "http://10.0.0.101:11434", {'num_ctx': 8192})]
+    assert litellm.reconcile.call_args.kwargs['api_bases'] == {"http://10.0.0.1:11434", "http://10.0.0.101:11434"}
+
+def test_sync_reloads_reused_models_whose_options_changed():
+    reconciler = provisioning_reconciler({})
+    reconciler.storage.get_instance = Mock(side_effect=lambda instance_id: {'ollama_addr': f"http://10.0.0.{instance_id}:11434"})
+    litellm = reconciler.model_manager.litellm
+    litellm.get_deployments = Mock(return_value=['current'])
+    # a: unchanged, b: num_ctx changed and reloads, c: num_ctx changed but does not fit any more
+    litellm.missing = Mock(side_effect=lambda desired, deployments: [entry for entry in desired if entry[0] != 'a:7b-q4_0'])
+    litellm.reconcile = Mock(return_value={'added': [], 'removed': [], 'kept': 0, 'failed': []})
+    models = [{'name': name, 'model': f'{name}:7b-q4_0', 'priority': 'low', 'size': 4096, 'num_ctx': 16384} for name in 'abc']
+    plan = {'actions': [{'action': 'reuse', 'instance_id': 1, 'models': models, 'cost': 0, 'seconds': 0}]}
+    reconciler.model_manager.warm_model = Mock(side_effect=lambda model, instance_id, address, options: {
+        'ok': model != 'c:7b-q4_0', 'reason': "model is not resident after loading"})
+
+    reconciler.sync_deployments(plan)
+
+    assert [call.args for call in reconciler.model_manager.warm_model.call_args_list] == [
+        ('b:7b-q4_0', 1, "http://10.0.0.1:11434", {'num_ctx': 16384}), ('c:7b-q4_0', 1, "http://10.0.0.1:11434", {'num_ctx': 16384})]
+    assert [entry[0] for entry in litellm.reconcile.call_args.args[0]] == ['a:7b-q4_0', 'b:7b-q4_0']
+    assert litellm.reconcile.call_args.kwargs['deployments'] == ['current']
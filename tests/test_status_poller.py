@@ -0,0 +1,61 @@
+import threading
+import time
+from unittest.mock import Mock
+
+from llm_deploy.status_poller import InstanceStatusPoller
+
+RUNNING = {'actual_status': 'running', 'intended_status': 'running', 'cur_state': 'running'}
+LOADING = {'actual_status': 'loading', 'intended_status': 'running', 'cur_state': 'running'}
+
+class FakeVast:
+    """ Instances become running after a number of list calls each. """
+    def __init__(self, boot_ticks, errors=()):
+        self.boot_ticks = boot_ticks
+        self.errors = errors
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def list_instances(self):
+        with self.lock:
+            self.calls += 1
+            calls = self.calls
+        instances = []
+        for instance_id, ticks in self.boot_ticks.items():
+            status = RUNNING if calls >= ticks else LOADING
+            if instance_id in self.errors:
+                status = dict(LOADING, status_msg='Error: image pull failed')
+            instances.append(dict(status, id=instance_id))
+        return instances
+
+def test_one_list_call_per_tick_for_all_watchers():
+    vast = FakeVast({1: 2, 2: 3, 3: 4})
+    poller = InstanceStatusPoller(vast, min_interval=0.01, max_interval=0.05)
+
+    futures = [poller.watch(instance_id, timeout=5) for instance_id in (1, 2, 3)]
+
+    assert [future.result(timeout=5)['id'] for future in futures] == [1, 2, 3]
+    assert vast.calls == poller.ticks
+    assert vast.calls <= 6
+
+def test_error_and_deadline_resolve_with_none():
+    vast = FakeVast({1: 1000, 2: 1000}, errors={2})
+    poller = InstanceStatusPoller(vast, min_interval=0.01, max_interval=0.02)
+
+    start = time.monotonic()
+    assert poller.wait(2, timeout=5) is None
+    assert poller.wait(1, timeout=0.1) is None
+    assert time.monotonic() - start < 1
+
+def test_poller_does_not_touch_storage():
+    from llm_deploy.instance_manager import InstanceManager
+
+    vast = FakeVast({7: 1})
+    vast.list_instances = Mock(side_effect=lambda: [dict(RUNNING, id=7, public_ipaddr='1.2.3.4', ports={'11434/tcp': [{'HostPort': '4000'}]})])
+    storage = Mock()
+    manager = InstanceManager(vast, storage, Mock(), poller=InstanceStatusPoller(vast, min_interval=0.01))
+
+    instance, address = manager.monitor_instance_status(7, timeout=5)
+
+    assert address == "http://1.2.3.4:4000"
+    storage.sync_instances.assert_not_called()
+    storage.save_instance.assert_not_called()
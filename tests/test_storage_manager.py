@@ -0,0 +1,65 @@
+import json
+import multiprocessing
+import threading
+from llm_deploy.storage_manager import StorageManager
+
+def test_migrates_state_json(tmp_path):
+    legacy = tmp_path / "state.json"
+    legacy.write_text(json.dumps({
+        "1": {"ollama_addr": "http://host1", "models": ["a:7b"], "server_env": {"OLLAMA_NUM_PARALLEL": "2"}},
+        "2": {"ollama_addr": "", "note": "manual"},
+    }))
+
+    storage = StorageManager(tmp_path / "state.db", legacy)
+
+    assert not legacy.exists()
+    assert (tmp_path / "state.json.migrated").exists()
+    assert storage.get_instance(1) == {"ollama_addr": "http://host1", "models": ["a:7b"], "server_env": {"OLLAMA_NUM_PARALLEL": "2"}}
+    assert storage.get_instance("2") == {"ollama_addr": "", "note": "manual"}
+    assert storage.history()[0]['event'] == 'migrated'
+    # A second run finds nothing left to migrate
+    assert StorageManager(tmp_path / "state.db", legacy).get_instance(1)['models'] == ["a:7b"]
+
+def test_updates_are_row_level(tmp_path):
+    storage = StorageManager(tmp_path / "state.db", tmp_path / "state.json")
+    storage.sync_instances([1, 2])
+    storage.update_instance(1, ollama_addr="http://host1")
+    storage.update_instance(1, server_env={"OLLAMA_KV_CACHE_TYPE": "q8_0"})
+    storage.update_instance(1, models=["b:7b", "a:7b"])
+
+    assert storage.get_instance(1) == {"ollama_addr": "http://host1", "server_env": {"OLLAMA_KV_CACHE_TYPE": "q8_0"}, "models": ["a:7b", "b:7b"]}
+    assert storage.get_instance(2) == {"ollama_addr": ""}
+
+    storage.save_instance(1, {"ollama_addr": "http://other"})
+    assert storage.get_instance(1) == {"ollama_addr": "http://other"}
+
+    storage.save_allocation(1, [{"model": "a:7b", "name": "chat", "size": 4096}])
+    storage.sync_instances([2, 3])
+    assert storage.get_instance(1) is None
+    assert storage.get_allocation(1) == []
+    assert storage.get_instance(3) == {"ollama_addr": ""}
+    assert [entry['event'] for entry in storage.history(1)] == ['gone']
+
+def update_from_process(filename, legacy, instance_id, count):
+    storage = StorageManager(filename, legacy)
+    for i in range(count):
+        storage.update_instance(instance_id, models=[f"m{i}"])
+        storage.log_event(instance_id, 'pull')
+
+def test_concurrent_writers_do_not_lose_updates(tmp_path):
+    filename, legacy = str(tmp_path / "state.db"), str(tmp_path / "state.json")
+    storage = StorageManager(filename, legacy)
+
+    processes = [multiprocessing.Process(target=update_from_process, args=(filename, legacy, instance_id, 20)) for instance_id in (1, 2)]
+    threads = [threading.Thread(target=storage.update_instance, args=(3,), kwargs={'ollama_addr': 'http://host3'}),
+               threading.Thread(target=storage.update_instance, args=(3,), kwargs={'models': ['c:7b']})]
+    for worker in processes + threads:
+        worker.start()
+    for worker in processes + threads:
+        worker.join()
+
+    assert [process.exitcode for process in processes] == [0, 0]
+    assert storage.get_instance(1)['models'] == ["m19"]
+    assert storage.get_instance(2)['models'] == ["m19"]
+    assert storage.get_instance(3) == {"ollama_addr": "http://host3", "models": ["c:7b"]}
+    assert len(storage.history(limit=100)) == 40